@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# MDP Incident Monitor App
+
+"""Microbenchmarks for the hot paths: the settings parsers in config.py, MonitorWorker.work's keyword scanning on
+synthetic Caltrans-style pages (served by a local http.server, so no network is needed), scanner.py's throughput with
+1 process up to one per core, and Messenger throughput.
+
+From this directory:
+  python3 bench.py                              # everything, results as JSON on stdout
+  python3 bench.py --quick                      # smaller sizes
+  python3 bench.py --only worker --output new.json
+  python3 bench.py --save baseline.json         # keep results to compare against later
+  python3 bench.py --compare baseline.json      # exit status 1 if anything is more than --threshold slower
+
+Each result is the best of --repeat runs (the median is kept too); comparisons use the best.
+"""
+
+import argparse
+import concurrent.futures
+import http.server
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import threading
+import time
+
+import config
+import globs
+from matcher import KeywordMatcher
+from messenger import Messenger
+from pool import MonitorWorker, UrlState
+from scanner import ScanPool
+
+PAGE_SIZES = [10 * 1024, 1024 * 1024, 10 * 1024 * 1024]
+KEYWORD_COUNTS = [10, 500, 5000]
+QUICK_PAGE_SIZES = [10 * 1024, 1024 * 1024]
+QUICK_KEYWORD_COUNTS = [10, 500]
+SETTINGS_SIZES = [10 * 1024, 100 * 1024]
+MESSAGE_COUNT = 100000
+MESSAGE_URLS = 50
+SCAN_PAGES = 32
+# ^ 1 MB pages scanned at once by bench_scanner, spread over the processes
+REPEAT = 3
+THRESHOLD = 0.2
+# ^ fraction slower than the baseline that counts as a regression
+NEG_FRACTION = 0.2
+# ^ fraction of the keywords that are ^negative
+
+_ROADS = ["SR 243", "SR 74", "SR 371", "I 10", "I 215", "SR 111"]
+_PLACES = ["Idyllwild", "Mountain Center", "Banning", "Hemet", "Pine Cove", "Anza", "Palm Desert", "Lake Hemet",
+           "Garner Valley", "Keen Camp", "Valle Vista", "Paradise Corner"]
+_EVENTS = ["IS CLOSED", "ONE WAY TRAFFIC CONTROL", "CHAINS ARE REQUIRED", "SHOULDER WORK", "ROCK SLIDE",
+           "IS OPEN", "CONSTRUCTION"]
+
+# Pages
+
+def make_page(size, seed=0):
+    # ^ roughly size bytes of road-report-looking html
+    rand = random.Random(seed)
+    lines = ["<html><head><title>Highway Conditions</title></head><body><pre>"]
+    length = len(lines[0])
+    while length < size:
+        road = rand.choice(_ROADS)
+        line = (road + " [IN THE SOUTHERN CALIFORNIA AREA & MOUNTAINS] " + rand.choice(_EVENTS) + " FROM "
+                + rand.choice(_PLACES) + " TO " + rand.choice(_PLACES) + " (RIVERSIDE CO) - FOR "
+                + str(rand.randint(1, 99)) + " MI - 24 HRS A DAY")
+        lines.append(line)
+        length = length + len(line) + 1
+    lines.append("NO TRAFFIC RESTRICTIONS ARE REPORTED FOR THIS AREA.")
+    lines.append("</pre></body></html>")
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+def make_keywords(count, seed=0):
+    # ^ mostly words that aren't on the page, a few that are, NEG_FRACTION of them negative
+    rand = random.Random(seed)
+    keywords = []
+    neg_count = int(count * NEG_FRACTION)
+    for keyword_count in range(count - neg_count):
+        if keyword_count < 3:
+            keywords.append(_PLACES[keyword_count + 9])
+        else:
+            keywords.append("Canyon " + str(rand.randint(0, 10 ** 6)) + " Rd")
+    for keyword_count in range(neg_count):
+        keywords.append("^Closure " + str(rand.randint(0, 10 ** 6)))
+    if neg_count:
+        keywords[-1] = "^NO TRAFFIC RESTRICTIONS ARE REPORTED FOR THIS AREA."
+    return keywords
+
+def make_settings(size, seed=0):
+    # ^ a settings "keywords=" value of about size characters, ; between urls every 50 keywords
+    rand = random.Random(seed)
+    parts = []
+    length = 0
+    while length < size:
+        keyword = rand.choice(_PLACES)
+        if rand.random() < NEG_FRACTION:
+            keyword = "^" + keyword
+        separator = "; " if len(parts) % 50 == 49 else ", "
+        parts.append(keyword + separator)
+        length = length + len(keyword) + 2
+    return "".join(parts)[:-2]
+
+class PageServer():
+    # Local stand-in for the Caltrans site: serves registered pages from memory, no caching headers.
+    def __init__(self):
+        pages = {}
+        self.pages = pages
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+            # ^ headers and body are written separately; with Nagle on, a kept-alive client waits out its delayed
+            #   ACK (~40 ms) for the body, which real web servers don't make it do
+
+            def do_GET(self):
+                body = pages.get(self.path, b"")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def add(self, path, body):
+        self.pages[path] = body
+        return "http://127.0.0.1:" + str(self.server.server_port) + path
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+# Timing
+
+def measure(name, params, func, repeat, size=None):
+    # ^ runs func repeat times; size (bytes handled per run), if given, adds a throughput figure
+    times = []
+    for run in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    result = dict(name=name, params=params, runs=repeat, best=min(times), median=statistics.median(times))
+    if size:
+        result["mb_per_s"] = size / min(times) / (1024 * 1024)
+    print(name + " " + json.dumps(params) + ": " + "%.4f" % result["best"] + " s", file=sys.stderr)
+    return result
+
+# Benchmarks
+
+def bench_parser(args):
+    results = []
+    sizes = SETTINGS_SIZES[:1] if args.quick else SETTINGS_SIZES
+    for size in sizes:
+        keyword_settings = make_settings(size)
+        url_settings = ", ".join("http://www.dot.ca.gov/hq/roadinfo/display.php?page=sr" + str(number)
+                                 for number in range(size // 60))
+        results.append(measure("parse_urls", dict(size=size), lambda: config.parse_urls(url_settings),
+                               args.repeat, size))
+        results.append(measure("parse_keywords", dict(size=size), lambda: config.parse_keywords(keyword_settings),
+                               args.repeat, size))
+    return results
+
+def bench_matcher(args):
+    results = []
+    counts = QUICK_KEYWORD_COUNTS if args.quick else KEYWORD_COUNTS
+    for count in counts:
+        keywords = make_keywords(count)
+        results.append(measure("matcher_compile", dict(keywords=count), lambda: KeywordMatcher(keywords),
+                               args.repeat))
+    return results
+
+def bench_worker(args):
+    results = []
+    page_server = PageServer()
+    sizes = QUICK_PAGE_SIZES if args.quick else PAGE_SIZES
+    counts = QUICK_KEYWORD_COUNTS if args.quick else KEYWORD_COUNTS
+
+    try:
+        for size in sizes:
+            page = make_page(size)
+            url = page_server.add("/page" + str(size), page)
+            changed_url = page_server.add("/changed" + str(size), page.replace(b"</pre>", b"Hemet IS CLOSED\n</pre>"))
+
+            for count in counts:
+                matcher = KeywordMatcher(make_keywords(count))
+                params = dict(page_size=size, keywords=count)
+
+                # whole page, every line scanned
+                for stream, incremental in [(False, False), (True, True)]:
+                    def full_scan():
+                        MonitorWorker(url, matcher, None, UrlState(), stream, incremental).work()
+                    mode_params = dict(params, stream=stream, incremental=incremental)
+                    results.append(measure("worker_scan", mode_params, full_scan, args.repeat, len(page)))
+
+                # one new line since last cycle; incremental only scans that
+                prev_state = MonitorWorker(url, matcher, None, UrlState(), True, True).work()
+                def rescan():
+                    MonitorWorker(changed_url, matcher, None, prev_state, True, True).work()
+                results.append(measure("worker_rescan", params, rescan, args.repeat, len(page)))
+    finally:
+        page_server.close()
+    return results
+
+def bench_scanner(args):
+    # scan throughput of scanner.py with 1, 2, 4 ... processes, up to the number of cores; ideally it scales linearly
+    pages = SCAN_PAGES // 4 if args.quick else SCAN_PAGES
+    body = make_page(1024 * 1024)
+    matcher = KeywordMatcher(make_keywords(500))
+    counts = []
+    processes = 1
+    while processes < (os.cpu_count() or 1):
+        counts.append(processes)
+        processes = processes * 2
+    counts.append(os.cpu_count() or 1)
+
+    results = []
+    for processes in counts:
+        scan_pool = ScanPool(processes, [matcher])
+        try:
+            # start the processes (and compile their matchers) before timing
+            for process_count in range(processes):
+                scan_pool.scan(matcher, b"")
+
+            def scan_all():
+                with concurrent.futures.ThreadPoolExecutor(max_workers=processes) as executor:
+                    list(executor.map(lambda page: scan_pool.scan(matcher, body), range(pages)))
+            results.append(measure("scanner", dict(processes=processes, pages=pages), scan_all, args.repeat,
+                                   len(body) * pages))
+        finally:
+            scan_pool.shutdown()
+    return results
+
+def bench_messenger(args):
+    # messenger_queue / messenger_drain: statuses for MESSAGE_URLS urls, each url's differing from its last so none
+    # fold (the queue's cap raised to hold them all); messenger_fold: one url's "no change" over and over, drained
+    # every 100 as the UI does, so nearly all of them fold
+    count = MESSAGE_COUNT // 10 if args.quick else MESSAGE_COUNT
+    messenger = Messenger([])
+    urls = ["http://www.dot.ca.gov/hq/roadinfo/display.php?page=sr" + str(url_count) for url_count in
+            range(MESSAGE_URLS)]
+    statuses = []
+    for url in urls:
+        statuses.append([(url, "no change"), (url, "no incident"), (["CLOSED", url], "ongoing"),
+                         (["CLOSED", url], "incident cleared")])
+
+    def queue_messages():
+        for message_count in range(count):
+            info, action = statuses[message_count % MESSAGE_URLS][(message_count // MESSAGE_URLS) % 4]
+            messenger.queue_message(info, action)
+
+    def drain():
+        while Messenger.get_messages(100):
+            pass
+
+    def queue_folded():
+        for message_count in range(count):
+            messenger.queue_message(urls[0], "no change")
+            if message_count % 100 == 99:
+                Messenger.get_messages(100)
+        drain()
+
+    results = []
+    Messenger.configure(count)
+    for run in range(args.repeat):
+        Messenger.clear_queue()
+        queue_time = time.perf_counter()
+        queue_messages()
+        queue_time = time.perf_counter() - queue_time
+        drain_time = time.perf_counter()
+        drain()
+        drain_time = time.perf_counter() - drain_time
+        Messenger.clear_queue()
+        fold_time = time.perf_counter()
+        queue_folded()
+        fold_time = time.perf_counter() - fold_time
+        results.append((queue_time, drain_time, fold_time))
+
+    Messenger.configure()
+    Messenger.clear_queue()
+    summary = []
+    for name, index, url_total in [("messenger_queue", 0, MESSAGE_URLS), ("messenger_drain", 1, MESSAGE_URLS),
+                                   ("messenger_fold", 2, 1)]:
+        times = [result[index] for result in results]
+        summary.append(dict(name=name, params=dict(messages=count, urls=url_total), runs=args.repeat,
+                            best=min(times), median=statistics.median(times), messages_per_s=count / min(times)))
+        print(name + ": " + "%.4f" % min(times) + " s", file=sys.stderr)
+    return summary
+
+BENCHMARKS = dict(parser=bench_parser, matcher=bench_matcher, worker=bench_worker, messenger=bench_messenger,
+                  scanner=bench_scanner)
+
+# Baselines
+
+def result_key(result):
+    return result["name"] + " " + json.dumps(result["params"], sort_keys=True)
+
+def compare(results, baseline, threshold):
+    # ^ returns the results that got more than threshold slower than in the baseline
+    baseline_times = {}
+    for result in baseline["results"]:
+        baseline_times[result_key(result)] = result["best"]
+
+    regressions = []
+    for result in results:
+        key = result_key(result)
+        if key not in baseline_times:
+            continue
+        change = result["best"] / baseline_times[key] - 1
+        print("%+7.1f%%  " % (change * 100) + key, file=sys.stderr)
+        if change > threshold:
+            regressions.append(dict(key=key, baseline=baseline_times[key], best=result["best"], change=change))
+    return regressions
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="bench", description="MDP monitor microbenchmarks.")
+    parser.add_argument("--only", choices=sorted(BENCHMARKS), action="append", help="run just these benchmarks")
+    parser.add_argument("--quick", action="store_true", help="smaller pages / keyword lists / counts")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="runs per measurement (best is kept)")
+    parser.add_argument("--output", help="write results here instead of stdout")
+    parser.add_argument("--save", help="also save results as a baseline file")
+    parser.add_argument("--compare", help="baseline file to compare against")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="slowdown counted as a regression")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    globs.init()
+
+    results = []
+    for name in args.only or sorted(BENCHMARKS):
+        results.extend(BENCHMARKS[name](args))
+
+    report = dict(python=platform.python_version(), machine=platform.machine(), quick=args.quick, results=results)
+    status = 0
+    if args.compare:
+        with open(args.compare, 'r', encoding="utf-8") as file:
+            baseline = json.load(file)
+        report["regressions"] = compare(results, baseline, args.threshold)
+        if report["regressions"]:
+            status = 1
+
+    output = json.dumps(report, indent=1)
+    if args.output:
+        with open(args.output, 'w', encoding="utf-8") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+    if args.save:
+        with open(args.save, 'w', encoding="utf-8") as file:
+            file.write(output + "\n")
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
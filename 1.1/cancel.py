@@ -0,0 +1,168 @@
+# MDP Incident Monitor App
+
+"""Cooperative cancellation for the monitor, in place of polling a global flag: a CancelToken is handed down from
+monitorapp.py / monitord.py to the pool, and from the pool to the scheduler, each cycle's workers, the fetcher, the
+scanning processes and the notifier.
+
+  cancelled()       polled in loops (cheap: a flag and a clock read)
+  wait(seconds)     sleeps, but wakes as soon as the token is cancelled
+  timeout(limit)    a per-operation timeout, cut short to what's left before the token's deadline
+  on_cancel(fn)     fn is called when the token is cancelled, e.g. to shut down a socket a thread is blocked on
+
+child(timeout) makes a token cancelled with its parent or at its own deadline (whichever comes first); the pool gives
+each cycle one, so a slow site can't hold the cycle (or a stop) up past it.
+"""
+
+import socket
+import threading
+import time
+
+from messenger import Messenger
+
+MIN_TIMEOUT = 0.001
+# ^ timeout() never returns 0 (which would make a socket non-blocking)
+
+class Cancelled(Exception):
+    pass
+
+class CancelToken():
+    # Thread-safe; a token and its children share one condition, which wait() sleeps on.
+    def __init__(self, timeout=None, parent=None):
+        # ^ timeout: seconds until the token cancels itself
+        self.parent = parent
+        self.deadline = None
+        # ^ time.monotonic() at which it's cancelled, if it has one (its own or a parent's, whichever is sooner)
+        if timeout is not None:
+            self.deadline = time.monotonic() + timeout
+        if parent is not None and parent.deadline is not None:
+            if self.deadline is None or parent.deadline < self.deadline:
+                self.deadline = parent.deadline
+        if parent is not None:
+            self._condition = parent._condition
+        else:
+            self._condition = threading.Condition()
+        self._cancelled = False
+        self._callbacks = []
+        self._children = []
+        self._timer = None
+        if timeout is not None:
+            # fires the callbacks at the deadline, rather than whenever something next polls
+            self._timer = threading.Timer(max(timeout, 0), self.cancel)
+            self._timer.daemon = True
+            self._timer.start()
+        if parent is not None:
+            parent.adopt(self)
+
+    def child(self, timeout=None):
+        return CancelToken(timeout, self)
+
+    def adopt(self, child):
+        with self._condition:
+            if not self._cancelled:
+                self._children.append(child)
+                return
+        child.cancel()
+
+    def cancel(self):
+        with self._condition:
+            if self._cancelled:
+                return
+            self._cancelled = True
+            callbacks = self._callbacks
+            children = self._children
+            self._callbacks = []
+            self._children = []
+            self._condition.notify_all()
+        if self._timer is not None:
+            self._timer.cancel()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as error:
+                Messenger([]).queue_message("couldn't cancel: " + str(error), "error")
+        for child in children:
+            child.cancel()
+
+    def close(self):
+        # ^ done with the token (e.g. the cycle it was for has finished): drops its callbacks and its timer, and its
+        #   parent lets go of it
+        if self._timer is not None:
+            self._timer.cancel()
+        with self._condition:
+            self._callbacks = []
+            if self.parent is not None and self in self.parent._children:
+                self.parent._children.remove(self)
+
+    def cancelled(self):
+        return self._cancelled or (self.deadline is not None and time.monotonic() >= self.deadline)
+
+    def check(self):
+        # ^ raises Cancelled if the token has been cancelled
+        if self.cancelled():
+            raise Cancelled()
+
+    def remaining(self):
+        # ^ seconds until the deadline, or None if there isn't one
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0)
+
+    def timeout(self, limit=None):
+        # ^ limit (seconds, or None for no limit) cut short to the time remaining; raises Cancelled if there's none
+        self.check()
+        remaining = self.remaining()
+        if remaining is None:
+            return limit
+        if limit is not None:
+            remaining = min(remaining, limit)
+        return max(remaining, MIN_TIMEOUT)
+
+    def wait(self, timeout=None, until=None):
+        # ^ sleeps until the token is cancelled, until() is true (checked whenever notify() is called) or timeout
+        #   passes; returns whether it was cancelled
+        end = None
+        if timeout is not None:
+            end = time.monotonic() + timeout
+        with self._condition:
+            while not self.cancelled():
+                if until is not None and until():
+                    break
+                wait_time = self.remaining()
+                if end is not None:
+                    left = end - time.monotonic()
+                    if left <= 0:
+                        break
+                    if wait_time is None or left < wait_time:
+                        wait_time = left
+                self._condition.wait(wait_time)
+        return self.cancelled()
+
+    def notify(self):
+        # ^ wakes wait()s, to check their until() again
+        with self._condition:
+            self._condition.notify_all()
+
+    def on_cancel(self, callback):
+        # ^ callback is called (once, from the cancelling thread) when the token is cancelled; straight away if it
+        #   already has been. Returns callback, for remove_callback()
+        with self._condition:
+            if not self._cancelled:
+                self._callbacks.append(callback)
+                return callback
+        callback()
+        return callback
+
+    def remove_callback(self, callback):
+        with self._condition:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+def shutdown_socket(sock):
+    # ^ an on_cancel callback for a socket another thread may be blocked reading / writing: shutting it down (rather
+    #   than just closing it) wakes that thread, with an error
+    if sock is None:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
@@ -0,0 +1,265 @@
+# MDP Incident Monitor App
+
+"""Reading settings.txt and turning it into what pool.py needs (the urls, a keyword matcher per url). Nothing here
+touches tkinter, so monitorapp.py and the headless monitord.py both use it.
+
+load_config() compiles the settings into a MonitorConfig (urls, matchers, per-url frequencies and which parts of each
+page are scanned, none of which change once it's built), plus any named profiles: further sets of urls / keywords /
+frequencies / regions with their own email recipient, given by "profile.NAME.FIELD=" lines, e.g.
+  profile.snow.urls=https://a, https://b
+  profile.snow.keywords=chains, closed; snow
+  profile.snow.recipient=roads@example.com
+The pool fetches a url the profiles share once and scans it with each profile's keywords. How incidents are emailed
+comes from "smtp_host=HOST[:PORT]", "smtp_tls=False" (e.g. for a local debugging server) and "digest_window=SECONDS"
+lines, read when the monitor starts.
+
+ConfigWatcher checks the file's mtime and compiles a new one when it has been edited, which the pool swaps in between
+cycles, so changing the urls / keywords doesn't need the monitor restarting.
+"""
+
+import collections
+import os
+import re
+
+from extract import parse_regions
+from matcher import KeywordMatcher
+from messenger import Messenger
+from notifier import DIGEST_WINDOW, SMTP_HOST, SMTP_PORT
+
+_PATH = os.path.dirname(os.path.realpath(__file__))
+SETTINGS_PATH = os.path.join(_PATH, "settings.txt")
+
+EmailSettings = collections.namedtuple("EmailSettings", ["host", "port", "use_tls", "digest_window"])
+# ^ the notifier.py Notifier's SMTP server and digest window (seconds; 0 to email every incident straight away)
+DEFAULT_EMAIL = EmailSettings(SMTP_HOST, SMTP_PORT, True, DIGEST_WINDOW)
+MonitorConfig = collections.namedtuple("MonitorConfig", ["urls", "matchers", "frequencies", "username", "password",
+                                                         "regions", "profiles", "email"], defaults=[DEFAULT_EMAIL])
+# ^ urls, matchers, frequencies (minutes) and regions are tuples, one entry per url; a url's regions are None if its
+#   raw HTML is scanned, else what extract.py keeps of the page (empty for all its text); profiles: a tuple of Profile;
+#   email: EmailSettings
+Profile = collections.namedtuple("Profile", ["name", "urls", "matchers", "frequencies", "regions", "recipient"])
+# ^ the same per-url tuples, for a named profile; recipient: email address ("" for the account's own)
+PROFILE_FIELDS = ("urls", "keywords", "frequencies", "regions", "recipient")
+
+def new_settings():
+    return dict(is_running="False", urls="", keywords="", username="", password="", frequency = "", duration = "")
+
+def load_settings(path=SETTINGS_PATH):
+    # ^ one pass over the file; each "key=value" line sets settings[key] (keys the app doesn't know, e.g.
+    #   frequencies=, are kept too)
+    settings = new_settings()
+
+    with open(path, 'r', encoding="utf-8") as file:
+        for line in file:
+            key, separator, value = line.partition("=")
+            if separator:
+                settings[key.strip()] = remove_line_breaks(value)
+
+    return settings
+
+def load_config(path=SETTINGS_PATH, frequency=5, matcher_cache=None):
+    return compile_config(load_settings(path), frequency, matcher_cache)
+
+def compile_config(settings, frequency=5, matcher_cache=None):
+    # ^ frequency (minutes): for urls not given one by a frequencies= line; matcher_cache: keywords tuple ->
+    #   KeywordMatcher, reused rather than compiled again
+    urls = parse_urls(settings["urls"])
+    keywords = parse_keywords(settings["keywords"])
+    matchers = build_matchers(urls, keywords, matcher_cache)
+    frequencies = parse_frequencies(settings.get("frequencies", ""), len(urls), frequency)
+    regions = parse_url_regions(settings.get("regions", ""), len(urls), settings.get("extract", "") == "True")
+    profiles = parse_profiles(settings, frequency, matcher_cache)
+    return MonitorConfig(tuple(urls), tuple(matchers), tuple(frequencies), settings["username"], settings["password"],
+                         tuple(regions), tuple(profiles), parse_email(settings))
+
+def parse_profiles(settings, frequency=5, matcher_cache=None):
+    # ^ the named profiles in settings ("profile.NAME.FIELD" keys), in the order they first appear; "extract=True"
+    #   applies to them too
+    fields = {}
+    for key, value in settings.items():
+        parts = key.split(".")
+        if len(parts) == 3 and parts[0] == "profile" and parts[1] and parts[2] in PROFILE_FIELDS:
+            fields.setdefault(parts[1], {})[parts[2]] = value
+
+    profiles = []
+    for name, profile_settings in fields.items():
+        urls = parse_urls(profile_settings.get("urls", ""))
+        keywords = parse_keywords(profile_settings.get("keywords", ""))
+        matchers = build_matchers(urls, keywords, matcher_cache)
+        frequencies = parse_frequencies(profile_settings.get("frequencies", ""), len(urls), frequency)
+        regions = parse_url_regions(profile_settings.get("regions", ""), len(urls),
+                                    settings.get("extract", "") == "True")
+        profiles.append(Profile(name, tuple(urls), tuple(matchers), tuple(frequencies), tuple(regions),
+                                profile_settings.get("recipient", "").strip()))
+    return profiles
+
+def parse_urls(url_settings):
+    urls = []
+    new_url = []
+    prev_char = ''
+
+    if url_settings:
+        for char in url_settings:
+            if char == ',':
+                prev_char = char
+            elif prev_char == ',' and char == ' ':
+                urls.append("".join(new_url))
+                new_url = []
+            elif char == ' ':
+                continue
+            else:
+                new_url.append(char)
+            prev_char = char
+
+    urls.append("".join(new_url))
+    return urls
+
+def parse_keywords(keyword_settings):
+    # ^ returns a list of keywords per url (urls separated by ; in the settings)
+    def invert_keyword(keyword):
+        # negative keywords keep their ^; matcher.py treats them as text that must be absent from the page
+        return "^" + keyword
+
+    keywords = [[]]
+    new_keyword = []
+    prev_char = ''
+    is_inv_keyword = False
+    count = 0
+
+    if keyword_settings:
+        for char in keyword_settings:
+            if char == '^':
+                if count == 0 or count == 1:
+                    is_inv_keyword = True
+                    prev_char = char
+
+            elif char == ',' or char == ';':
+                prev_char = char
+            elif (prev_char == ',' or prev_char == ';') and (char == ' '):
+                if is_inv_keyword:
+                    keywords[-1].append(invert_keyword("".join(new_keyword)))
+                    is_inv_keyword = False
+                else:
+                    keywords[-1].append("".join(new_keyword))
+                new_keyword = []
+                count = 0
+                if prev_char == ';':
+                    keywords.append([])
+
+            else:
+                new_keyword.append(char)
+                prev_char = char
+
+            count = count + 1
+
+        if is_inv_keyword:
+            keywords[-1].append(invert_keyword("".join(new_keyword)))
+        else:
+            keywords[-1].append("".join(new_keyword))
+
+    return keywords
+
+def parse_frequencies(frequency_settings, url_total, frequency):
+    # ^ minutes per url from a "frequencies=5, 10, 60" line; blank / missing entries get frequency
+    frequencies = [float(frequency)] * url_total
+    url_count = 0
+    for entry in frequency_settings.split(","):
+        entry = entry.strip()
+        if url_count >= url_total:
+            break
+        if entry:
+            frequencies[url_count] = float(entry)
+        url_count = url_count + 1
+    return frequencies
+
+def parse_email(settings):
+    # ^ EmailSettings from the "smtp_host=HOST[:PORT]", "smtp_tls=" and "digest_window=" lines; missing ones keep
+    #   DEFAULT_EMAIL's
+    host = settings.get("smtp_host", "").strip()
+    port = DEFAULT_EMAIL.port
+    if not host:
+        host = DEFAULT_EMAIL.host
+    elif ":" in host:
+        host, separator, port_text = host.rpartition(":")
+        port = int(port_text)
+    use_tls = settings.get("smtp_tls", "").strip() != "False"
+    digest_window = DEFAULT_EMAIL.digest_window
+    if settings.get("digest_window", "").strip():
+        digest_window = float(settings["digest_window"])
+        if digest_window < 0:
+            raise ValueError("digest_window is negative: " + settings["digest_window"])
+    return EmailSettings(host, port, use_tls, digest_window)
+
+def parse_url_regions(region_settings, url_total, extract=False):
+    # ^ from a "regions=#incidents; ; start..end" line (urls separated by ;, like the keywords): a url with regions
+    #   has only them scanned, as text; the rest have all their text scanned if extract (an "extract=True" line),
+    #   otherwise their raw HTML
+    regions = [()] * url_total if extract else [None] * url_total
+    entries = region_settings.split(";") if region_settings.strip() else []
+    for url_count in range(min(len(entries), url_total)):
+        url_regions = parse_regions(entries[url_count])
+        if url_regions:
+            regions[url_count] = url_regions
+    return regions
+
+def build_matchers(urls, keywords, matcher_cache=None):
+    # ^ compiled once, then reused by the pool every cycle; urls past the last ; get no keywords
+    matchers = []
+    for url_count in range(len(urls)):
+        url_keywords = []
+        if url_count < len(keywords):
+            url_keywords = keywords[url_count]
+        key = tuple(url_keywords)
+        if matcher_cache is not None and key in matcher_cache:
+            matchers.append(matcher_cache[key])
+        else:
+            matchers.append(KeywordMatcher(url_keywords))
+    return matchers
+
+def remove_line_breaks(settings):
+    return settings.replace("\n", "").replace("\r", "")
+
+class ConfigWatcher():
+    # Notices when the settings file has been saved (by its mtime and size) and compiles it again. Matchers whose
+    # keywords haven't changed are carried over from the current config, so only edited urls are recompiled.
+    def __init__(self, path=SETTINGS_PATH, frequency=5, current=None):
+        self.path = path
+        self.frequency = frequency
+        self.current = current
+        self._stamp = self.stamp()
+
+    def stamp(self):
+        try:
+            status = os.stat(self.path)
+        except OSError:
+            return None
+        return (status.st_mtime_ns, status.st_size)
+
+    def poll(self):
+        # ^ returns the new MonitorConfig if the file has changed (and still parses), otherwise None
+        stamp = self.stamp()
+        if stamp is None or stamp == self._stamp:
+            return None
+
+        matcher_cache = {}
+        if self.current is not None:
+            for matcher in self.current.matchers:
+                matcher_cache[tuple(matcher.keywords)] = matcher
+            for profile in self.current.profiles:
+                for matcher in profile.matchers:
+                    matcher_cache[tuple(matcher.keywords)] = matcher
+        try:
+            new_config = load_config(self.path, self.frequency, matcher_cache)
+        except (OSError, ValueError, re.error) as error:
+            Messenger([]).queue_message("couldn't reload settings: " + str(error), "error")
+            self._stamp = stamp
+            return None
+
+        if self.stamp() != stamp:
+            # saved again while being read; try again next time
+            return None
+        self._stamp = stamp
+        if new_config == self.current:
+            return None
+        self.current = new_config
+        return new_config
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# MDP Incident Monitor App
+
+"""Recorded pages, for trying keyword / matcher changes offline against what the monitor actually fetched, instead of
+against the live sites.
+
+Capturing: given a CorpusWriter (monitord's --capture), the pool stores every response it gets (url, time, status,
+headers and body; a 304's body is empty) in a SQLite file, like state.db. Bodies are kept zlib-compressed and only
+once each, by digest, since most fetches of a page bring back what the last one did; months of polling stay small.
+
+Replaying: each url's responses are handed, in the order they were fetched, to a MonitorWorker (with the settings'
+keywords and regions) through a ReplayFetcher standing in for the network, with no waiting between cycles; the
+incidents it would have reported come out with the time of the response that caused them, then the throughput. Urls
+are independent of each other, so --processes replays them in parallel. From this directory:
+  python3 -m corpus [--db PATH]                                                  # what's in the corpus
+  python3 -m corpus --replay [--settings PATH] [--url URL] [--since YYYY-MM-DD] [--until YYYY-MM-DD] [--processes N]
+"""
+
+import argparse
+import concurrent.futures
+import datetime
+import email.message
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+
+import config
+from matcher import KeywordMatcher
+from pool import INCREMENTAL, STREAM, MonitorWorker, UrlState
+
+_PATH = os.path.dirname(os.path.realpath(__file__))
+CORPUS_PATH = os.path.join(_PATH, "corpus.db")
+COMPRESSION_LEVEL = 6
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS bodies (
+    digest TEXT PRIMARY KEY,
+    size INTEGER,
+    body BLOB
+);
+CREATE TABLE IF NOT EXISTS fetches (
+    id INTEGER PRIMARY KEY,
+    url TEXT,
+    time REAL,
+    status INTEGER,
+    headers TEXT,
+    digest TEXT
+);
+CREATE INDEX IF NOT EXISTS fetches_url_time ON fetches (url, time);
+"""
+
+class CorpusWriter():
+    # Thread-safe (the pool's fetching threads add to it); writes go into an open transaction until commit(), which the
+    # pool calls once per cycle.
+    def __init__(self, path=CORPUS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(_SCHEMA)
+        self.connection.commit()
+
+    def add(self, url, when, status, headers, body=None, digest=None):
+        # ^ headers: (name, value) pairs; body: None for a 304; digest: body's sha256 hexdigest, if already worked out
+        if body is not None and digest is None:
+            digest = hashlib.sha256(body).hexdigest()
+        with self._lock:
+            if body is not None:
+                self.connection.execute("INSERT OR IGNORE INTO bodies (digest, size, body) VALUES (?, ?, ?)",
+                                        (digest, len(body), zlib.compress(body, COMPRESSION_LEVEL)))
+            self.connection.execute("INSERT INTO fetches (url, time, status, headers, digest) VALUES (?, ?, ?, ?, ?)",
+                                    (url, when, status, json.dumps(list(headers)), digest))
+
+    def commit(self):
+        with self._lock:
+            self.connection.commit()
+
+    def close(self):
+        with self._lock:
+            self.connection.commit()
+            self.connection.close()
+
+class CorpusReader():
+    def __init__(self, path=CORPUS_PATH):
+        self.connection = sqlite3.connect("file:" + path + "?mode=ro", uri=True)
+
+    def urls(self, since=None, until=None):
+        # ^ (url, fetches) for each url fetched in the time range
+        query, parameters = CorpusReader.time_range("SELECT url, COUNT(*) FROM fetches", since, until)
+        return self.connection.execute(query + " GROUP BY url ORDER BY url", parameters).fetchall()
+
+    def fetches(self, url, since=None, until=None):
+        # ^ yields url's recorded responses, oldest first, as (time, status, headers, body); body is None for a 304
+        query, parameters = CorpusReader.time_range("SELECT fetches.time, fetches.status, fetches.headers, "
+                                                    "bodies.body FROM fetches LEFT JOIN bodies "
+                                                    "ON bodies.digest = fetches.digest", since, until, [url])
+        for when, status, headers, body in self.connection.execute(query + " ORDER BY fetches.time, fetches.id",
+                                                                   parameters):
+            if body is not None:
+                body = zlib.decompress(body)
+            yield when, status, json.loads(headers), body
+
+    def sizes(self):
+        # ^ (fetches, distinct bodies, their total size, their stored (compressed) size)
+        fetch_total = self.connection.execute("SELECT COUNT(*) FROM fetches").fetchone()[0]
+        body_total, size, stored = self.connection.execute("SELECT COUNT(*), TOTAL(size), TOTAL(LENGTH(body)) "
+                                                           "FROM bodies").fetchone()
+        return fetch_total, body_total, int(size), int(stored)
+
+    def close(self):
+        self.connection.close()
+
+    def time_range(query, since, until, parameters=None):
+        # ^ query restricted to fetches in [since, until) (time.time() values, or None), and to parameters[0]'s url if
+        #   given; returns (query, parameters)
+        conditions = []
+        parameters = list(parameters or [])
+        if parameters:
+            conditions.append("fetches.url = ?")
+        if since is not None:
+            conditions.append("fetches.time >= ?")
+            parameters.append(since)
+        if until is not None:
+            conditions.append("fetches.time < ?")
+            parameters.append(until)
+        if conditions:
+            query = query + " WHERE " + " AND ".join(conditions)
+        return query, parameters
+
+class ReplayFetcher():
+    # Stands in for fetch.Fetcher: each fetch() gets the next recorded response, whatever the request's headers.
+    def __init__(self, responses):
+        # ^ responses: (time, status, headers, body), as CorpusReader.fetches() gives them
+        self.responses = iter(responses)
+
+    def fetch(self, url, headers=None, cancel=None):
+        when, status, response_headers, body = next(self.responses)
+        return ReplayResponse(status, response_headers, body)
+
+class ReplayResponse():
+    # Just what MonitorWorker uses of a fetch.FetchResponse.
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = email.message.Message()
+        # ^ looked up without regard to case, as the real response's are
+        for name, value in headers:
+            self.headers[name] = value
+        self.reused = True
+        self.dns_time = 0
+        self.connect_time = 0
+        self.wait_time = 0
+        self.compressed_bytes = len(body or b"")
+        self._body = io.BytesIO(body or b"")
+
+    def read(self, size=-1):
+        return self._body.read(size)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def config_entries(monitor_config):
+    # ^ what to replay: (label, url, keywords, regions) per url per profile in a config.MonitorConfig
+    entries = []
+    sources = [("", monitor_config.urls, monitor_config.matchers, monitor_config.regions)]
+    for profile in monitor_config.profiles:
+        sources.append((profile.name, profile.urls, profile.matchers, profile.regions))
+    for name, urls, matchers, regions in sources:
+        for url_count in range(len(urls)):
+            if not urls[url_count]:
+                continue
+            label = urls[url_count]
+            if name:
+                label = label + " (" + name + ")"
+            entries.append((label, urls[url_count], list(matchers[url_count].keywords), regions[url_count]))
+    return entries
+
+def replay_url(path, entry, since=None, until=None, stream=STREAM, incremental=INCREMENTAL):
+    # ^ runs entry's url's recorded responses through a MonitorWorker, carrying its state from one to the next (may
+    #   run in another process); returns (label, decisions, pages, changed pages, bytes, scan seconds), decisions as
+    #   (time, action, keywords) for each incident reported / cleared
+    label, url, keywords, regions = entry
+    matcher = KeywordMatcher(keywords)
+    reader = CorpusReader(path)
+    state = UrlState()
+    decisions = []
+    page_total = 0
+    changed_total = 0
+    byte_total = 0
+    scan_time = 0
+
+    for response in reader.fetches(url, since, until):
+        when = response[0]
+        worker = MonitorWorker(url, matcher, None, state, stream, incremental, fetcher=ReplayFetcher([response]),
+                               regions=regions)
+        state = worker.work()
+        page_total = page_total + 1
+        if worker.changed:
+            changed_total = changed_total + 1
+        byte_total = byte_total + worker.bytes_read
+        scan_time = scan_time + worker.scan_time
+        for info, action in worker.messages:
+            if action == "new incident" or action == "incident cleared":
+                decisions.append((when, action, info[0]))
+
+    reader.close()
+    return label, decisions, page_total, changed_total, byte_total, scan_time
+
+def replay(path, entries, since=None, until=None, processes=0):
+    # ^ replay_url() for each entry, in processes if processes (spawned, as scanner.py's are), otherwise here; returns
+    #   their results in entry order
+    if not processes:
+        return [replay_url(path, entry, since, until) for entry in entries]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes,
+                                                mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [executor.submit(replay_url, path, entry, since, until) for entry in entries]
+        return [future.result() for future in futures]
+
+def format_time(when):
+    return str(datetime.datetime.fromtimestamp(when).replace(microsecond=0))
+
+def parse_date(date):
+    if date is None:
+        return None
+    return datetime.datetime.strptime(date, "%Y-%m-%d").timestamp()
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="corpus", description="MDP monitor's recorded pages, and replaying them.")
+    parser.add_argument("--db", default=CORPUS_PATH, help="corpus (default: corpus.db)")
+    parser.add_argument("--replay", action="store_true", help="replay it with the settings' keywords")
+    parser.add_argument("--settings", default=config.SETTINGS_PATH, help="settings file (default: settings.txt)")
+    parser.add_argument("--url", default=None, help="only this url")
+    parser.add_argument("--since", default=None, help="only responses since this date (YYYY-MM-DD)")
+    parser.add_argument("--until", default=None, help="only responses before this date (YYYY-MM-DD)")
+    parser.add_argument("--processes", type=int, default=0,
+                        help="replay urls in this many processes at once (default: 0, one after another)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not os.path.exists(args.db):
+        print("no corpus at " + args.db, file=sys.stderr)
+        return 1
+    since = parse_date(args.since)
+    until = parse_date(args.until)
+
+    if not args.replay:
+        reader = CorpusReader(args.db)
+        for url, fetch_total in reader.urls(since, until):
+            print(str(fetch_total) + "  " + url)
+        fetch_total, body_total, size, stored = reader.sizes()
+        print(str(fetch_total) + " responses, " + str(body_total) + " distinct bodies, " + "%.1f" % (size / 1e6)
+              + " MB (" + "%.1f" % (stored / 1e6) + " MB stored)")
+        reader.close()
+        return 0
+
+    recorded = set(url for url, fetch_total in CorpusReader(args.db).urls(since, until))
+    entries = [entry for entry in config_entries(config.load_config(args.settings))
+               if entry[1] in recorded and (args.url is None or entry[1] == args.url)]
+    replay_start = time.perf_counter()
+    results = replay(args.db, entries, since, until, args.processes)
+    replay_time = time.perf_counter() - replay_start
+
+    page_total = 0
+    changed_total = 0
+    byte_total = 0
+    scan_time = 0
+    for label, decisions, pages, changed, byte_count, url_scan_time in results:
+        for when, action, keywords in decisions:
+            print(format_time(when) + "  " + action + "  " + label + "  (" + keywords + ")")
+        page_total = page_total + pages
+        changed_total = changed_total + changed
+        byte_total = byte_total + byte_count
+        scan_time = scan_time + url_scan_time
+    replay_time = max(replay_time, 1e-9)
+    print(str(page_total) + " responses (" + str(changed_total) + " changed) from " + str(len(entries)) + " urls, "
+          + "%.1f" % (byte_total / 1e6) + " MB, in " + "%.2f" % replay_time + " s")
+    print("%.0f" % (page_total / replay_time) + " responses/s, " + "%.1f" % (byte_total / 1e6 / replay_time)
+          + " MB/s (" + "%.2f" % scan_time + " s of it matching keywords)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
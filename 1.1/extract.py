@@ -0,0 +1,144 @@
+# MDP Incident Monitor App
+
+"""Text extraction for pool.py, so keywords are matched against a page's visible text rather than its raw HTML: tags,
+attributes, comments, scripts and styles are dropped before a line reaches the matcher, so "College" in a nav link's
+href or a script's string doesn't read as an incident, and there's less to scan.
+
+Optionally only parts of the page are kept (a url's regions= entry in settings.txt):
+  #incidents        the element with id="incidents" (and everything in it)
+  start..end        what's between <!-- start --> and <!-- end --> comments
+
+Built on html.parser, fed the page a chunk at a time as it's read; text lines come out as soon as they're complete
+(at a line break, a <br> or a block element such as <p>, <div>, <li> or <tr> starting or ending).
+"""
+
+import html.parser
+
+SKIPPED_TAGS = ("script", "style", "template")
+VOID_TAGS = ("area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track",
+             "wbr")
+BLOCK_TAGS = ("address", "article", "aside", "blockquote", "br", "dd", "div", "dl", "dt", "fieldset", "figcaption",
+              "figure", "footer", "form", "h1", "h2", "h3", "h4", "h5", "h6", "header", "hr", "li", "main", "nav",
+              "ol", "p", "pre", "section", "table", "td", "th", "tr", "ul")
+
+def parse_regions(region_settings):
+    # ^ one url's regions= entry ("#incidents, start..end") -> tuple of ("id", id) / ("marker", start, end)
+    regions = []
+    for entry in region_settings.split(","):
+        entry = entry.strip()
+        if entry.startswith("#") and len(entry) > 1:
+            regions.append(("id", entry[1:]))
+        elif ".." in entry:
+            start, separator, end = entry.partition("..")
+            regions.append(("marker", start.strip(), end.strip()))
+        elif entry:
+            raise ValueError("region isn't #id or start..end: " + entry)
+    return tuple(regions)
+
+def extract_lines(chunks, regions=()):
+    # ^ chunks: the page's text, in pieces of any size; yields its visible text a line at a time
+    extractor = TextExtractor(regions)
+    for chunk in chunks:
+        for line in extractor.lines(chunk):
+            yield line
+    for line in extractor.finish():
+        yield line
+
+class TextExtractor(html.parser.HTMLParser):
+    # regions: from parse_regions(); empty for the whole page.
+    def __init__(self, regions=()):
+        html.parser.HTMLParser.__init__(self, convert_charrefs=True)
+        self.ids = set()
+        self.markers = {}
+        # ^ start comment -> end comment
+        for region in regions:
+            if region[0] == "id":
+                self.ids.add(region[1])
+            else:
+                self.markers[region[1]] = region[2]
+        self.restricted = bool(regions)
+        self._skipping = 0
+        # ^ how many script / style / template elements the parser is in
+        self._region_tags = []
+        # ^ while in an id region, the tags open in it (the region's own first); it ends when its own tag does
+        self._region_end = None
+        # ^ while in a marker region, the comment that ends it
+        self._text = []
+        self._ready = []
+
+    def lines(self, chunk):
+        # ^ feeds the parser chunk; returns the lines completed by it
+        self.feed(chunk)
+        ready = self._ready
+        self._ready = []
+        return ready
+
+    def finish(self):
+        self.close()
+        self.end_line()
+        ready = self._ready
+        self._ready = []
+        return ready
+
+    def in_region(self):
+        return not self.restricted or bool(self._region_tags) or self._region_end is not None
+
+    def end_line(self):
+        if self._text:
+            line = " ".join("".join(self._text).split())
+            self._text = []
+            if line:
+                self._ready.append(line + "\n")
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self._skipping = self._skipping + 1
+            return
+        if self._region_tags:
+            if tag not in VOID_TAGS:
+                self._region_tags.append(tag)
+        elif self.ids and tag not in VOID_TAGS:
+            for name, value in attrs:
+                if name == "id" and value in self.ids:
+                    self.end_line()
+                    self._region_tags.append(tag)
+                    break
+        if tag in BLOCK_TAGS:
+            self.end_line()
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in BLOCK_TAGS:
+            self.end_line()
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            if self._skipping:
+                self._skipping = self._skipping - 1
+            return
+        if tag in BLOCK_TAGS:
+            self.end_line()
+        if tag in self._region_tags:
+            # closes anything left open inside it too (<li>s and <p>s often aren't closed)
+            while self._region_tags.pop() != tag:
+                pass
+            if not self._region_tags:
+                self.end_line()
+
+    def handle_comment(self, data):
+        comment = data.strip()
+        if self._region_end is not None:
+            if comment == self._region_end:
+                self.end_line()
+                self._region_end = None
+        elif comment in self.markers:
+            self.end_line()
+            self._region_end = self.markers[comment]
+
+    def handle_data(self, data):
+        if self._skipping or not self.in_region():
+            return
+        lines = data.split("\n")
+        for line_count in range(len(lines)):
+            if line_count:
+                self.end_line()
+            self._text.append(lines[line_count])
@@ -0,0 +1,317 @@
+# MDP Incident Monitor App
+
+"""HTTP fetching for pool.py workers: keeps connections open between requests (per host, and across cycles) instead
+of a new TCP / TLS handshake per page, asks for gzip / deflate and decompresses as the body is read, caches DNS
+lookups for DNS_TTL, and has separate connect / read timeouts. Redirects are followed (up to MAX_REDIRECTS).
+
+Fetcher.fetch() returns a FetchResponse, read a chunk at a time like urllib's; a 304 comes back as a response
+(status 304), other error statuses raise urllib.error.HTTPError as urlopen did, and a body that doesn't decompress
+(corrupt or cut short) raises DecodeError, an OSError like a failed read. A connection that had been idle and
+turns out to have been closed by the server is replaced, and the request sent again, once.
+
+Given a cancel.CancelToken, the timeouts are cut short to its deadline and cancelling it shuts down the socket, so a
+stop (or the end of the pool's cycle) interrupts a fetch that's waiting on a slow server; it then raises Cancelled.
+"""
+
+import http.client
+import socket
+import ssl
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import zlib
+
+from cancel import CancelToken, Cancelled, shutdown_socket
+
+CONNECT_TIMEOUT = 15
+READ_TIMEOUT = 60
+DNS_TTL = 5 * 60
+MAX_IDLE = 5 * 60
+# ^ seconds an idle connection is kept for reuse
+MAX_REDIRECTS = 5
+CHUNK_SIZE = 16 * 1024
+USER_AGENT = "Python-urllib/" + str(sys.version_info[0]) + "." + str(sys.version_info[1])
+
+class DecodeError(OSError):
+    # The body didn't decompress: corrupt, or cut short, gzip / deflate.
+    pass
+
+class Fetcher():
+    # Shared by all of a pool's workers (thread-safe).
+    def __init__(self, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT, dns_ttl=DNS_TTL,
+                 max_redirects=MAX_REDIRECTS):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.dns_ttl = dns_ttl
+        self.max_redirects = max_redirects
+        self._lock = threading.Lock()
+        self._idle = {}
+        # ^ (scheme, host, port) -> [(connection, time it was put back)]
+        self._dns = {}
+        # ^ (host, port) -> (addresses, time they expire)
+        self._ssl_context = None
+        # ^ made when first needed; loading the CA certificates takes tens of milliseconds
+
+    def fetch(self, url, headers=None, cancel=None):
+        # ^ GET url; headers: extra request headers (e.g. If-None-Match)
+        if cancel is None:
+            cancel = CancelToken()
+        request_headers = {"User-Agent": USER_AGENT, "Accept-Encoding": "gzip, deflate"}
+        if headers:
+            request_headers.update(headers)
+
+        timings = dict(dns=0, connect=0, reused=False)
+        for redirect_count in range(self.max_redirects + 1):
+            parts = urllib.parse.urlsplit(url)
+            key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == "https" else 80))
+            path = parts.path or "/"
+            if parts.query:
+                path = path + "?" + parts.query
+
+            connection, response, wait_time, callback = self.send(key, parts.netloc, path, request_headers, timings,
+                                                                  cancel)
+            status = response.status
+            if status in (301, 302, 303, 307, 308) and response.getheader("Location"):
+                location = response.getheader("Location")
+                response.read()
+                cancel.remove_callback(callback)
+                self.release(key, connection, response)
+                url = urllib.parse.urljoin(url, location)
+                continue
+
+            fetched = FetchResponse(self, key, connection, response, url, timings, wait_time, cancel, callback)
+            if status >= 400:
+                fetched.close()
+                raise urllib.error.HTTPError(url, status, response.reason, response.msg, None)
+            return fetched
+
+        raise urllib.error.HTTPError(url, status, "too many redirects", response.msg, None)
+
+    def send(self, key, netloc, path, headers, timings, cancel):
+        # ^ returns (connection, response to the request, seconds waiting for it, its on_cancel callback); on a
+        #   reused connection that's gone stale, tries once more on a new one
+        while True:
+            connection = self.take(key)
+            reused = connection is not None
+            if connection is None:
+                connection = self.connect(key, timings, cancel)
+            else:
+                connection.sock.settimeout(cancel.timeout(self.read_timeout))
+            callback = cancel.on_cancel(lambda: shutdown_socket(connection.sock))
+            request_start = time.perf_counter()
+            try:
+                connection.request("GET", path, headers=dict(headers, Host=netloc))
+                response = connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                cancel.remove_callback(callback)
+                connection.close()
+                cancel.check()
+                if reused:
+                    continue
+                raise
+            except:
+                cancel.remove_callback(callback)
+                connection.close()
+                cancel.check()
+                raise
+            timings["reused"] = reused
+            return connection, response, time.perf_counter() - request_start, callback
+
+    def connect(self, key, timings, cancel):
+        scheme, host, port = key
+        if scheme == "https":
+            with self._lock:
+                if self._ssl_context is None:
+                    self._ssl_context = ssl.create_default_context()
+            connection = http.client.HTTPSConnection(host, port, context=self._ssl_context)
+        else:
+            connection = http.client.HTTPConnection(host, port)
+        connection._create_connection = lambda address, timeout, source_address=None: self.create_connection(
+            address, timings, cancel)
+
+        connect_start = time.perf_counter()
+        connection.connect()
+        timings["connect"] = time.perf_counter() - connect_start - timings["dns"]
+        return connection
+
+    def create_connection(self, address, timings, cancel):
+        # ^ socket.create_connection, but resolving through the dns cache; connect_timeout for connecting, then
+        #   read_timeout for each read (both cut short to cancel's deadline)
+        host, port = address
+        dns_start = time.perf_counter()
+        addresses = self.resolve(host, port)
+        timings["dns"] = time.perf_counter() - dns_start
+
+        error = None
+        for family, socktype, proto, canonname, sockaddr in addresses:
+            sock = socket.socket(family, socktype, proto)
+            callback = cancel.on_cancel(lambda: shutdown_socket(sock))
+            try:
+                sock.settimeout(cancel.timeout(self.connect_timeout))
+                sock.connect(sockaddr)
+                sock.settimeout(cancel.timeout(self.read_timeout))
+                cancel.remove_callback(callback)
+                return sock
+            except (OSError, Cancelled) as connect_error:
+                cancel.remove_callback(callback)
+                sock.close()
+                cancel.check()
+                error = connect_error
+        if error is None:
+            error = OSError("no addresses for " + host)
+        raise error
+
+    def resolve(self, host, port):
+        now = time.monotonic()
+        with self._lock:
+            cached = self._dns.get((host, port))
+        if cached is not None and cached[1] > now:
+            return cached[0]
+        addresses = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        with self._lock:
+            self._dns[(host, port)] = (addresses, now + self.dns_ttl)
+        return addresses
+
+    def take(self, key):
+        # ^ an idle connection to key, if there's one that isn't too old
+        now = time.monotonic()
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                connection, idle_since = idle.pop()
+                if now - idle_since < MAX_IDLE:
+                    return connection
+                connection.close()
+        return None
+
+    def release(self, key, connection, response):
+        # ^ back to the idle connections if the response was read to the end and the server keeps it open
+        if response.isclosed() and not response.will_close:
+            with self._lock:
+                self._idle.setdefault(key, []).append((connection, time.monotonic()))
+        else:
+            connection.close()
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for connection, idle_since in idle:
+                    connection.close()
+            self._idle = {}
+
+class FetchResponse():
+    def __init__(self, fetcher, key, connection, response, url, timings, wait_time, cancel, callback):
+        self.fetcher = fetcher
+        self.cancel = cancel
+        self.callback = callback
+        self.key = key
+        self.connection = connection
+        self.response = response
+        self.url = url
+        self.status = response.status
+        self.headers = response.msg
+        self.dns_time = timings["dns"]
+        self.connect_time = timings["connect"]
+        self.reused = timings["reused"]
+        self.wait_time = wait_time
+        # ^ from sending the request to the headers coming back
+        self.compressed_bytes = 0
+        self._decoder = None
+        encoding = (response.getheader("Content-Encoding") or "").strip().lower()
+        self.encoding = encoding
+        if encoding in ("gzip", "x-gzip"):
+            self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == "deflate":
+            self._decoder = DeflateDecoder()
+        self._finished = False
+
+    def read(self, size=-1):
+        # ^ up to size bytes of the (decompressed) body; b"" at the end
+        if size is None or size < 0:
+            chunks = []
+            while True:
+                chunk = self.read(CHUNK_SIZE)
+                if not chunk:
+                    return b"".join(chunks)
+                chunks.append(chunk)
+
+        if self._decoder is None:
+            return self.read_raw(size)
+
+        while not self._finished:
+            data = self._decoder.unconsumed_tail
+            if not data:
+                data = self.read_raw(size)
+                if not data:
+                    self._finished = True
+                    return self.finish_decoding()
+            try:
+                output = self._decoder.decompress(data, size)
+            except zlib.error as error:
+                raise DecodeError("bad " + self.encoding + " body: " + str(error)) from error
+            if output:
+                return output
+        return b""
+
+    def finish_decoding(self):
+        # ^ what's left in the decoder at the end of the body, which must have ended the compressed stream
+        try:
+            output = self._decoder.flush()
+        except zlib.error as error:
+            raise DecodeError("bad " + self.encoding + " body: " + str(error)) from error
+        if self.compressed_bytes and not self._decoder.eof:
+            raise DecodeError(self.encoding + " body cut short")
+        return output
+
+    def read_raw(self, size):
+        if self.cancel.deadline is not None and self.connection.sock is not None:
+            self.connection.sock.settimeout(self.cancel.timeout(self.fetcher.read_timeout))
+        try:
+            data = self.response.read(size)
+        except (OSError, http.client.HTTPException):
+            # the socket having been shut down by cancelling shows up as an error, or a short read
+            self.cancel.check()
+            raise
+        self.cancel.check()
+        self.compressed_bytes = self.compressed_bytes + len(data)
+        return data
+
+    def close(self):
+        self.cancel.remove_callback(self.callback)
+        self.fetcher.release(self.key, self.connection, self.response)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class DeflateDecoder():
+    # "deflate" is meant to be zlib-wrapped, but some servers send it raw; tells which from the first bytes.
+    def __init__(self):
+        self._decoder = None
+        self.unconsumed_tail = b""
+        self.eof = False
+        # ^ whether the end of the compressed stream has been reached, as zlib's decompress objects have it
+
+    def decompress(self, data, max_length=0):
+        if self._decoder is None:
+            self._decoder = zlib.decompressobj()
+            try:
+                output = self._decoder.decompress(data, max_length)
+                self.unconsumed_tail = self._decoder.unconsumed_tail
+                self.eof = self._decoder.eof
+                return output
+            except zlib.error:
+                self._decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+        output = self._decoder.decompress(data, max_length)
+        self.unconsumed_tail = self._decoder.unconsumed_tail
+        self.eof = self._decoder.eof
+        return output
+
+    def flush(self):
+        if self._decoder is None:
+            return b""
+        return self._decoder.flush()
@@ -0,0 +1,80 @@
+# MDP Incident Monitor App
+
+"""Incident index for pool.py: which incidents are open at a url, each identified by a fingerprint of the text it
+was found in and the keyword, so the same closure is one incident however many times the page around it changes.
+
+Each check, the page's fingerprints are compared with the open ones:
+  new       not open before; reported (and emailed)
+  ongoing   still there; not reported again
+  cleared   gone from the page; reported (and emailed) as cleared
+
+The text is normalized before it's fingerprinted (case, runs of spaces, digits), so a line that only has its
+"updated at" time or mileage changed is still the same incident. A page with neither a positive nor a negative
+keyword on it is an incident of its own (keyword ""), as it always has been.
+"""
+
+import hashlib
+import re
+
+_DIGITS = re.compile(r"\d+")
+
+def block_key(text):
+    # ^ normalized hash of a block of page text (a line)
+    normalized = _DIGITS.sub("#", " ".join(text.lower().split()))
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).hexdigest()
+
+def fingerprint(key, keyword):
+    # ^ key: a block_key(), or "" for the page-wide no-keywords incident
+    return hashlib.blake2b((key + "\n" + keyword).encode("utf-8"), digest_size=8).hexdigest()
+
+class Incident():
+    def __init__(self, fingerprint, keyword, first_seen):
+        self.fingerprint = fingerprint
+        self.keyword = keyword
+        self.first_seen = first_seen
+
+class IncidentIndex():
+    # One url's open incidents by fingerprint. update() doesn't change the index it's called on (that belongs to the
+    # url's previous UrlState), it returns the next one.
+    def __init__(self, incidents=None):
+        self.open = {}
+        # ^ fingerprint -> Incident
+        if incidents:
+            for incident in incidents:
+                self.open[incident.fingerprint] = incident
+
+    def update(self, current, when, complete=True):
+        # ^ current: fingerprint -> keyword, for the incidents on the page now; complete: False if only part of the
+        #   page was read, in which case nothing is cleared. Returns (next index, new, ongoing, cleared), the last
+        #   three lists of Incident
+        next_index = IncidentIndex()
+        new = []
+        ongoing = []
+        cleared = []
+
+        for incident_fingerprint, keyword in current.items():
+            if incident_fingerprint in self.open:
+                incident = self.open[incident_fingerprint]
+                ongoing.append(incident)
+            else:
+                incident = Incident(incident_fingerprint, keyword, when)
+                new.append(incident)
+            next_index.open[incident_fingerprint] = incident
+
+        for incident_fingerprint, incident in self.open.items():
+            if incident_fingerprint not in current:
+                if complete:
+                    cleared.append(incident)
+                else:
+                    ongoing.append(incident)
+                    next_index.open[incident_fingerprint] = incident
+
+        return next_index, new, ongoing, cleared
+
+    def keywords(incidents):
+        # ^ the distinct keywords of a list of Incident, in order
+        keywords = []
+        for incident in incidents:
+            if incident.keyword not in keywords:
+                keywords.append(incident.keyword)
+        return keywords
@@ -0,0 +1,41 @@
+# MDP Incident Monitor App
+
+"""Log view over one of the tkinter Text widgets in monitorapp.py. Entries are collected as they're logged and
+written out by flush() (once per UI tick) as a single insert, and only the newest MAX_LINES lines are kept, so
+weeks of monitoring don't slow the widget down or keep using more memory.
+"""
+
+import datetime
+import tkinter as tk
+
+MAX_LINES = 2000
+
+class LogView():
+    def __init__(self, text_widget, max_lines=MAX_LINES):
+        self.text_widget = text_widget
+        self.max_lines = max_lines
+        self._pending = []
+
+    def log(self, message):
+        # ^ one entry: date stamp, then message on the next line; shown on the next flush()
+        self._pending.append("[" + str(datetime.datetime.now()) + "]\n" + message)
+
+    def flush(self):
+        if not self._pending:
+            return
+
+        text = "\n\n".join(self._pending)
+        self._pending = []
+        if self.text_widget.compare("end-1c", "!=", "1.0"):
+            text = "\n\n" + text
+
+        self.text_widget.config(state=tk.NORMAL)
+        self.text_widget.insert(tk.END, text)
+
+        # drop the oldest lines past max_lines
+        line_count = int(self.text_widget.index("end-1c").split(".")[0])
+        if line_count > self.max_lines:
+            self.text_widget.delete("1.0", str(line_count - self.max_lines + 1) + ".0")
+
+        self.text_widget.see(tk.END)
+        self.text_widget.config(state=tk.DISABLED)
@@ -0,0 +1,140 @@
+# MDP Incident Monitor App
+
+"""Keyword matcher for one url, compiled once (when the settings are parsed in monitorapp.py) and reused by pool.py
+workers every cycle.
+
+The positive keywords are folded into a single pattern: the plain-text ones (nearly all of them) as a trie, so the
+regex engine walks shared prefixes once rather than trying each keyword in turn, and anything with regex syntax as
+extra alternatives. Negative keywords (^keyword) are plain text that must be absent from the page; they go into the
+same trie, so a line is checked for both kinds in the one search. Lines that don't match the combined pattern, which
+is nearly all of them, cost that one search; lines that do are then looked at more closely to report every keyword
+on the line.
+"""
+
+import hashlib
+import re
+
+# characters that make a keyword a regex rather than plain text
+_REGEX_CHARS = set(".^$*+?{}[]\\|()")
+
+class KeywordMatcher():
+    def __init__(self, keywords):
+        # ^ keywords as parsed from the settings; negative ones begin with ^
+        self.keywords = keywords
+        self.fingerprint = hashlib.blake2b("\n".join(keywords).encode("utf-8"), digest_size=8).hexdigest()
+        # ^ identifies the keyword list, e.g. for telling whether a page snapshot was scanned with these keywords
+        self.pos_keywords = []
+        self.neg_keywords = []
+        seen = set()
+        for keyword in keywords:
+            if keyword in seen:
+                continue
+            seen.add(keyword)
+            if keyword.startswith("^"):
+                if keyword[1:]:
+                    self.neg_keywords.append(keyword[1:])
+            else:
+                self.pos_keywords.append(keyword)
+
+        # an empty keyword matches anything (as re.search("", line) always has)
+        self._always = [keyword for keyword in self.pos_keywords if keyword == ""]
+        literals = [keyword for keyword in self.pos_keywords if keyword and not _REGEX_CHARS & set(keyword)]
+        regexes = [keyword for keyword in self.pos_keywords if keyword and _REGEX_CHARS & set(keyword)]
+
+        # lower-cased literal -> (every positive keyword it contains at its start, whether it contains a negative one
+        # at its start); the trie only reports the longest
+        self._literal_hits = {}
+        pos_by_lowered = {}
+        for literal in literals:
+            pos_by_lowered.setdefault(literal.lower(), []).append(literal)
+        neg_literals = set(keyword.lower() for keyword in self.neg_keywords)
+        for literal in literals + self.neg_keywords:
+            lowered = literal.lower()
+            hits = []
+            neg = False
+            for end in range(1, len(lowered) + 1):
+                prefix = lowered[:end]
+                hits.extend(pos_by_lowered.get(prefix, []))
+                neg = neg or prefix in neg_literals
+            self._literal_hits[lowered] = (hits, neg)
+
+        # the trie has each literal lower-cased, unless that changes its length ("İ" -> "i" + combining dot), when the
+        # regex engine's own case folding of it (as re.search(keyword, line, re.IGNORECASE) always did) is what's
+        # wanted
+        self._trie_words = {}
+        # ^ word in the trie -> the lower-cased literal
+        for literal in literals + self.neg_keywords:
+            lowered = literal.lower()
+            if len(lowered) == len(literal):
+                self._trie_words[lowered] = lowered
+            else:
+                self._trie_words[literal] = lowered
+        alternatives = []
+        if self._literal_hits:
+            alternatives.append("(?P<lit>" + KeywordMatcher.trie_pattern(list(self._trie_words)) + ")")
+        for regex in regexes:
+            alternatives.append("(?:" + regex + ")")
+
+        # lookahead, so overlapping keywords ("Palm Canyon", "Canyon Dr") are each found
+        self._pattern = None
+        self._has_literals = bool(self._literal_hits)
+        if alternatives:
+            self._pattern = re.compile("(?=" + "|".join(alternatives) + ")", re.IGNORECASE)
+        self._regex_patterns = [(regex, re.compile(regex, re.IGNORECASE)) for regex in regexes]
+
+    def scan(self, line):
+        # ^ returns (the positive keywords found in line, in settings order; True if line contains a negative keyword)
+        if self._pattern is None or self._pattern.search(line) is None:
+            return list(self._always), False
+
+        found = set(self._always)
+        found_neg = False
+        for match in self._pattern.finditer(line):
+            if self._has_literals and match.group("lit") is not None:
+                hits, neg = self.literal_hits(match.group("lit"))
+                found.update(hits)
+                found_neg = found_neg or neg
+        for regex, pattern in self._regex_patterns:
+            if pattern.search(line):
+                found.add(regex)
+
+        return [keyword for keyword in self.pos_keywords if keyword in found], found_neg
+
+    def literal_hits(self, text):
+        lowered = text.lower()
+        if lowered in self._literal_hits:
+            return self._literal_hits[lowered]
+        # case folding that doesn't round-trip through lower() (rare unicode); do it the slow way
+        hits = []
+        neg = False
+        for word, literal in self._trie_words.items():
+            if re.match(re.escape(word), text, re.IGNORECASE):
+                hits.extend(hit for hit in self._literal_hits[literal][0] if hit not in hits)
+                neg = neg or self._literal_hits[literal][1]
+        return hits, neg
+
+    def trie_pattern(words):
+        # ^ regex matching any of words, longest first, with shared prefixes factored out:
+        #   ["mccall", "mccall park", "mcgaugh"] -> "mc(?:call(?: park)?|gaugh)"
+        trie = {}
+        for word in words:
+            node = trie
+            for char in word:
+                node = node.setdefault(char, {})
+            node[""] = {}
+
+        def build(node):
+            branches = []
+            for char in sorted(node):
+                if char != "":
+                    branches.append(re.escape(char) + build(node[char]))
+            if not branches:
+                return ""
+            if len(branches) == 1 and "" not in node:
+                return branches[0]
+            pattern = "(?:" + "|".join(branches) + ")"
+            if "" in node:
+                pattern = pattern + "?"
+            return pattern
+
+        return build(trie)
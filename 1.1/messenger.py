@@ -1,57 +1,254 @@
 # MDP Idyllwild Incident Monitor App
 
+"""Channel from pool.py to the UI. Producers only put messages on the queue and carry on; the UI (or the daemon)
+takes them off in batches on its own schedule, so the monitor never waits on the UI.
+
+The queue holds at most MAX_QUEUED messages. Most of them are the same status again ("no change" to a url every
+cycle), so a status repeating the last one for its url is folded into it (counted, and shown as "... (3 times)")
+rather than queued again: into the message itself while it's still waiting, or, once the UI has taken it, into a
+held repeat that's queued when the url's status changes, when FOLD_LIMIT repeats have built up, or at "finished".
+Messages about a url keep their order; the pool's own (sleeping, errors, ...) are never folded. If the queue is full
+anyway, the overflow policy decides:
+  "drop-oldest"   the oldest waiting status message makes room (the default)
+  "drop-newest"   the new status message is dropped
+  "block"         the producer waits for room (until its cancel.CancelToken, if it gave one, is cancelled)
+Incidents, emails, errors and "finished" (KEPT_ACTIONS) are never dropped or held up, even past MAX_QUEUED.
+"""
+
+import collections
 import threading
-import time
-import queue
 
-import globs
+MAX_QUEUED = 1000
+OVERFLOW = "drop-oldest"
+OVERFLOW_POLICIES = ("drop-oldest", "drop-newest", "block")
+KEPT_ACTIONS = ("new incident", "incident cleared", "email", "error", "finished")
+POOL_ACTIONS = ("sleeping", "reloaded", "profiled", "error", "finished")
+# ^ the pool's own messages, not about any one url
+COALESCED_ACTIONS = ("no incident", "no change", "ongoing")
+FOLD_LIMIT = 20
+# ^ repeats held back before they're queued anyway, so the UI still hears about the url now and then
 
 class Messenger():
 
-    _info = ""
-    _action = ""
-    _trigger_func = None
-    _message = []
-    _message_condition = threading.Condition()
-    _message_queue = queue.Queue()
+    _condition = threading.Condition()
+    _messages = collections.deque()
+    # ^ waiting messages, as [info, action, count], oldest first
+    _latest = {}
+    # ^ url -> the last message queued for it, while it's still waiting
+    _taken = {}
+    # ^ url -> (info, action) of the last message for it the UI took
+    _held = {}
+    # ^ url -> repeats of that message since, as [info, action, count], not yet queued
+    _capacity = MAX_QUEUED
+    _overflow = OVERFLOW
+    _dropped = 0
 
     #
     # Action values:
     #
     # "new incident"
     # "no incident"
-    # "sleeping"
-    # "finished"
+    # "no change"
+    # "incident cleared"
+    # "ongoing"
+    # "email"
+    # "sleeping"    (info: seconds until the next check)
+    # "reloaded"
+    # "profiled"
+    # "error"       (info: what went wrong, as text)
+    # "finished"    (info: the finished pool's cancel.CancelToken)
     #
-    
+
     def __init__(self, message):
         self.message = message
-    
-    def queue_message(self, info, action):
-        message = [info, action]
-        Messenger._message_queue.put(message)
-
-    def send_messages(self):
-        with Messenger._message_condition:
-            while not Messenger._message_queue.empty():
-                time.sleep(1)
-                
-                if not globs.trigger_running:
-                    if not globs.monitor_finished:
-                        globs.set_trigger_running(True)
-                        message = Messenger._message_queue.get()
-                        Messenger._trigger_func(message)
-                    else:
+
+    def configure(capacity=MAX_QUEUED, overflow=OVERFLOW):
+        # ^ overflow: one of OVERFLOW_POLICIES
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("overflow policy isn't one of " + ", ".join(OVERFLOW_POLICIES) + ": " + overflow)
+        with Messenger._condition:
+            Messenger._capacity = capacity
+            Messenger._overflow = overflow
+            Messenger._condition.notify_all()
+
+    def queue_message(self, info, action, cancel=None):
+        # ^ returns False if the message was dropped; cancel: what ends the wait for room, if the policy is "block"
+        key = Messenger.message_key(info, action)
+        callback = None
+        queued = True
+        with Messenger._condition:
+            if action in COALESCED_ACTIONS and key is not None:
+                latest = Messenger._latest.get(key)
+                if latest is not None and latest[0] == info and latest[1] == action:
+                    latest[2] = latest[2] + 1
+                    return True
+                if latest is None and Messenger._taken.get(key) == (info, action):
+                    held = Messenger._held.setdefault(key, [info, action, 0])
+                    held[2] = held[2] + 1
+                    if held[2] < FOLD_LIMIT:
+                        return True
+                    del Messenger._held[key]
+                    info, action = held[0], held[1]
+                    # queued below, with its count
+                else:
+                    held = None
+                    Messenger.release(key)
+            else:
+                held = None
+                if action == "finished":
+                    for held_key in list(Messenger._held):
+                        Messenger.release(held_key)
+                elif key is not None:
+                    Messenger.release(key)
+
+            if action not in KEPT_ACTIONS and Messenger.full():
+                if Messenger._overflow == "block" and cancel is not None:
+                    callback = cancel.on_cancel(Messenger.wake)
+                while Messenger._overflow == "block" and Messenger.full():
+                    if cancel is not None and cancel.cancelled():
                         break
+                    Messenger._condition.wait()
+                if Messenger._overflow == "drop-oldest":
+                    Messenger.drop_oldest()
+                if Messenger.full():
+                    Messenger._dropped = Messenger._dropped + 1
+                    queued = False
+
+            if queued:
+                message = held or [info, action, 1]
+                Messenger._messages.append(message)
+                if key is not None:
+                    Messenger._latest[key] = message
+        if callback is not None:
+            cancel.remove_callback(callback)
+        return queued
+
+    def full():
+        return len(Messenger._messages) >= Messenger._capacity
+
+    def message_key(info, action):
+        # ^ what a message is about, for folding repeats of it into one: its url; None for emails and the pool's own
+        #   messages (never folded)
+        if action == "email" or action in POOL_ACTIONS:
+            return None
+        if isinstance(info, list):
+            return info[1]
+        return info
+
+    def release(key):
+        # ^ queues the repeats held for key, if any, ahead of whatever is queued for it next (no room needed: there
+        #   are at most as many as urls)
+        held = Messenger._held.pop(key, None)
+        if held is not None:
+            Messenger._messages.append(held)
+            Messenger._latest[key] = held
+
+    def drop_oldest():
+        # ^ makes room by dropping the oldest waiting message that isn't one of KEPT_ACTIONS, if there is one
+        for message_count in range(len(Messenger._messages)):
+            message = Messenger._messages[message_count]
+            if message[1] not in KEPT_ACTIONS:
+                del Messenger._messages[message_count]
+                Messenger.forget(message)
+                Messenger._dropped = Messenger._dropped + 1
+                return
+
+    def forget(message):
+        key = Messenger.message_key(message[0], message[1])
+        if Messenger._latest.get(key) is message:
+            del Messenger._latest[key]
+
+    def wake():
+        with Messenger._condition:
+            Messenger._condition.notify_all()
+
+    def get_messages(max_count):
+        # ^ takes up to max_count waiting messages, oldest first, without blocking
+        messages = []
+        with Messenger._condition:
+            while len(messages) < max_count and Messenger._messages:
+                message = Messenger._messages.popleft()
+                Messenger.forget(message)
+                key = Messenger.message_key(message[0], message[1])
+                if key is not None:
+                    Messenger._taken[key] = (message[0], message[1])
+                messages.append(message)
+            if messages:
+                Messenger._condition.notify_all()
+        return messages
+
+    def get_queue_depth():
+        return len(Messenger._messages)
+
+    def take_dropped():
+        # ^ how many messages have been dropped since it was last called
+        with Messenger._condition:
+            dropped = Messenger._dropped
+            Messenger._dropped = 0
+        return dropped
 
     def clear_queue():
-        Messenger._message_queue = queue.Queue()
+        with Messenger._condition:
+            Messenger._messages = collections.deque()
+            Messenger._latest = {}
+            Messenger._taken = {}
+            Messenger._held = {}
+            Messenger._condition.notify_all()
+
+    def get_text(self):
+        # ^ the message as a line of status text (the UI's wording)
+        text = self.get_status_text()
+        if self.get_count() > 1:
+            text = text + " (" + str(self.get_count()) + " times)"
+        return text
+
+    def get_status_text(self):
+        info = self.get_info()
+        action = self.get_action()
+        if action == "new incident":
+            return "New incident at " + str(info[1]) + " (found keyword: " + str(info[0]) + ")"
+        elif action == "no incident":
+            return "No incident at " + info
+        elif action == "no change":
+            return "No changes to " + info
+        elif action == "incident cleared":
+            return "Incident cleared at " + str(info[1]) + " (keyword: " + str(info[0]) + ")"
+        elif action == "ongoing":
+            return "Ongoing incident at " + str(info[1]) + " (keyword: " + str(info[0]) + ")"
+        elif action == "email":
+            return "Sending an email to " + info + "..."
+        elif action == "sleeping":
+            return "Sleeping for " + Messenger.wait_text(info) + "..."
+        elif action == "reloaded":
+            return "Reloaded the settings (" + info + " urls)."
+        elif action == "profiled":
+            return "Wrote a profile of the last cycles to " + info + "."
+        elif action == "error":
+            return info
+        elif action == "finished":
+            return "Done monitoring."
+        return str(info)
+
+    def wait_text(seconds):
+        # ^ e.g. "45 seconds", "1 minute", "2.5 minutes"; to a tenth of a second under 10 s, so a short wait isn't 0
+        if seconds < 10:
+            amount, unit = round(seconds, 1), "second"
+        elif seconds < 60:
+            amount, unit = round(seconds), "second"
+        else:
+            amount, unit = round(seconds / 60, 1), "minute"
+        if amount != 1:
+            unit = unit + "s"
+        return "%g " % amount + unit
 
     def get_info(self):
         return self.message[0]
-    
+
     def get_action(self):
         return self.message[1]
-    
-    def set_trigger_func(trigger_func):
-        Messenger._trigger_func = trigger_func
+
+    def get_count(self):
+        # ^ how many times the message was queued in a row for its url (repeats being folded into it)
+        if len(self.message) > 2:
+            return self.message[2]
+        return 1
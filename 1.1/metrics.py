@@ -0,0 +1,202 @@
+# MDP Incident Monitor App
+
+"""Performance metrics for pool.py: counters, gauges and histograms, each kept per url where that makes sense.
+
+Histograms keep cumulative buckets (what Prometheus expects) plus the last WINDOW observations, from which the JSON
+snapshot reports rolling percentiles. MetricsServer serves them on a local port:
+  /metrics       Prometheus text format
+  /metrics.json  the same as JSON
+and write_snapshot() saves the JSON to a file (the pool does so after every cycle).
+
+Recorded by the pool / workers / notifier:
+  mdp_dns_seconds, mdp_connect_seconds, mdp_transfer_seconds, mdp_scan_seconds  (histograms, per url)
+  mdp_response_seconds                                                              (histogram, per url)
+  mdp_bytes_downloaded_total, mdp_keyword_hits_total, mdp_fetches_total           (counters, per url)
+  mdp_connections_total                                                             (counter, per url, by reused)
+  mdp_cycle_seconds, mdp_email_send_seconds                                         (histograms)
+  mdp_emails_total                                                                  (counter, by result)
+  mdp_messenger_queue_depth                                                         (gauge)
+  mdp_messages_dropped_total                                                        (counter)
+  mdp_poll_interval_seconds                                                         (gauge, per url)
+"""
+
+import collections
+import http.server
+import json
+import math
+import os
+import threading
+
+WINDOW = 100
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+_HELP = dict(
+    mdp_dns_seconds="Time to resolve the url's host (new connections only; lookups are cached).",
+    mdp_connect_seconds="Time to open a new connection (TCP and TLS handshakes).",
+    mdp_response_seconds="Time from sending the request to the response headers.",
+    mdp_transfer_seconds="Time reading the body, not counting scanning.",
+    mdp_scan_seconds="Time spent matching keywords.",
+    mdp_cycle_seconds="Time for all the urls due in a cycle.",
+    mdp_email_send_seconds="Time to send one email (including retries).",
+    mdp_bytes_downloaded_total="Body bytes read off the wire (compressed, if the server compressed them).",
+    mdp_connections_total="Requests, by whether they went over a kept-alive connection.",
+    mdp_keyword_hits_total="Positive keywords found on changed lines.",
+    mdp_fetches_total="Fetches, by result.",
+    mdp_emails_total="Emails, by result.",
+    mdp_messenger_queue_depth="Messages waiting for the UI.",
+    mdp_messages_dropped_total="Status messages dropped because the UI's queue was full.",
+    mdp_poll_interval_seconds="Seconds between checks of the url (before jitter); grows while unchanged if adaptive.",
+)
+
+class Histogram():
+    def __init__(self, window=WINDOW, buckets=BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+        self.recent = collections.deque(maxlen=window)
+
+    def observe(self, value):
+        self.count = self.count + 1
+        self.sum = self.sum + value
+        self.recent.append(value)
+        for bucket_count in range(len(self.buckets)):
+            if value <= self.buckets[bucket_count]:
+                self.bucket_counts[bucket_count] = self.bucket_counts[bucket_count] + 1
+
+    def percentile(self, fraction):
+        # ^ over the rolling window
+        if not self.recent:
+            return 0
+        values = sorted(self.recent)
+        return values[min(int(math.ceil(fraction * len(values))) - 1, len(values) - 1)]
+
+    def summary(self):
+        summary = dict(count=self.count, sum=self.sum)
+        if self.recent:
+            summary["window"] = len(self.recent)
+            summary["mean"] = sum(self.recent) / len(self.recent)
+            summary["p50"] = self.percentile(0.5)
+            summary["p90"] = self.percentile(0.9)
+            summary["p99"] = self.percentile(0.99)
+            summary["max"] = max(self.recent)
+        return summary
+
+class Metrics():
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        # ^ each keyed by (name, labels), labels a tuple of (label, value) pairs
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(self.window)
+            self._histograms[key].observe(value)
+
+    def snapshot(self):
+        def entries(metrics, render):
+            result = {}
+            for (name, labels), value in sorted(metrics.items()):
+                result.setdefault(name, []).append(dict(labels=dict(labels), value=render(value)))
+            return result
+
+        with self._lock:
+            return dict(counters=entries(self._counters, lambda value: value),
+                        gauges=entries(self._gauges, lambda value: value),
+                        histograms=entries(self._histograms, lambda histogram: histogram.summary()))
+
+    def prometheus_text(self):
+        def label_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(label + '="' + Metrics.escape(str(value)) + '"' for label, value in pairs) + "}"
+
+        lines = []
+        described = set()
+
+        def describe(name, kind):
+            if name not in described:
+                described.add(name)
+                if name in _HELP:
+                    lines.append("# HELP " + name + " " + _HELP[name])
+                lines.append("# TYPE " + name + " " + kind)
+
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                describe(name, "counter")
+                lines.append(name + label_text(labels) + " " + repr(value))
+            for (name, labels), value in sorted(self._gauges.items()):
+                describe(name, "gauge")
+                lines.append(name + label_text(labels) + " " + repr(value))
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                describe(name, "histogram")
+                for bucket, bucket_count in zip(histogram.buckets, histogram.bucket_counts):
+                    lines.append(name + "_bucket" + label_text(labels, [("le", repr(bucket))]) + " "
+                                 + str(bucket_count))
+                lines.append(name + "_bucket" + label_text(labels, [("le", "+Inf")]) + " " + str(histogram.count))
+                lines.append(name + "_sum" + label_text(labels) + " " + repr(histogram.sum))
+                lines.append(name + "_count" + label_text(labels) + " " + str(histogram.count))
+
+        return "\n".join(lines) + "\n"
+
+    def write_snapshot(self, path):
+        # written to a temporary file then renamed, so a reader never sees half a file
+        temp_path = path + ".tmp"
+        with open(temp_path, 'w', encoding="utf-8") as file:
+            json.dump(self.snapshot(), file, indent=1)
+        os.replace(temp_path, path)
+
+    def escape(value):
+        return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+class MetricsServer(threading.Thread):
+    # Serves a Metrics on 127.0.0.1 (only) until stop().
+    def __init__(self, metrics, port, host="127.0.0.1"):
+        threading.Thread.__init__(self, daemon=True)
+        served = metrics
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body = served.prometheus_text().encode("utf-8")
+                    content_type = "text/plain; version=0.0.4; charset=utf-8"
+                elif self.path == "/metrics.json":
+                    body = json.dumps(served.snapshot(), indent=1).encode("utf-8")
+                    content_type = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.port = self.server.server_port
+
+    def run(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -15,16 +15,32 @@ Misc. code standards:
   Private class variables preceded with _.
   Other private variables not distinguished.
   Constants are caps.
-  "globs" only modified in monitorapp (using appropriate function).
+  "globs" only modified in monitorapp / monitord (using appropriate function).
   "globs" accessed anywhere.
-  "if not globs.monitor_finished:" used in each non-GUI loop to keep responsiveness to exiting the program;
-    the alternatives seem unnecessarily complicated.
+  Non-GUI loops check the monitor's cancel.CancelToken ("if not cancel.cancelled():") and sleep with cancel.wait(),
+    to keep responsiveness to exiting the program; blocking calls get a timeout, cut short to its deadline.
       
 Modules:
   monitorapp.py: main loop, tkinter UI, methods for handling pool.py worker web-scraping events.
-  pool.py: "thread" pool that manages workers (currently single-thread) for monitoring websites.
+  monitord.py: headless alternative to monitorapp.py (python3 -m monitord), logging to stdout / a file.
+  bench.py: microbenchmarks for the parsers, matcher, worker and messenger, with baseline comparison.
+  incidents.py: open incidents per url by fingerprint, so only new / cleared ones are reported.
+  state.py: per-url state and incident history in SQLite (state.db), so a restart resumes where it left off.
+  config.py: reading settings.txt into urls and per-url keyword matchers / frequencies; watches it for edits.
+  profiler.py: cProfile / tracemalloc reports on the next few cycles, on demand (Debug menu, SIGUSR1, profile.now).
+  pool.py: thread pool that manages workers (concurrent, with global and per-host caps) for monitoring websites.
+  corpus.py: recording fetched pages (monitord.py --capture) and replaying them offline against the keywords.
+  extract.py: visible text of a page's HTML (optionally only some regions of it), for scanning instead of markup.
+  fetch.py: HTTP for the workers: kept-alive connections reused across cycles, gzip / deflate, cached DNS, timeouts.
+  matcher.py: per-url keyword matcher, compiled once from the settings and reused every cycle.
+  scanner.py: keyword scanning in worker processes (matchers compiled once per process), for large pages / many urls.
+  scheduler.py: heap of when each url is next due (per-url frequency, optional jitter) for pool.py.
+  notifier.py: emails incidents from its own thread over a kept-alive SMTP connection (digests, retries).
+  metrics.py: counters / histograms of fetch, scan, cycle and email timings; served locally or saved as JSON.
+  logview.py: bounded, batched log over the status / incidents Text widgets.
   messenger.py: queue to send status / keyword matches / &c. to UI from pool.py.
-  globs.py: safe globals indicating state of monitoring (started, stopped) and semaphores to lock communication with UI.
+  cancel.py: cancellation token (with deadlines) that stops the pool, its workers, scans and emails promptly.
+  globs.py: safe globals (semaphores to lock communication with UI).
 
 Misc. notes:
   The program is not perfectly separated MVC--model is pool.py; view is monitorapp.py; while controller is broken up
@@ -36,61 +52,71 @@ Todo (3/15):
   More comments.
   General refactoring.
   Fix UI text output character jumbling.
-  Alert when incident disappears.
-  Research different trigger handling instead of current hack.
 
 """
 
-import datetime
-import os
 import re
-import threading
 import tkinter as tk
-import time
-import queue
 
+import config
 import globs
+from logview import LogView
 from pool import MonitorPool
 from messenger import Messenger
+from profiler import PROFILE_CYCLES, Profiler
+from state import STATE_PATH, StateStore
 
 class Application(tk.Frame):
     """
     """
-    _PATH, _fn = os.path.split(os.path.realpath(__file__))
-    #_full_path = os.path.join(_path, _fn)
-    _SETTINGS_PATH = _PATH + "\settings.txt"
+    _SETTINGS_PATH = config.SETTINGS_PATH
+    _STATE_PATH = STATE_PATH
+    POLL_INTERVAL = 100
+    # ^ ms between checks of the messenger queue
+    MAX_MESSAGES_PER_TICK = 100
     
     def __init__(self, master=None):    
         tk.Frame.__init__(self, master)
         master.resizable(tk.FALSE, tk.FALSE)
         self.grid()
-        self.settings = dict(is_running="False", urls="", keywords="", username="", password="", frequency = "",
-                             duration = "")
+        self.settings = config.new_settings()
         self.urls = []
         self.keywords = [[]]
+        self.matchers = []
         self.username = ""
         self.duration = tk.StringVar()
         self.frequency = tk.StringVar() 
+        self.max_frequency = tk.StringVar()
+        self.monitor_pool = None
+        self.profiler = None
         self.load_settings_from_file()
         self.create_widgets(master)
-        self.messenger = Messenger(["", ""])
-        self.trigger_counter = 0
-        self.trigger_condition = threading.Condition()
-        self.trigger_finished = False
-        self.messenger_queue = queue.Queue()
+        self.status_log = LogView(self.status_text)
+        self.incident_log = LogView(self.incident_text)
+        self.poll_messages()
         
 # Widgets
 
 #   -   Initialization
 
     def create_widgets(self, master):
+        self.create_menu(master)
         self.create_settings_frame(master)
         self.create_status_frame(master)
         self.create_button_frame(master)
-        self.create_trigger_frame(master)
         
         self.create_incident_top(master)
     
+#   -   -    Menu
+
+    def create_menu(self, master):
+        self.menu = tk.Menu(master)
+        self.debug_menu = tk.Menu(self.menu, tearoff=0)
+        self.debug_menu.add_command(label="Profile the next " + str(PROFILE_CYCLES) + " cycles",
+                                    command=self.profile_menu_item)
+        self.menu.add_cascade(label="Debug", menu=self.debug_menu)
+        master.config(menu=self.menu)
+
 #   -   -    Frames
 
     def create_settings_frame(self, master):
@@ -102,6 +128,7 @@ class Application(tk.Frame):
 
         self.create_frequency_optionmenu(self.settings_frame)
         self.create_duration_optionmenu(self.settings_frame)
+        self.create_max_frequency_optionmenu(self.settings_frame)
 
     def create_status_frame(self, master):
         self.status_frame = tk.Frame(master)
@@ -116,11 +143,6 @@ class Application(tk.Frame):
         self.create_monitor_button(self.button_frame)
         self.create_quit_button(self.button_frame)
 
-    def create_trigger_frame(self, master):
-        self.trigger_frame = tk.Frame(master, height=1, width=1)
-        self.trigger_frame.grid()
-        self.trigger_frame.bind("<Configure>", lambda e: self.handle_trigger_configure())
-
 #   -   -   Top
 
     def create_incident_top(self, master):
@@ -172,6 +194,9 @@ class Application(tk.Frame):
         self.frequency_label = tk.Label(master, text="Automatic turn off (hours):")
         self.frequency_label.grid(row=5, column=0, padx=10, pady=5, sticky=tk.E)
 
+        self.max_frequency_label = tk.Label(master, text="Check unchanged sites less often, up to (minutes):")
+        self.max_frequency_label.grid(row=6, column=0, padx=10, pady=5, sticky=tk.E)
+
     def create_frequency_optionmenu(self, master):
         self.frequency.set("5")
         self.frequency_optionmenu = tk.OptionMenu(master, self.frequency, "5", "15", "30", "45", "60")
@@ -184,6 +209,12 @@ class Application(tk.Frame):
         self.duration_optionmenu.grid(row=5, column=1, padx=8, pady=5, sticky=tk.W)
         self.duration_optionmenu.config(bg="white", relief=tk.SUNKEN, width=4, anchor=tk.W)
         
+    def create_max_frequency_optionmenu(self, master):
+        self.max_frequency.set("Off")
+        self.max_frequency_optionmenu = tk.OptionMenu(master, self.max_frequency, "Off", "60", "120", "240")
+        self.max_frequency_optionmenu.grid(row=6, column=1, padx=8, pady=5, sticky=tk.W)
+        self.max_frequency_optionmenu.config(bg="white", relief=tk.SUNKEN, width=4, anchor=tk.W)
+        
 #   -   -    Entries
 
     def create_settings_entries(self, master):
@@ -229,19 +260,26 @@ class Application(tk.Frame):
         self.write_all_entries_to_file("start")
         self.update_settings_from_entries()  
 
-        # GLOBAL SET
-        globs.set_monitor_finished(False)
-
-        self.insert_text(self.status_text, "\n\n")
-        self.insert_date(self.status_text)
-        self.insert_text(self.status_text, "\nStarting to monitor...")
-
-        Messenger.set_trigger_func(self.trigger_configure)
-        
-        # check urls
-        monitor_pool = MonitorPool(self.urls, self.keywords, self.username, self.password, self.duration,
-                                   self.frequency)
-        monitor_pool.start()
+        self.status_log.log("Starting to monitor...")
+        self.status_log.flush()
+
+        # check urls; settings.txt is watched, so edits to it are picked up between cycles
+        frequencies = config.parse_frequencies(self.settings.get("frequencies", ""), len(self.urls),
+                                               self.frequency.get())
+        regions = config.parse_url_regions(self.settings.get("regions", ""), len(self.urls),
+                                           self.settings.get("extract", "") == "True")
+        profiles = config.parse_profiles(self.settings, self.frequency.get())
+        email = config.parse_email(self.settings)
+        monitor_config = config.MonitorConfig(tuple(self.urls), tuple(self.matchers), tuple(frequencies),
+                                              self.username, self.password, tuple(regions), tuple(profiles), email)
+        watcher = config.ConfigWatcher(Application._SETTINGS_PATH, self.frequency.get(), monitor_config)
+        self.profiler = Profiler()
+        self.monitor_pool = MonitorPool(self.urls, self.matchers, self.username, self.password, self.duration.get(),
+                                        self.frequency.get(), frequencies=frequencies, regions=regions,
+                                        profiles=profiles, email=email, watcher=watcher,
+                                        state_store=StateStore(Application._STATE_PATH),
+                                        max_frequency=self.get_max_frequency(), profiler=self.profiler)
+        self.monitor_pool.start()
         
         # change button's action to stop
         self.monitor_button["text"] = "Stop monitoring"
@@ -253,16 +291,11 @@ class Application(tk.Frame):
         self.write_all_entries_to_file("stop")
         self.update_settings_from_entries()
         
-        # GLOBAL SET
-        globs.set_monitor_finished(True)
+        # the pool winds down on its own thread; a new one can be started straight away
+        self.monitor_pool.stop()
 
-        '''messenger = Messenger([])
-        messenger.queue_message("\nDone monitoring.", "finished")
-        messenger.send_messages()'''
-        
-        self.insert_text(self.status_text, "\n\n")
-        self.insert_date(self.status_text)
-        self.insert_text(self.status_text, "\nDone monitoring.")
+        self.status_log.log("Done monitoring.")
+        self.status_log.flush()
 
         # change button's action to start
         self.monitor_button["text"] = "Start monitoring"
@@ -270,7 +303,20 @@ class Application(tk.Frame):
         self.monitor_button.config(state = tk.NORMAL)
 
         Messenger.clear_queue()
+
+    def profile_menu_item(self):
+        if self.monitor_pool is None or not self.monitor_pool.is_alive():
+            self.status_log.log("Start monitoring first; only the monitor's cycles are profiled.")
+        else:
+            self.profiler.request()
+            self.status_log.log("Profiling the next " + str(PROFILE_CYCLES) + " cycles...")
+        self.status_log.flush()
         
+    def get_max_frequency(self):
+        if self.max_frequency.get() == "Off":
+            return None
+        return self.max_frequency.get()
+
 # Settings
 #   -   Writing
 
@@ -281,6 +327,7 @@ class Application(tk.Frame):
         self.write_one_entry_to_file(self.keywords_entry)
         self.write_one_entry_to_file(self.username_entry)
         self.write_one_entry_to_file(self.password_entry)
+        self.write_other_settings_to_file()
 
     def prepare_settings_file(usage):
         if usage == "start":
@@ -306,25 +353,22 @@ class Application(tk.Frame):
             elif (entry == ""):
                 file.write("\n")
 
+    def write_other_settings_to_file(self):
+        # settings without an entry (added to settings.txt by hand, e.g. frequencies=) are kept as they were
+        known = config.new_settings()
+        with open(Application._SETTINGS_PATH, 'a', encoding="utf-8") as file:
+            for key in self.settings:
+                if key not in known and self.settings[key]:
+                    file.write("\n" + key + "=" + self.settings[key])
+
 #   -   Reading in saved settings
     
     def load_settings_from_file(self):
-        with open(Application._SETTINGS_PATH, 'r') as file:
-            #file.encode("utf-8").strip()
-
-            for line in file:
-                if re.search("is_running=", line):
-                    self.settings["is_running"] = line
-                elif re.search("urls=", line):
-                    self.settings["urls"] = line
-                elif re.search("keywords=", line):
-                    self.settings["keywords"] = line
-                elif re.search("username=", line):
-                    self.settings["username"] = line
-                elif re.search("password=", line):
-                    self.settings["password"] = line
-
-            self.clean_settings()
+        self.settings = config.load_settings(Application._SETTINGS_PATH)
+        self.username = self.settings["username"]
+        self.password = self.settings["password"]
+
+        self.parse_urls_keywords()
 
     def update_settings_from_entries(self): 
         self.settings["urls"] = self.URL_entry.get()
@@ -334,232 +378,53 @@ class Application(tk.Frame):
 
         self.urls = []
         self.parse_urls_keywords()
-        
-    def clean_settings(self):
-        if self.settings["is_running"]:
-            self.settings["is_running"] = Application.remove_line_breaks(self.settings["is_running"])
-            self.settings["is_running"] = self.settings["is_running"][11:]
-        if self.settings["urls"]:
-            self.settings["urls"] = Application.remove_line_breaks(self.settings["urls"])
-            self.settings["urls"] = self.settings["urls"][5:]
-            what = self.settings["urls"]
-        if self.settings["keywords"]:
-            self.settings["keywords"] = Application.remove_line_breaks(self.settings["keywords"])
-            self.settings["keywords"] = self.settings["keywords"][9:]     
-        if self.settings["username"]:
-            self.settings["username"] = Application.remove_line_breaks(self.settings["username"])
-            self.settings["username"] = self.settings["username"][9:]
-            self.username = self.settings["username"]
-        if self.settings["password"]:
-            self.settings["password"] = Application.remove_line_breaks(self.settings["password"])
-            self.settings["password"] = self.settings["password"][9:]
-            self.password = self.settings["password"]
-
-        self.parse_urls_keywords()
 
     def parse_urls_keywords(self):
-        def parse_urls():
-            self.urls = []
-            new_url = ""
-            prev_char = ''
-            
-            if self.settings["urls"]:
-                for char in self.settings["urls"]:
-                    if char == ',':
-                        prev_char = char
-                    elif prev_char == ',' and char == ' ':
-                        self.urls.append(new_url)
-                        new_url = ""
-                    elif prev_char == ',' and re.search('^ ', char):
-                        new_url = new_url + prev_char + char
-                    elif char == ' ':
-                        continue
-                    else:
-                        new_url = new_url + char
-                    prev_char = char
-                    
-            self.urls.append(new_url)
-
-        def parse_keywords():
-            def invert_keyword(keyword):
-                inv_keyword = "^((?!"
-                inv_keyword = inv_keyword + keyword
-                inv_keyword = inv_keyword + ").)*$"
-                return inv_keyword
-
-            KEYWORD_SIZE = 200
-            
-            self.keywords = [[] for x in range(KEYWORD_SIZE)]
-            new_keyword = ""
-            prev_char = ''
-            is_inv_keyword = False
-            count = 0
-            url_count = 0
-
-            if self.settings["keywords"]:
-                for char in self.settings["keywords"]:
-                    if char == '^':
-                        if count == 0 or count == 1:
-                            is_inv_keyword = True
-                            prev_char = char
-              
-                    elif char == ',' or char == ';':
-                        prev_char = char
-                    elif (prev_char == ',' or prev_char == ';') and (char == ' '): 
-                        if is_inv_keyword:
-                            new_keyword = invert_keyword(new_keyword)
-                            self.keywords[url_count].append(new_keyword)
-                            new_keyword = ""
-                            is_inv_keyword = False
-                            count = 0
-                        else:
-                            self.keywords[url_count].append(new_keyword)
-                            new_keyword = ""
-                            count = 0
-                        if prev_char == ';':
-                            url_count = url_count + 1
-                        
-                    else:
-                        new_keyword = new_keyword + char
-                        prev_char = char
-                        
-                    count = count + 1
-
-                if is_inv_keyword:
-                    new_keyword = invert_keyword(new_keyword)
-                    self.keywords[url_count].append(new_keyword)
-                    is_inv_keyword = False
-                    count = 0
-                else:
-                    self.keywords[url_count].append(new_keyword)
-                    count = 0
-
-        parse_urls()
-        parse_keywords()
-        
-    def remove_line_breaks(settings):
-        new_settings = ""
-        
-        for char in settings:
-            if char == '\n':
-                pass
-            else:
-                new_settings = new_settings + char
-
-        return new_settings
-        '''
-        new_keyword = ""
-        prev_char = ''
-        if self.settings["keywords"]:
-            for char in self.settings["keywords"]:  
-                if re.search('"', char):
-                    pass
-                elif re.search(';', char):
-                    pass
-                elif (re.search('\"', prev_char)) and (re.search('\w', char)):
-                    new_keyword = new_keyword + char
-                elif (re.search('\w', char):
-                    new_keyword =
-
-                prev_char = char'''
+        self.urls = config.parse_urls(self.settings["urls"])
+        self.keywords = config.parse_keywords(self.settings["keywords"])
+        self.matchers = config.build_matchers(self.urls, self.keywords)
                     
             
 # Misc.
 
-# - Status Text widget
-
-    _status_condition = threading.Condition()
-    _incident_condition = threading.Condition()
-
-    def insert_text(self, text_widget, string):
-        if text_widget is self.incident_text:
-            with Application._incident_condition:
-                text_widget.config(state=tk.NORMAL)
-                text_widget.insert(tk.INSERT, string)
-                text_widget.see(tk.END)
-                text_widget.config(state=tk.DISABLED)
-                
-        elif text_widget is self.status_text:
-            with Application._status_condition:
-                text_widget.config(state=tk.NORMAL)
-                text_widget.insert(tk.INSERT, string)
-                text_widget.see(tk.END)
-                text_widget.config(state=tk.DISABLED)
-            
-
-    def insert_date(self, text_widget):
-            self.insert_text(text_widget, "[")
-            self.insert_text(text_widget, datetime.datetime.now())
-            self.insert_text(text_widget, "]")
-
 # - Other
 
     def kill_it(self):
-        # GLOBAL SET
-        globs.set_monitor_finished(True)
+        # the pool's thread finishes interrupting its fetches and saving its state after the window has gone
+        if self.monitor_pool is not None:
+            self.monitor_pool.stop()
 
         self.write_all_entries_to_file("stop")
         
         root.destroy()
 
-    def trigger_configure(self, message):
-        # to prevent
-        self.messenger = Messenger(message)
-        if globs.monitor_finished == True:
-            self.stop_monitor_button()
-
-        if self.trigger_frame["width"] == 1:
-            self.trigger_frame.config(width=2)
-        elif self.trigger_frame["width"] == 2:
-            self.trigger_frame.config(width=1)
-        else: # problem
-            pass 
-
-    def handle_trigger_configure(self):
-        # for second time, preventing
-        #print("\n monitor - handling trigger " + self.messenger.get_action() + " " + self.messenger.get_info())
-        if self.trigger_counter == 0:
-            self.trigger_counter = self.trigger_counter + 1
-            globs.set_trigger_running(False)
-            return
-        elif self.messenger.get_action() == "new incident":
-            if self.trigger_counter == 1:
-                self.insert_date(self.incident_text)
-                self.insert_text(self.incident_text, "\nNew incident at " + str(self.messenger.get_info()[1])
-                                 + " (found keyword: " + str(self.messenger.get_info()[0]) + ")")
-            elif self.trigger_counter > 1:
-                self.insert_text(self.incident_text, "\n\n")
-                self.insert_date(self.incident_text)
-                self.insert_text(self.incident_text, "\nNew incident at " + str(self.messenger.get_info()[1])
-                                 + " (found keyword: " + str(self.messenger.get_info()[0]) + ")")
+    def poll_messages(self):
+        # takes whatever the pool has queued since the last tick, then checks again in POLL_INTERVAL ms
+        for message in Messenger.get_messages(Application.MAX_MESSAGES_PER_TICK):
+            self.handle_message(Messenger(message))
+        self.status_log.flush()
+        self.incident_log.flush()
+
+        self.after(Application.POLL_INTERVAL, self.poll_messages)
+
+    def handle_message(self, messenger):
+        #print("\n monitor - handling message " + messenger.get_action() + " " + str(messenger.get_info()))
+        if messenger.get_action() == "new incident":
+            self.incident_log.log(messenger.get_text())
 
             self.incident_top.lift()                            
             self.bell()
                                         
-            self.insert_text(self.status_text, "\n\n")
-            self.insert_date(self.status_text)
-            self.insert_text(self.status_text, "\nNew incident found! Check the Incidents window.")
-        elif self.messenger.get_action() == "no incident":
-            self.insert_text(self.status_text, "\n\n")
-            self.insert_date(self.status_text)
-            self.insert_text(self.status_text, "\nNo incident at " + self.messenger.get_info())
-        elif self.messenger.get_action() == "no change":
-            self.insert_text(self.status_text, "\n\n")
-            self.insert_date(self.status_text)
-            self.insert_text(self.status_text, "\nNo changes to " + self.messenger.get_info())
-        elif self.messenger.get_action() == "email":
-            self.insert_text(self.status_text, "\n\n")
-            self.insert_date(self.status_text)
-            self.insert_text(self.status_text, "\nSending an email to " + self.messenger.get_info() + "...")
-        elif self.messenger.get_action() == "sleeping":
-            self.insert_text(self.status_text, "\n\n")
-            self.insert_date(self.status_text)
-            self.insert_text(self.status_text, "\nSleeping for " + self.messenger.get_info() + " minutes...")
-        elif self.messenger.get_action() == "finished":
-            self.stop_monitor_button()
-
-        self.trigger_counter = self.trigger_counter + 1
-        globs.set_trigger_running(False)  
+            self.status_log.log("New incident found! Check the Incidents window.")
+        elif messenger.get_action() == "incident cleared":
+            self.incident_log.log(messenger.get_text())
+            self.status_log.log(messenger.get_text())
+        elif messenger.get_action() == "finished":
+            # only from the pool running now: one stopped just before a restart may still finish late
+            if self.monitor_pool is not None and messenger.get_info() is self.monitor_pool.cancel:
+                self.stop_monitor_button()
+        else:
+            self.status_log.log(messenger.get_text())
 
 if __name__ == "__main__":       
     globs.init()
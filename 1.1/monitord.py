@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# MDP Incident Monitor App
+
+"""Headless monitor: runs pool.py with the settings in settings.txt and no tkinter, writing the status lines the UI
+would show to stdout, or to a log file.
+
+From this directory:
+  python3 -m monitord [--settings PATH] [--frequency MINUTES] [--max-frequency MINUTES] [--duration HOURS|None]
+                      [--log PATH]
+                      [--state PATH | --no-state] [--no-reload] [--scan-processes N] [--metrics-port PORT]
+                      [--metrics-file PATH] [--cycle-timeout SECONDS] [--queue-size N]
+                      [--queue-overflow drop-oldest|drop-newest|block] [--capture PATH]
+                      [--profile-cycles N] [--profile-dir PATH] [--max-workers N] [--max-per-host N]
+
+State (see state.py) is saved to state.db, so a restart picks up where the last run left off. Edits to the
+settings file are picked up between cycles (unless --no-reload), without restarting. --capture records every page
+fetched into a corpus (see corpus.py), to try keyword changes against offline. SIGUSR1 (or creating profile.now)
+profiles the next --profile-cycles cycles, writing the reports to --profile-dir (see profiler.py).
+
+Stops cleanly (current cycle abandoned, pending emails flushed) on SIGTERM or ctrl-c, within a bounded time: fetches
+and scans under way are interrupted, and emails still unsent after pool.NOTIFIER_STOP_TIMEOUT are given up on. A
+site that's slow to answer is given up on after --cycle-timeout (checked again next cycle), rather than holding up
+the rest.
+"""
+
+import argparse
+import datetime
+import signal
+import sys
+
+import config
+import corpus
+import globs
+from cancel import CancelToken
+from messenger import MAX_QUEUED, OVERFLOW, OVERFLOW_POLICIES, Messenger
+from pool import CYCLE_TIMEOUT, MAX_PER_HOST, MAX_WORKERS, MonitorPool
+from profiler import PROFILE_CYCLES, PROFILE_DIRECTORY, Profiler
+from state import STATE_PATH, StateStore
+
+POLL_INTERVAL = 0.5
+# ^ seconds between writing out queued messages
+MAX_MESSAGES_PER_TICK = 100
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="monitord", description="MDP incident monitor without the UI.")
+    parser.add_argument("--settings", default=config.SETTINGS_PATH, help="settings file (default: settings.txt)")
+    parser.add_argument("--frequency", default="5", help="minutes between checks of each url (default: 5)")
+    parser.add_argument("--duration", default="None", help="hours to monitor for, or None (default: None)")
+    parser.add_argument("--max-frequency", default=None,
+                        help="check pages that keep coming back unchanged less often, up to every this many minutes")
+    parser.add_argument("--log", default=None, help="append status lines to this file instead of stdout")
+    parser.add_argument("--state", default=STATE_PATH, help="state database to resume from (default: state.db)")
+    parser.add_argument("--no-state", action="store_true", help="start afresh and don't save state")
+    parser.add_argument("--scan-processes", type=int, default=0,
+                        help="scan changed pages in this many processes, e.g. one per core (default: 0, in threads)")
+    parser.add_argument("--no-reload", action="store_true",
+                        help="don't pick up changes to the settings file while running")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="serve metrics on 127.0.0.1:PORT (/metrics for Prometheus, /metrics.json)")
+    parser.add_argument("--metrics-file", default=None, help="save a JSON metrics snapshot here after each cycle")
+    parser.add_argument("--max-workers", type=int, default=MAX_WORKERS,
+                        help="urls fetched at once, at most (default: " + str(MAX_WORKERS) + ")")
+    parser.add_argument("--max-per-host", type=int, default=MAX_PER_HOST,
+                        help="urls on the same host fetched at once, at most (default: " + str(MAX_PER_HOST) + ")")
+    parser.add_argument("--cycle-timeout", type=float, default=CYCLE_TIMEOUT,
+                        help="give up on fetches / scans still going this many seconds into a cycle (default: "
+                        + str(CYCLE_TIMEOUT) + ")")
+    parser.add_argument("--queue-size", type=int, default=MAX_QUEUED,
+                        help="status messages held for the log before the overflow policy applies (default: "
+                        + str(MAX_QUEUED) + ")")
+    parser.add_argument("--queue-overflow", choices=OVERFLOW_POLICIES, default=OVERFLOW,
+                        help="what to do with status messages once the queue is full (default: " + OVERFLOW + ")")
+    parser.add_argument("--capture", default=None,
+                        help="record every response fetched into this corpus, for replaying (see corpus.py)")
+    parser.add_argument("--profile-cycles", type=int, default=PROFILE_CYCLES,
+                        help="cycles to profile on SIGUSR1 (default: " + str(PROFILE_CYCLES) + ")")
+    parser.add_argument("--profile-dir", default=PROFILE_DIRECTORY,
+                        help="where profiling reports go (default: profiles)")
+    return parser.parse_args(argv)
+
+def write_messages(sink):
+    for message in Messenger.get_messages(MAX_MESSAGES_PER_TICK):
+        write_line(sink, Messenger(message).get_text())
+
+def write_line(sink, text):
+    sink.write("[" + str(datetime.datetime.now()) + "] " + text + "\n")
+    sink.flush()
+
+def main(argv=None):
+    args = parse_args(argv)
+    globs.init()
+    Messenger.configure(args.queue_size, args.queue_overflow)
+
+    monitor_config = config.load_config(args.settings, args.frequency)
+    watcher = None
+    if not args.no_reload:
+        watcher = config.ConfigWatcher(args.settings, args.frequency, monitor_config)
+
+    state_store = None
+    if not args.no_state:
+        state_store = StateStore(args.state)
+
+    corpus_writer = None
+    if args.capture:
+        corpus_writer = corpus.CorpusWriter(args.capture)
+
+    sink = sys.stdout
+    if args.log:
+        sink = open(args.log, 'a', encoding="utf-8")
+
+    cancel = CancelToken()
+    def stop(signum, frame):
+        cancel.cancel()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    profiler = Profiler(args.profile_dir)
+    def profile(signum, frame):
+        profiler.request(args.profile_cycles)
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, profile)
+
+    try:
+        monitor_pool = MonitorPool(list(monitor_config.urls), list(monitor_config.matchers), monitor_config.username,
+                                   monitor_config.password, args.duration, args.frequency,
+                                   max_workers=args.max_workers, max_per_host=args.max_per_host,
+                                   frequencies=monitor_config.frequencies, regions=monitor_config.regions,
+                                   profiles=monitor_config.profiles, email=monitor_config.email, watcher=watcher,
+                                   state_store=state_store,
+                                   scan_processes=args.scan_processes, max_frequency=args.max_frequency,
+                                   metrics_port=args.metrics_port, metrics_file=args.metrics_file, cancel=cancel,
+                                   cycle_timeout=args.cycle_timeout, corpus=corpus_writer, profiler=profiler)
+    except OSError as error:
+        # the metrics port is taken
+        print("couldn't serve metrics on port " + str(args.metrics_port) + ": " + str(error), file=sys.stderr)
+        if state_store is not None:
+            state_store.close()
+        if corpus_writer is not None:
+            corpus_writer.close()
+        if sink is not sys.stdout:
+            sink.close()
+        return 1
+    write_line(sink, "Starting to monitor...")
+    monitor_pool.start()
+
+    while monitor_pool.is_alive():
+        monitor_pool.join(POLL_INTERVAL)
+        write_messages(sink)
+    write_messages(sink)
+
+    if cancel.cancelled():
+        write_line(sink, "Done monitoring.")
+    if sink is not sys.stdout:
+        sink.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
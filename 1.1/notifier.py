@@ -0,0 +1,232 @@
+# MDP Incident Monitor App
+
+"""Emails incidents on its own thread, so pool.py workers only put them on a queue and carry on monitoring.
+
+One authenticated SMTP connection is kept open between emails (and reopened if the server has dropped it); after
+IDLE_TIMEOUT with nothing to send it's closed. With a digest window, incidents arriving within the window go out
+together in one email (one per recipient, for a monitor profile emailing someone other than the notifier's own
+address). Failed sends are retried, waiting RETRY_DELAY and doubling each time.
+
+Each SMTP operation times out after SMTP_TIMEOUT. stop() waits a bounded time for what's queued to go out; if it
+hasn't by then, the notifier's cancel.CancelToken is cancelled, which shuts the connection down mid-send and ends the
+retries, so a hung SMTP server can't hold up a shutdown.
+
+Host, port and TLS can be changed, so a local debugging SMTP server can stand in for gmail, e.g.
+  Notifier("me", "", host="localhost", port=1025, use_tls=False)
+"""
+
+import email.message
+import queue
+import smtplib
+import threading
+import time
+
+from cancel import CancelToken, Cancelled, shutdown_socket
+from messenger import Messenger
+
+SMTP_HOST = "smtp.gmail.com"
+SMTP_PORT = 587
+SMTP_TIMEOUT = 30
+IDLE_TIMEOUT = 4 * 60
+DIGEST_WINDOW = 0
+MAX_RETRIES = 5
+RETRY_DELAY = 5
+
+class Notifier(threading.Thread):
+    def __init__(self, username, password, host=SMTP_HOST, port=SMTP_PORT, use_tls=True, address=None,
+                 digest_window=DIGEST_WINDOW, max_retries=MAX_RETRIES, retry_delay=RETRY_DELAY, cancel=None):
+        # ^ digest_window in seconds; 0 sends every incident as soon as it's queued; cancel: a CancelToken that
+        #   abandons any sending when cancelled (one is made if not given, which stop() cancels if it has to)
+        threading.Thread.__init__(self, daemon=True)
+        self.cancel = cancel
+        if self.cancel is None:
+            self.cancel = CancelToken()
+        self.username = username
+        self.password = password
+        self.host = host
+        self.port = port
+        self.use_tls = use_tls
+        self.address = address
+        if not self.address:
+            self.address = self.username + "@gmail.com"
+        self.digest_window = digest_window
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.sent = 0
+        self.failed = 0
+        self.metrics = None
+        # ^ set by the pool, if it's recording metrics.py timings
+        self._queue = queue.Queue()
+        self._stopping = threading.Event()
+        self._server = None
+        self._callback = None
+
+    def notify(self, url, found_keyword, action="new incident", recipient=""):
+        # ^ action: "new incident" or "incident cleared"; recipient: address to email, if not the notifier's own
+        self._queue.put([url, found_keyword, action, recipient])
+
+    def stop(self, timeout=None):
+        # ^ sends whatever is already queued (without waiting out the digest window), then closes the connection;
+        #   whatever hasn't been sent after timeout seconds is given up on
+        self._stopping.set()
+        self._queue.put(None)
+        self.cancel.notify()
+        if self.is_alive():
+            self.join(timeout)
+        if self.is_alive():
+            self.cancel.cancel()
+            self.join(SMTP_TIMEOUT)
+
+    def run(self):
+        finished = False
+        while not finished:
+            try:
+                if self._server is not None:
+                    incident = self._queue.get(timeout=IDLE_TIMEOUT)
+                else:
+                    incident = self._queue.get()
+            except queue.Empty:
+                self.disconnect()
+                continue
+
+            if incident is None:
+                break
+
+            batch = [incident]
+            deadline = time.monotonic() + self.digest_window
+            while True:
+                if self._stopping.is_set():
+                    remaining = 0
+                else:
+                    remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        incident = self._queue.get(timeout=remaining)
+                    else:
+                        incident = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if incident is None:
+                    finished = True
+                    break
+                batch.append(incident)
+
+            self.send(batch)
+
+        self.disconnect()
+
+    def send(self, batch):
+        # ^ one email per recipient in batch; returns whether they were all sent
+        recipients = []
+        for incident in batch:
+            if incident[3] not in recipients:
+                recipients.append(incident[3])
+        all_sent = True
+        for recipient in recipients:
+            send_start = time.perf_counter()
+            sent = self.send_with_retries([incident for incident in batch if incident[3] == recipient], recipient)
+            if self.metrics is not None:
+                self.metrics.observe("mdp_email_send_seconds", time.perf_counter() - send_start)
+                self.metrics.inc("mdp_emails_total", result="sent" if sent else "failed")
+            all_sent = all_sent and sent
+        return all_sent
+
+    def send_with_retries(self, batch, recipient=""):
+        # ^ returns True once sent; gives up after max_retries
+        msg = self.compose(batch, recipient)
+        delay = self.retry_delay
+        attempt = 0
+
+        while not self.cancel.cancelled():
+            reused = self._server is not None
+            try:
+                self.connect()
+                self._server.send_message(msg)
+                self.sent = self.sent + 1
+                return True
+            except (smtplib.SMTPException, OSError, Cancelled) as error:
+                self.disconnect()
+                if self.cancel.cancelled():
+                    break
+                Messenger([]).queue_message("email failed: " + str(error), "error")
+                if reused:
+                    # kept-alive connection had gone stale; reconnect straight away, doesn't count as a retry
+                    continue
+
+            attempt = attempt + 1
+            if attempt > self.max_retries:
+                break
+            self.cancel.wait(delay, self._stopping.is_set)
+            if self._stopping.is_set():
+                break
+            delay = delay * 2
+
+        self.failed = self.failed + 1
+        return False
+
+    def compose(self, batch, recipient=""):
+        msg = email.message.EmailMessage()
+        msg["From"] = self.address
+        msg["To"] = recipient or self.address
+
+        lines = []
+        actions = set()
+        for url, found_keyword, action, incident_recipient in batch:
+            actions.add(action)
+            if action == "incident cleared":
+                lines.append("Incident cleared at " + Notifier.strip_scheme(url) + "\n" + "(keyword: " + found_keyword
+                             + ")")
+            else:
+                lines.append("New incident at " + Notifier.strip_scheme(url) + "\n" + "(found keyword: "
+                             + found_keyword + ")")
+        if len(batch) == 1 and batch[0][2] == "incident cleared":
+            msg["Subject"] = "Incident cleared at " + Notifier.strip_scheme(batch[0][0])
+        elif len(batch) == 1:
+            msg["Subject"] = "New incident at " + Notifier.strip_scheme(batch[0][0])
+        elif actions == {"incident cleared"}:
+            msg["Subject"] = str(len(batch)) + " incidents cleared"
+        elif actions == {"new incident"}:
+            msg["Subject"] = str(len(batch)) + " new incidents"
+        else:
+            msg["Subject"] = str(len(batch)) + " incident updates"
+        msg.set_content("\n\n".join(lines))
+        return msg
+
+    def connect(self):
+        if self._server is not None:
+            return
+        server = smtplib.SMTP(timeout=self.cancel.timeout(SMTP_TIMEOUT))
+        server._host = self.host
+        # ^ what starttls() checks the certificate against; SMTP() only sets it when it's given the host to connect to
+        # cancelling shuts the socket down, waking the thread if it's waiting on the server
+        self._callback = self.cancel.on_cancel(lambda: shutdown_socket(server.sock))
+        try:
+            server.connect(self.host, self.port)
+            if self.use_tls:
+                server.starttls()
+            if self.password:
+                server.login(self.username, self.password)
+        except:
+            self.cancel.remove_callback(self._callback)
+            server.close()
+            raise
+        self._server = server
+
+    def disconnect(self):
+        if self._server is None:
+            return
+        self.cancel.remove_callback(self._callback)
+        try:
+            self._server.quit()
+        except (smtplib.SMTPException, OSError):
+            self._server.close()
+        self._server = None
+
+    def strip_scheme(url):
+        if url.startswith("https://"):
+            url = url[8:]
+        elif url.startswith("http://"):
+            url = url[7:]
+        if url.startswith("www."):
+            url = url[4:]
+        return url
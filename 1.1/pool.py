@@ -1,196 +1,823 @@
 # MDP Incident Monitor App
 
-"""Pool that managers "workers" to do web-scraping; workers currently single-threaded, but may be multi-thread in 
-future. Communication with UI achieved by queue in messenger.py.
+"""Pool that managers "workers" to do web-scraping; each cycle the workers run concurrently on a bounded thread pool,
+with a per-host cap so a single site isn't hammered. Results are handed back to the UI in URL order, regardless of
+which page finished first. Communication with UI achieved by queue in messenger.py.
+
+With named profiles (config.Profile), each profile's urls are scheduled and scanned with its own keywords, but a url
+due for several profiles in the same cycle is fetched once and the page handed to each of them.
+
+Stopping is by the pool's cancel.CancelToken (stop()); each cycle runs under a child of it with a deadline of
+cycle_timeout, so a site that's slow to answer is given up on (and checked again next time) rather than holding up the
+rest, and a stop interrupts whatever is being fetched or scanned.
 """
 
-import os
-import re
-import smtplib
-import socket
+import codecs
+import collections
+import concurrent.futures
+import hashlib
+import http.client
+import io
+import json
 import threading
 import time
-import urllib.request
+import urllib.parse
 
-import globs
+from cancel import CancelToken, Cancelled
+from extract import extract_lines
+from fetch import Fetcher
+from incidents import Incident, IncidentIndex, block_key, fingerprint
 from messenger import Messenger
+from metrics import Metrics, MetricsServer
+from notifier import Notifier
+from scanner import LINE_HASH_SIZE, ScanPool, line_hash
+from scheduler import MonitorScheduler
 #from worker import MonitorWorker
 
+MAX_WORKERS = 8
+MAX_PER_HOST = 2
+NOTIFIER_STOP_TIMEOUT = 30
+CONFIG_POLL = 5
+# ^ seconds between checks of the settings file for changes, when watching it
+CYCLE_TIMEOUT = 5 * 60
+# ^ seconds a cycle's fetches and scans have before the ones still going are given up on
+STREAM = True
+INCREMENTAL = True
+CHUNK_SIZE = 16 * 1024
+MAX_LINE_SIZE = 64 * 1024
+LINE_OVERLAP = 256
+
 class MonitorPool(threading.Thread):
-    def __init__(self, urls, keywords, username, password, duration, frequency):
+    def __init__(self, urls, matchers, username, password, duration, frequency, max_workers=MAX_WORKERS,
+                 max_per_host=MAX_PER_HOST, frequencies=None, jitter=0, stream=STREAM, incremental=INCREMENTAL,
+                 notifier=None, metrics=None, metrics_port=None, metrics_file=None, watcher=None,
+                 config_poll=CONFIG_POLL, state_store=None, scan_processes=0, max_frequency=None, regions=None,
+                 cancel=None, cycle_timeout=CYCLE_TIMEOUT, profiles=None, corpus=None, profiler=None, email=None):
+        # ^ frequencies: optional per-url frequencies in minutes (otherwise every url uses frequency); jitter: fraction
+        #   of each url's frequency to randomly add / take away, so checks on the same host drift apart; notifier:
+        #   sends the emails (by default gmail, if there's a username); metrics: where to record timings (made here if
+        #   there's a metrics_port to serve them on or a metrics_file to save them to after each cycle); watcher: a
+        #   config.ConfigWatcher, whose reloaded settings are swapped in between cycles; state_store: a
+        #   state.StateStore to pick up from at the start and save to after each cycle (closed when the pool ends);
+        #   scan_processes: scan changed pages in this many processes (scanner.py) rather than the fetching threads;
+        #   max_frequency: minutes; if given, urls that keep coming back unchanged are checked less and less often, up
+        #   to this (see scheduler.py), and back to their frequency once they change or have an incident; regions:
+        #   optional per-url config.MonitorConfig regions, for scanning the text extracted from the page (extract.py)
+        #   rather than its raw HTML; cancel: a CancelToken that stops the pool when cancelled (one is made if not
+        #   given; see stop()); cycle_timeout: seconds, or None for cycles to take as long as they take; profiles:
+        #   config.Profile, monitored as well as urls / matchers (which are the settings' unnamed profile); corpus: a
+        #   corpus.CorpusWriter to record every response in (closed when the pool ends); profiler: a
+        #   profiler.Profiler, asked between cycles whether to profile the next one; email: config.EmailSettings for
+        #   the notifier made here (gmail, sending straight away, if not given)
         threading.Thread.__init__(self)
-        self.urls = urls
-        self.keywords = keywords
+        self.cancel = cancel
+        if self.cancel is None:
+            self.cancel = CancelToken()
+        self.cycle_timeout = cycle_timeout
         self.username = username
         self.password = password
-        self.duration = duration.get()
+        self.notifier = notifier
+        if self.notifier is None and self.username:
+            if email is None:
+                self.notifier = Notifier(self.username, self.password)
+            else:
+                self.notifier = Notifier(self.username, self.password, email.host, email.port, email.use_tls,
+                                         digest_window=email.digest_window)
+        self.metrics = metrics
+        if self.metrics is None and (metrics_port or metrics_file):
+            self.metrics = Metrics()
+        self.metrics_port = metrics_port
+        self.metrics_file = metrics_file
+        self.metrics_server = None
+        if self.metrics_port:
+            # bound now, so a port that's taken fails here (OSError), for whoever is starting the pool to report,
+            # rather than on the pool's thread
+            self.metrics_server = MetricsServer(self.metrics, self.metrics_port)
+        if self.notifier is not None:
+            self.notifier.metrics = self.metrics
+        self.duration = str(duration)
         self.dur_in_seconds = 0
-        self.frequency = frequency.get()
-        self.freq_in_seconds = int(self.frequency) * 60
+        self.frequency = str(frequency)
+        self.freq_in_seconds = float(self.frequency) * 60
+        if not frequencies:
+            frequencies = [self.frequency] * len(urls)
+        if not regions:
+            regions = [None] * len(urls)
+        self.set_entries(urls, matchers, frequencies, regions, profiles or ())
+        self.jitter = jitter
+        self.stream = stream
+        self.incremental = incremental
+        if self.duration != "None":
+            self.dur_in_seconds = int(self.duration) * 60 * 60
+        self.max_frequency = max_frequency
+        ceiling = None
+        if self.max_frequency:
+            ceiling = float(self.max_frequency) * 60
+        self.scheduler = MonitorScheduler(self.freqs_in_seconds, self.jitter, self.dur_in_seconds, ceiling,
+                                          self.cancel)
+        self.watcher = watcher
+        self.state_store = state_store
+        self.config_poll = config_poll
         self.start_time = 0
         self.current_time = 0
-        self.prev_file_size_list = [0] * (len(self.urls))
-        '''self.prev_found_keywords = [0] * (len(self.urls))
-        self.prev_stats = [self.prev_file_size_list, self.prev_found_keywords]
-        print(len(self.urls))'''
-        
+        self.url_states = {}
+        # ^ state key (see state_key()) -> UrlState; by url rather than position, so it survives the urls being
+        #   reloaded
+        for key in self.keys:
+            self.url_states[key] = UrlState()
+        self.max_workers = max_workers
+        self.scan_processes = scan_processes
+        self.scan_pool = None
+        self.corpus = corpus
+        self.profiler = profiler
+        self.fetcher = Fetcher()
+        # ^ one for the life of the pool, so connections (and dns lookups) are reused from one cycle to the next
+        if self.scan_processes:
+            # enough fetching threads to keep every process busy
+            self.max_workers = max(self.max_workers, self.scan_processes)
+        self.max_per_host = max_per_host
+        # ^ urls on the same host fetched at once, at most (see run_cycle())
+
+    def set_entries(self, urls, matchers, frequencies, regions, profiles):
+        # ^ flattens the unnamed profile (urls, matchers, frequencies in minutes, regions) and the named ones into the
+        #   pool's per-entry lists, one entry per url per profile (blank urls left out); the scheduler and url_states
+        #   work by entry, run_cycle fetches by url
+        self.urls = []
+        self.matchers = []
+        self.freqs_in_seconds = []
+        self.regions = []
+        self.profile_names = []
+        self.recipients = []
+        self.keys = []
+        sources = [("", urls, matchers, frequencies, regions, "")]
+        for profile in profiles:
+            sources.append(tuple(profile))
+        for name, profile_urls, profile_matchers, profile_frequencies, profile_regions, recipient in sources:
+            for url_count in range(len(profile_urls)):
+                if not profile_urls[url_count]:
+                    continue
+                self.urls.append(profile_urls[url_count])
+                self.matchers.append(profile_matchers[url_count])
+                self.freqs_in_seconds.append(float(profile_frequencies[url_count]) * 60)
+                self.regions.append(profile_regions[url_count])
+                self.profile_names.append(name)
+                self.recipients.append(recipient)
+                self.keys.append(MonitorPool.state_key(name, profile_urls[url_count]))
+
+    def state_key(profile_name, url):
+        # ^ what a profile's url is known by in url_states and the state store: the url itself for the unnamed
+        #   profile (as it always was), otherwise "NAME URL" (urls have no spaces)
+        if not profile_name:
+            return url
+        return profile_name + " " + url
+
     def run(self):
         # GLOBAL USE
         self.start_time = time.time()
-        
-        if self.duration != "None":
-            self.dur_in_seconds = int(self.duration) * 60 * 60
-            
-            while self.current_time < self.dur_in_seconds:
-                url_count = -1
-                if not globs.monitor_finished:    
-                    for url in self.urls:
-                        url_count = url_count + 1
-                        if not globs.monitor_finished:
-                            stats = self.create_worker(url, self.keywords[url_count], self.username, self.password,
-                                                       self.prev_file_size_list[url_count], url_count)
-
-                            self.current_time = time.time()
-                            self.current_time = self.current_time - self.start_time
-                        else:
-                            break
-                    
-                    messenger = Messenger([])
-                    messenger.queue_message(str(self.frequency), "sleeping")
-                    messenger.send_messages()
-                    self.doze(self.freq_in_seconds)
-                else:
-                    break
-                
-            messenger.queue_message("", "finished")
-            messenger.send_messages()
-       
-        elif self.duration == "None":
-            while not globs.monitor_finished:
-                url_count = -1     
-                for url in self.urls:
-                    url_count = url_count + 1
-                    if not globs.monitor_finished:
-                        self.create_worker(url, self.keywords[url_count], self.username, self.password,
-                                           self.prev_file_size_list[url_count], url_count)
-                    else:
-                        break
-
-                messenger = Messenger([])
-                messenger.queue_message(str(self.frequency), "sleeping")
-                messenger.send_messages()
-                self.doze(self.freq_in_seconds)
-                
-    def create_worker(self, url, keywords, username, password, prev_file_size, url_count):
-        worker = MonitorWorker(url, keywords, username, password, prev_file_size)
-        prev_file_size = worker.work()
-        self.prev_file_size_list[url_count] = prev_file_size
-                
-    def doze(self, duration):  
-        # ^ duration in seconds
-        doze_start = time.time()
-        present_time = 0
-        while present_time < duration:
-            if not globs.monitor_finished:
-                present_time = time.time()
-                present_time = present_time - doze_start
+        messenger = Messenger([])
+        if self.notifier is not None:
+            self.notifier.start()
+        if self.metrics_server is not None:
+            self.metrics_server.start()
+        if self.state_store is not None:
+            for key in self.keys:
+                self.url_states[key] = self.load_url_state(key)
+        if self.scan_processes:
+            self.scan_pool = ScanPool(self.scan_processes, self.matchers)
+
+        while not self.cancel.cancelled():
+            if self.watcher is not None:
+                due = self.scheduler.wait_for_due(self.config_poll)
+                if due is None:
+                    # nothing due yet; see whether the settings have been edited meanwhile
+                    self.check_config()
+                    continue
             else:
-                break 
+                due = self.scheduler.wait_for_due()
+            if not due:
+                break
+
+            profiling = self.profiler is not None and self.profiler.start_cycle()
+            cycle_start = time.perf_counter()
+            active = self.run_cycle(due)
+            for url_count in due:
+                self.scheduler.reschedule(url_count, active.get(url_count, True))
+            if self.metrics is not None:
+                self.record_cycle(time.perf_counter() - cycle_start, due)
+            if self.watcher is not None:
+                self.check_config()
+            if profiling:
+                self.report_profile(self.profiler.finish_cycle())
+
+            self.current_time = time.time()
+            self.current_time = self.current_time - self.start_time
+
+            if not self.scheduler.expired() and not self.cancel.cancelled():
+                messenger.queue_message(self.scheduler.next_due_in(), "sleeping", self.cancel)
+
+        if self.profiler is not None:
+            self.report_profile(self.profiler.stop())
+        if self.notifier is not None:
+            self.notifier.stop(NOTIFIER_STOP_TIMEOUT)
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        if self.state_store is not None:
+            self.state_store.close()
+        if self.corpus is not None:
+            self.corpus.close()
+        if self.scan_pool is not None:
+            # when stopped, without waiting for a scan that's under way (its result isn't wanted)
+            self.scan_pool.shutdown(not self.cancel.cancelled())
+        self.fetcher.close()
+
+        if self.scheduler.expired():
+            # tagged with the pool's token, so a UI that has since started another pool can tell it isn't that one
+            messenger.queue_message(self.cancel, "finished")
+
+    def stop(self):
+        # ^ from any thread; the pool finishes what it's doing (interrupting fetches and scans), saves its state and
+        #   ends, waiting at most NOTIFIER_STOP_TIMEOUT for emails already queued
+        self.cancel.cancel()
+
+    def run_cycle(self, due):
+        # ^ due: indexes of the urls (entries) to check this time around; all fetched / scanned at once, so the cycle
+        #   takes as long as the slowest page, and each url once however many profiles are due to check it. Returns
+        #   url index -> whether the url is active (changed, or has an incident open), for the scheduler
+        workers = []
+        groups = {}
+        # ^ url -> its workers, one per profile due to check it
+        cycle_cancel = self.cancel.child(self.cycle_timeout)
+        for url_count in due:
+            url = self.urls[url_count]
+            worker = self.create_worker(url, self.matchers[url_count], self.notifier,
+                                        self.url_states[self.keys[url_count]], self.regions[url_count], cycle_cancel,
+                                        self.profile_names[url_count], self.recipients[url_count])
+            workers.append(worker)
+            groups.setdefault(url, []).append(worker)
+
+        # each host's urls wait in a queue here, and only max_per_host of them are handed to the executor at a time
+        # (the next as one finishes), so a host with many urls doesn't tie up threads waiting on it while other
+        # hosts' urls could be fetched
+        host_queues = {}
+        for group in groups.values():
+            host = urllib.parse.urlsplit(group[0].url).netloc
+            host_queues.setdefault(host, collections.deque()).append(group)
+        url_states = {}
+        # ^ worker -> its new UrlState
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            running = {}
+            # ^ future -> (its group, the queue of the group's host)
+            for host_queue in host_queues.values():
+                for group_count in range(min(self.max_per_host, len(host_queue))):
+                    group = host_queue.popleft()
+                    running[executor.submit(self.run_workers, group)] = (group, host_queue)
+            while running:
+                done, pending = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    group, host_queue = running.pop(future)
+                    try:
+                        group_states = future.result()
+                    except Exception as error:
+                        # whatever went wrong with one url (run_workers() reports the errors it expects), the rest
+                        # of the cycle, and the pool, carry on
+                        Messenger([]).queue_message("couldn't check " + group[0].url + ": " + repr(error), "error")
+                        group_states = [None] * len(group)
+                    for worker, url_state in zip(group, group_states):
+                        url_states[worker] = url_state
+                    if host_queue:
+                        next_group = host_queue.popleft()
+                        running[executor.submit(self.run_workers, next_group)] = (next_group, host_queue)
+        cycle_cancel.close()
+
+        # hand results back in url order so the UI output doesn't depend on which page finished first
+        messenger = Messenger([])
+        active = {}
+        for url_count, worker in zip(due, workers):
+            url_state = url_states[worker]
+            if url_state is not None:
+                if self.state_store is not None:
+                    self.save_url_state(worker, self.url_states[worker.key], url_state)
+                self.url_states[worker.key] = url_state
+                active[url_count] = worker.changed or bool(url_state.incidents.open)
+            for message in worker.messages:
+                messenger.queue_message(message[0], message[1], self.cancel)
+        if self.state_store is not None:
+            self.state_store.commit()
+        if self.corpus is not None:
+            self.corpus.commit()
+        return active
+
+    def check_config(self):
+        new_config = self.watcher.poll()
+        if new_config is not None:
+            self.apply_config(new_config)
+            Messenger([]).queue_message(str(len(self.urls)), "reloaded", self.cancel)
+
+    def apply_config(self, new_config):
+        # ^ swaps in a reloaded config.MonitorConfig; only called between cycles, from the pool's thread. Urls still
+        #   in the settings keep their state (validators, digest, snapshot), so they aren't fetched or scanned again
+        #   just because of the reload, and keep their place in the schedule; new urls are checked straight away
+        prev_indexes = {}
+        for url_count in range(len(self.keys)):
+            prev_indexes.setdefault(self.keys[url_count], url_count)
+
+        self.set_entries(new_config.urls, new_config.matchers, new_config.frequencies, new_config.regions,
+                         new_config.profiles)
+        url_states = {}
+        for key in self.keys:
+            if key in self.url_states:
+                url_states[key] = self.url_states[key]
+            else:
+                url_states[key] = self.load_url_state(key)
+        self.url_states = url_states
+        if self.scan_pool is not None:
+            self.scan_pool.update(self.matchers)
+        self.scheduler.replace_urls(self.freqs_in_seconds, [prev_indexes.get(key) for key in self.keys])
+
+    def load_url_state(self, key):
+        # ^ what the state store has for the url (by state_key()) from a previous run, else a fresh UrlState
+        if self.state_store is None:
+            return UrlState()
+        saved = self.state_store.load_url_state(key)
+        if saved is None:
+            return UrlState()
+        url_state = UrlState(saved["etag"], saved["last_modified"], saved["digest"], fingerprint=saved["fingerprint"])
+        url_state.incidents = IncidentIndex([Incident(incident_fingerprint, keyword, first_seen) for
+                                             incident_fingerprint, keyword, first_seen in
+                                             self.state_store.load_open_incidents(key)])
+        if saved["lines"] is not None:
+            url_state.snapshot = PageSnapshot.unpack(saved)
+        return url_state
+
+    def save_url_state(self, worker, prev_state, url_state):
+        # ^ into the store's open transaction; run_cycle commits once all the cycle's workers are saved
+        now = time.time()
+        if url_state is not prev_state:
+            snapshot = None
+            if url_state.snapshot is not None and url_state.snapshot is not prev_state.snapshot:
+                snapshot = url_state.snapshot.pack()
+            self.state_store.save_url_state(worker.key, url_state.etag, url_state.last_modified, url_state.digest,
+                                            now, snapshot, url_state.fingerprint)
+            if url_state.incidents is not prev_state.incidents:
+                self.state_store.save_open_incidents(worker.key, [(incident.fingerprint, incident.keyword,
+                                                                   incident.first_seen) for incident in
+                                                                  url_state.incidents.open.values()])
+
+        for info, action in worker.messages:
+            if action == "new incident" or action == "incident cleared":
+                self.state_store.add_incident(worker.key, now, action, info[0])
+            if action != "email":
+                keywords = ""
+                if isinstance(info, list):
+                    keywords = info[0]
+                self.state_store.save_result(worker.key, now, action, keywords)
+
+    def report_profile(self, path):
+        # ^ path: the profiler's text report, once it has written one
+        if path is not None:
+            Messenger([]).queue_message(path, "profiled", self.cancel)
+
+    def record_cycle(self, cycle_time, due):
+        self.metrics.observe("mdp_cycle_seconds", cycle_time)
+        for url_count in due:
+            self.metrics.set("mdp_poll_interval_seconds", self.scheduler.interval(url_count), url=self.keys[url_count])
+        self.metrics.set("mdp_messenger_queue_depth", Messenger.get_queue_depth())
+        self.metrics.inc("mdp_messages_dropped_total", Messenger.take_dropped())
+        if self.metrics_file:
+            try:
+                self.metrics.write_snapshot(self.metrics_file)
+            except OSError as error:
+                Messenger([]).queue_message("couldn't write metrics: " + str(error), "error")
+
+    def create_worker(self, url, matcher, notifier, prev_state, regions=None, cancel=None, profile_name="",
+                      recipient=""):
+        return MonitorWorker(url, matcher, notifier, prev_state, self.stream, self.incremental, self.metrics,
+                             self.scan_pool, self.fetcher, regions, cancel, profile_name, recipient, self.corpus)
+
+    def run_workers(self, workers):
+        # ^ runs on an executor thread, for a url's workers (one per profile checking it); returns their new
+        #   UrlStates, or Nones if the monitor was stopped, or the cycle ran out of time, before they got a turn or
+        #   while they were working, or the url couldn't be fetched
+        url = workers[0].url
+        if workers[0].cancel.cancelled() or self.scheduler.expired():
+            return [None] * len(workers)
+        try:
+            if self.profiler is not None and self.profiler.active:
+                return self.profiler.call(MonitorWorker.work_together, workers)
+            return MonitorWorker.work_together(workers)
+        except Cancelled:
+            if not self.cancel.cancelled():
+                Messenger([]).queue_message("gave up on " + url + ": took longer than the cycle allows", "error")
+        except (OSError, http.client.HTTPException) as error:
+            Messenger([]).queue_message("couldn't check " + url + ": " + str(error), "error")
+        return [None] * len(workers)
+
+class UrlState():
+    # What the worker remembers about a url between cycles: the validators the server sent (to make the next
+    # request conditional), a digest of the last body, so an edit that keeps the same length still counts, and (when
+    # incremental) a snapshot of the page's lines; and the incidents open on the page (see incidents.py).
+    def __init__(self, etag=None, last_modified=None, digest=None, snapshot=None, incidents=None, fingerprint=None):
+        # ^ fingerprint: MonitorWorker.scan_fingerprint() of the keywords / regions the page was last scanned with
+        self.etag = etag
+        self.last_modified = last_modified
+        self.digest = digest
+        self.fingerprint = fingerprint
+        self.snapshot = snapshot
+        self.incidents = incidents
+        if self.incidents is None:
+            self.incidents = IncidentIndex()
+
+class PageSnapshot():
+    # Compact record of a page: how many times each distinct line (by hash) appears, and which of those lines had
+    # keywords on them, so the next cycle only scans the lines it hasn't seen before.
+    def __init__(self, fingerprint=None):
+        self.fingerprint = fingerprint
+        # ^ MonitorWorker.scan_fingerprint(), i.e. which keywords (in which regions) hits / neg were found with
+        self.lines = {}
+        # ^ line hash -> count
+        self.hits = {}
+        # ^ line hash -> positive keywords on the line (only lines that have some)
+        self.neg = set()
+        # ^ hashes of lines with a negative keyword
+        self.blocks = {}
+        # ^ line hash -> incidents.block_key of the line (only lines with positive keywords)
+
+    def line_hash(line):
+        return line_hash(line)
+
+    def pack(self):
+        # ^ as stored by state.py: lines as hash + 4-byte count records, neg as concatenated hashes, hits as json
+        lines = b"".join(line_hash + count.to_bytes(4, "big") for line_hash, count in self.lines.items())
+        hits = {}
+        for line_hash in self.hits:
+            hits[line_hash.hex()] = [self.blocks.get(line_hash, "")] + list(self.hits[line_hash])
+        return dict(fingerprint=self.fingerprint, lines=lines, hits=json.dumps(hits), neg=b"".join(self.neg))
+
+    def unpack(saved):
+        snapshot = PageSnapshot(saved["fingerprint"])
+        lines = saved["lines"]
+        record_size = LINE_HASH_SIZE + 4
+        for start in range(0, len(lines), record_size):
+            snapshot.lines[lines[start:start + LINE_HASH_SIZE]] = int.from_bytes(
+                lines[start + LINE_HASH_SIZE:start + record_size], "big")
+        for line_hash, hit in json.loads(saved["hits"] or "{}").items():
+            # hit: the line's block key, then its keywords
+            snapshot.hits[bytes.fromhex(line_hash)] = tuple(hit[1:])
+            if hit[0]:
+                snapshot.blocks[bytes.fromhex(line_hash)] = hit[0]
+        neg = saved["neg"] or b""
+        for start in range(0, len(neg), LINE_HASH_SIZE):
+            snapshot.neg.add(neg[start:start + LINE_HASH_SIZE])
+        return snapshot
 
 class MonitorWorker():
-    def __init__(self, url, keywords, username, password, prev_file_size):
+    def __init__(self, url, matcher, notifier, prev_state, stream=STREAM, incremental=INCREMENTAL, metrics=None,
+                 scan_pool=None, fetcher=None, regions=None, cancel=None, profile_name="", recipient="", corpus=None):
+        # ^ scan_pool: a scanner.ScanPool to scan the page in; the whole page is then read before it's scanned;
+        #   fetcher: a fetch.Fetcher, shared so connections are reused; regions: None to scan the raw HTML, else
+        #   extract.py's regions of the page to scan the text of (empty for all of it); cancel: the cycle's
+        #   CancelToken, which interrupts the fetch / scan when cancelled (then work() raises Cancelled);
+        #   profile_name, recipient: the config.Profile it's checking the url for, if not the unnamed one; corpus: a
+        #   corpus.CorpusWriter to record the response in (the whole page is then read, not just up to a keyword)
         self.url = url
-        self.keywords = keywords
-        self.username = username
-        self.password = password
-        self.prev_file_size = prev_file_size
-        '''self.prev_stats = prev_stats
-        self.prev_file_size = prev_stats[0]'''
+        self.corpus = corpus
+        self.profile_name = profile_name
+        self.recipient = recipient
+        self.key = MonitorPool.state_key(profile_name, url)
+        self.label = url
+        # ^ the url as the messages show it: with the profile's name after it, if it has one
+        if profile_name:
+            self.label = url + " (" + profile_name + ")"
+        self.cancel = cancel
+        if self.cancel is None:
+            self.cancel = CancelToken()
+        self.regions = regions
+        self.scan_pool = scan_pool
+        self.fetcher = fetcher
+        if self.fetcher is None:
+            self.fetcher = Fetcher()
+        self.metrics = metrics
+        self.matcher = matcher
+        self.notifier = notifier
+        self.prev_state = prev_state
+        self.stream = stream
+        self.fingerprint = MonitorWorker.scan_fingerprint(matcher, regions)
+        self.snapshot = None
+        if incremental:
+            self.snapshot = PageSnapshot(self.fingerprint)
+        self.rescan = prev_state.digest is not None and prev_state.fingerprint != self.fingerprint
+        # ^ True if the keywords / regions have been changed (settings reloaded) since the page was last scanned, so
+        #   it's scanned again (and fetched unconditionally) even if it hasn't changed
+        self.carry_hits = (prev_state.snapshot is not None
+                           and prev_state.snapshot.fingerprint == self.fingerprint)
+        # ^ False if so since the last snapshot, so lines it had seen are scanned again
+        self.messages = []
+        self.found_pos_key = False
+        self.found_neg_key = False
+        self.found_keywords = []
+        self.fingerprints = {}
+        # ^ when not incremental, fingerprint -> keyword of each incident seen on the page
+        self.complete = True
+        # ^ False if reading stopped early (streaming, not incremental), so not every incident on the page was seen
+        self.changed = False
+        # ^ whether the page was different from last time (or is to be scanned again anyway, see rescan)
+        self.bytes_read = 0
+        self.scan_time = 0
     
     def work(self):
-        local_filename, headers = urllib.request.urlretrieve(self.url)
-        local_file_size = os.stat(local_filename).st_size
-
-        with open(local_filename, 'rt', encoding='utf-8') as file:
-            if self.prev_file_size != local_file_size:
-                found_pos_key = False
-                found_neg_key = False
-                found_keyword = ""
-
-                line_count = 0
-
-                for line in file:
-                    #print("line # " + str(line_count) + ": " + line + "\n")
-                    line_count = line_count + 1
-                    if not globs.monitor_finished:
-                        for keyword in self.keywords:
-                            #print("testing keyword " + keyword + "\n")
-                            if re.match("\^", keyword): 
-                                 if not re.search(keyword, line, re.IGNORECASE):
-                                     #print(line + " neg-matches " + keyword + "\n")
-                                     found_neg_key = True
-                            else:
-                                if re.search(keyword, line, re.IGNORECASE):
-                                    #print(line + " matches " + keyword + "\n")
-                                    found_pos_key = True
-                                    found_keyword = keyword
-                                    break
-                    
-                if not globs.monitor_finished:
-                    if found_pos_key == True:
-                        self.queue_and_email(found_keyword)
-                        self.prev_file_size = local_file_size
-                    elif found_pos_key == False and found_neg_key == False:
-                        self.queue_and_email(found_keyword)
-                        self.prev_file_size = local_file_size
-                    else:
-                        messenger = Messenger([])
-                        messenger.queue_message(self.url, "no incident")
-                        self.prev_file_size = local_file_size
+        # ^ returns the url's new UrlState
+        return MonitorWorker.work_together([self])[0]
+
+    def work_together(workers):
+        # ^ workers: one per profile due to check the same url (the first's fetcher / cancel are used); the page is
+        #   fetched once and each scans it with its own matcher. Returns their new UrlStates, in the same order
+        first = workers[0]
+        response = first.fetcher.fetch(first.url, MonitorWorker.validators(workers), first.cancel)
+        if response.status == 304:
+            # not modified; nothing sent, nothing to scan
+            response.close()
+            if first.corpus is not None:
+                first.corpus.add(first.url, time.time(), response.status, response.headers.items())
+            first.record_fetch("not modified", response, 0)
+            for worker in workers:
+                if worker.metrics is not None:
+                    worker.metrics.observe("mdp_scan_seconds", 0, url=worker.url)
+                worker.queue_message(worker.label, "no change")
+            return [worker.prev_state for worker in workers]
+
+        read_start = time.perf_counter()
+        with response:
+            if len(workers) == 1 and first.stream and first.scan_pool is None and first.corpus is None:
+                states = [first.read_page(response)]
+            else:
+                body = response.read()
+                digest = hashlib.sha256(body).hexdigest()
+                if first.corpus is not None:
+                    first.corpus.add(first.url, time.time(), response.status, response.headers.items(), body, digest)
+                states = [worker.take_body(response, body, digest) for worker in workers]
+
+        scan_time = 0
+        changed = False
+        for worker in workers:
+            scan_time = scan_time + worker.scan_time
+            changed = changed or worker.changed
+        first.record_fetch("changed" if changed else "unchanged", response,
+                           time.perf_counter() - read_start - scan_time)
+        return [worker.report(state) for worker, state in zip(workers, states)]
+
+    def scan_fingerprint(matcher, regions):
+        # ^ what a page's scan results depend on besides the page: the keywords, and which regions of it were scanned
+        if regions is None:
+            return matcher.fingerprint
+        return hashlib.blake2b((matcher.fingerprint + repr(regions)).encode("utf-8"), digest_size=8).hexdigest()
+
+    def validators(workers):
+        # ^ headers making the request conditional, if all the workers last saw the page with the same validators (a
+        #   profile that's new to the url hasn't seen it at all, and needs it sent whether it has changed or not) and
+        #   none of them is to scan it again with different keywords
+        headers = {}
+        for worker in workers:
+            if worker.rescan:
+                return headers
+        etags = set(worker.prev_state.etag for worker in workers)
+        last_modifieds = set(worker.prev_state.last_modified for worker in workers)
+        if len(etags) == 1 and None not in etags:
+            headers["If-None-Match"] = etags.pop()
+        if len(last_modifieds) == 1 and None not in last_modifieds:
+            headers["If-Modified-Since"] = last_modifieds.pop()
+        return headers
+
+    def read_page(self, response):
+        # ^ scans the page as it comes in, and (unless incremental, which needs the whole page) hangs up as soon as
+        #   the result is decided (a positive keyword); the digest then only covers what was read, which is all that
+        #   decided the result. Returns the new UrlState, before report()
+        hasher = hashlib.sha256()
+        if self.regions is None:
+            lines = self.read_lines(response, hasher)
+        else:
+            lines = extract_lines(self.read_text(response, hasher), self.regions)
+        for line in lines:
+            if self.cancel.cancelled() or self.take_line(line):
+                break
+        state = UrlState(response.headers.get("ETag"), response.headers.get("Last-Modified"), hasher.hexdigest(),
+                         fingerprint=self.fingerprint)
+        self.changed = self.prev_state.digest != state.digest or self.rescan
+        return state
+
+    def take_body(self, response, body, digest):
+        # ^ scans a page already read in full (digest: of body), if it has changed (or rescan). Returns the new
+        #   UrlState, before report()
+        self.bytes_read = len(body)
+        state = UrlState(response.headers.get("ETag"), response.headers.get("Last-Modified"), digest,
+                         fingerprint=self.fingerprint)
+        self.changed = self.prev_state.digest != state.digest or self.rescan
+        if self.changed and self.scan_pool is not None:
+            self.take_scan_result(self.scan_pool.scan(self.matcher, body, self.regions, self.cancel))
+        elif self.changed:
+            text = body.decode('utf-8', errors='replace')
+            if self.regions is None:
+                lines = io.StringIO(text)
+            else:
+                lines = extract_lines([text], self.regions)
+            for line in lines:
+                if self.cancel.cancelled() or self.take_line(line):
+                    break
+        return state
+
+    def report(self, state):
+        # ^ compares what was found on the page with the incidents open before, queues the messages / emails, and
+        #   returns the finished UrlState
+        if self.metrics is not None:
+            self.metrics.observe("mdp_scan_seconds", self.scan_time, url=self.url)
+
+        if self.cancel.cancelled():
+            # stopped part way through; leave the state alone so the page gets scanned properly next time
+            return self.prev_state
+
+        if self.snapshot is not None:
+            if self.changed:
+                state.snapshot = self.snapshot
+            else:
+                state.snapshot = self.prev_state.snapshot
+
+        if self.changed:
+            # only incidents that have turned up or gone away since last time are reported; ongoing ones (an edit
+            # elsewhere on a page still showing the same closure) aren't emailed again
+            state.incidents, new, ongoing, cleared = self.prev_state.incidents.update(self.current_incidents(),
+                                                                                      time.time(), self.complete)
+            if cleared:
+                self.queue_and_email(self.keyword_text(cleared), "incident cleared")
+            if new:
+                self.found_keywords = IncidentIndex.keywords(new)
+                if self.metrics is not None:
+                    self.metrics.inc("mdp_keyword_hits_total", len(new), url=self.url)
+                self.queue_and_email(self.keyword_text(new))
+            elif ongoing:
+                self.queue_message([self.keyword_text(ongoing), self.label], "ongoing")
+            elif not cleared:
+                self.queue_message(self.label, "no incident")
+        else:
+            # same body (server just doesn't support / didn't honour the conditional request)
+            state.incidents = self.prev_state.incidents
+            self.queue_message(self.label, "no change")
+
+        return state
+
+    def match(self, line):
+        scan_start = time.perf_counter()
+        result = self.matcher.scan(line)
+        self.scan_time = self.scan_time + time.perf_counter() - scan_start
+        return result
+
+    def record_fetch(self, result, response, transfer_time):
+        if self.metrics is None:
+            return
+        self.metrics.inc("mdp_fetches_total", url=self.url, result=result)
+        self.metrics.inc("mdp_connections_total", url=self.url, reused=str(response.reused).lower())
+        if not response.reused:
+            self.metrics.observe("mdp_dns_seconds", response.dns_time, url=self.url)
+            self.metrics.observe("mdp_connect_seconds", response.connect_time, url=self.url)
+        self.metrics.observe("mdp_response_seconds", response.wait_time, url=self.url)
+        if result != "not modified":
+            self.metrics.observe("mdp_transfer_seconds", max(transfer_time, 0), url=self.url)
+            self.metrics.inc("mdp_bytes_downloaded_total", response.compressed_bytes, url=self.url)
+
+    def read_text(self, response, hasher):
+        # ^ decodes the response a chunk at a time, yielding the text of each
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        while True:
+            chunk = response.read(CHUNK_SIZE)
+            self.bytes_read = self.bytes_read + len(chunk)
+            hasher.update(chunk)
+            yield decoder.decode(chunk, final=not chunk)
+            if not chunk:
+                break
+
+    def read_lines(self, response, hasher):
+        # ^ yields whole lines of the response; only one chunk plus one partial line (at most MAX_LINE_SIZE) is held
+        #   at once, however big the page is
+        partial = ""
+
+        for text in self.read_text(response, hasher):
+            partial = partial + text
+            lines = partial.split("\n")
+            partial = lines.pop()
+            for line in lines:
+                yield line + "\n"
+
+            if len(partial) > MAX_LINE_SIZE:
+                # very long line (minified html); scan what's there, keeping an overlap so a keyword cut in two
+                # still gets found
+                yield partial
+                partial = partial[-LINE_OVERLAP:]
+
+        if partial:
+            yield partial
+
+    def take_line(self, line):
+        # ^ returns True once the rest of the page needn't be read
+        if self.snapshot is None:
+            return self.scan_line(line)
+
+        # incremental: lines seen last cycle aren't scanned again, their results are carried over
+        line_hash = PageSnapshot.line_hash(line)
+        count = self.snapshot.lines.get(line_hash, 0)
+        self.snapshot.lines[line_hash] = count + 1
+        if count:
+            return False
+
+        prev = self.prev_state.snapshot
+        if self.carry_hits and line_hash in prev.lines:
+            if line_hash in prev.hits:
+                self.snapshot.hits[line_hash] = prev.hits[line_hash]
+                self.snapshot.blocks[line_hash] = prev.blocks.get(line_hash) or block_key(line)
+            if line_hash in prev.neg:
+                self.snapshot.neg.add(line_hash)
+        else:
+            found_keywords, found_neg = self.match(line)
+            if found_keywords:
+                self.snapshot.hits[line_hash] = tuple(found_keywords)
+                self.snapshot.blocks[line_hash] = block_key(line)
+            if found_neg:
+                self.snapshot.neg.add(line_hash)
+        return False
+
+    def take_scan_result(self, result):
+        # ^ what a scanning process found on the page: the snapshot gets only the lines with keywords, which is all
+        #   the incidents need (a later thread-scanned cycle just rescans the rest)
+        hits, neg, scan_time = result
+        self.scan_time = self.scan_time + scan_time
+        for hashed, key, keywords in hits:
+            if self.snapshot is not None:
+                self.snapshot.lines[hashed] = 1
+                self.snapshot.hits[hashed] = keywords
+                self.snapshot.blocks[hashed] = key
+            else:
+                self.found_pos_key = True
+                for keyword in keywords:
+                    self.fingerprints[fingerprint(key, keyword)] = keyword
+        for hashed in neg:
+            if self.snapshot is not None:
+                self.snapshot.lines[hashed] = 1
+                self.snapshot.neg.add(hashed)
             else:
-                messenger = Messenger([])
-                messenger.queue_message(self.url, "no change")
-
-        return self.prev_file_size
-
-    def queue_and_email(self, found_keyword):
-        def email(found_keyword):
-            def parse_url(url):
-                new_url = ""
-                if re.match("https:", url):
-                    new_url = url[8:]
-                elif re.match("http:", url):
-                    new_url = url[7:]
-                elif re.match("www.", url):
-                    new_url = url[4:]
-                return new_url
-
-            new_url = parse_url(self.url)
-                
-            address = self.username + "@gmail.com"
-            msg = "New incident at " + new_url + "\n" + "(found keyword: " + found_keyword + ")"
-
-            username = self.username
-            password = self.password
-
-            # Start the server using gmail's servers
-            server = smtplib.SMTP('smtp.gmail.com:587')
-            server.starttls()
-            server.login(username, password)
-            server.sendmail(address, address, msg)
-
-            # Log off
-            server.quit()
-            
+                self.found_neg_key = True
+
+    def current_incidents(self):
+        # ^ fingerprint -> keyword for each incident on the page as it is now: one per positive keyword per line,
+        #   or, if the page has neither positive nor negative keywords, the page-wide one (keyword "")
+        current = {}
+        found_neg = self.found_neg_key
+        if self.snapshot is not None:
+            for line_hash, keywords in self.snapshot.hits.items():
+                for keyword in keywords:
+                    current[fingerprint(self.snapshot.blocks[line_hash], keyword)] = keyword
+            found_neg = bool(self.snapshot.neg)
+        else:
+            current.update(self.fingerprints)
+
+        if not current and not found_neg and self.complete:
+            current[fingerprint("", "")] = ""
+        return current
+
+    def keyword_text(self, incidents):
+        # ^ the incidents' keywords, in settings order (any no longer in the settings last)
+        keywords = IncidentIndex.keywords(incidents)
+        ordered = [keyword for keyword in self.matcher.pos_keywords if keyword in keywords]
+        ordered.extend(keyword for keyword in keywords if keyword not in ordered)
+        return ", ".join(ordered)
+
+    def scan_line(self, line):
+        # ^ returns True once the result for the page is decided (a positive keyword was found) and streaming, where
+        #   the rest of the page isn't read; otherwise the whole page is scanned, to report every keyword on it
+        found_keywords, found_neg = self.match(line)
+        if found_keywords:
+            key = block_key(line)
+            for keyword in found_keywords:
+                self.found_pos_key = True
+                self.fingerprints[fingerprint(key, keyword)] = keyword
+        if found_neg:
+            self.found_neg_key = True
+        if self.found_pos_key and self.stream:
+            self.complete = False
+            return True
+        return False
+
+    def queue_and_email(self, found_keyword, action="new incident"):
+        # ^ action: "new incident" or "incident cleared"
         info = []
         info.append(found_keyword)
-        info.append(self.url)
-        messenger = Messenger([])
-        messenger.queue_message(info, "new incident")
+        info.append(self.label)
+        self.queue_message(info, action)
         
-        if self.username:
-            messenger.queue_message(self.username, "email")
-            email(found_keyword)
+        if self.notifier is not None:
+            # sent from the notifier's thread; the worker doesn't wait on smtp
+            self.queue_message(self.recipient or self.notifier.username, "email")
+            self.notifier.notify(self.url, found_keyword, action, self.recipient)
+
+    def queue_message(self, info, action):
+        # ^ held until the pool hands the whole cycle to the messenger, in url order
+        self.messages.append([info, action])
                     
     
 
@@ -0,0 +1,186 @@
+# MDP Incident Monitor App
+
+"""On-demand profiling of the pool's cycles, for when they get slow on a running monitor: asked for, the next few
+cycles (PROFILE_CYCLES) are run under cProfile, the pool's thread and each url's MonitorWorker.work_together() on the
+fetching threads alike, with tracemalloc tracing allocations meanwhile. Afterwards, in PROFILE_DIRECTORY:
+  profile-YYYYMMDD-HHMMSS.prof   the combined cProfile stats (python3 -m pstats, snakeviz, ...)
+  profile-YYYYMMDD-HHMMSS.txt    cycle times, then the top functions by cumulative time
+  memory-YYYYMMDD-HHMMSS.txt     the top allocation sites at the end, and what grew while profiling
+
+Asked for by request() (monitord.py's SIGUSR1 handler, monitorapp.py's Debug menu), or by creating the control file
+(profile.now, in this directory; it may hold a number of cycles), which the pool checks for between cycles and
+removes. When not profiling the pool and workers only check a flag: no profiler or tracing is set up until asked for.
+"""
+
+import cProfile
+import datetime
+import io
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+
+from messenger import Messenger
+
+_PATH = os.path.dirname(os.path.realpath(__file__))
+PROFILE_DIRECTORY = os.path.join(_PATH, "profiles")
+CONTROL_PATH = os.path.join(_PATH, "profile.now")
+PROFILE_CYCLES = 5
+TRACEMALLOC_FRAMES = 10
+REPORT_LINES = 40
+# ^ functions / allocation sites listed in the text reports
+
+class Profiler():
+    # Used from the pool's thread (start_cycle / finish_cycle) and its fetching threads (call); request() from any
+    # thread, or a signal handler.
+    def __init__(self, directory=PROFILE_DIRECTORY, control_path=CONTROL_PATH, frames=TRACEMALLOC_FRAMES):
+        # ^ control_path: None for no control file; frames: how much of the stack tracemalloc keeps per allocation
+        self.directory = directory
+        self.control_path = control_path
+        self.frames = frames
+        self.active = False
+        # ^ whether the cycle under way is being profiled
+        self._requested = 0
+        self._cycles_left = 0
+        self._lock = threading.Lock()
+        self._stats = None
+        # ^ pstats.Stats, everything profiled so far merged
+        self._cycle_profile = None
+        self._cycle_start = 0
+        self._cycle_times = []
+        self._first_snapshot = None
+        self._started_tracing = False
+
+    def request(self, cycles=PROFILE_CYCLES):
+        # ^ profile the next cycles cycles (starting the count again, if already profiling)
+        self._requested = cycles
+
+    def check_control(self):
+        if self.control_path is None or not os.path.exists(self.control_path):
+            return
+        try:
+            with open(self.control_path, 'r', encoding="utf-8") as file:
+                text = file.read().strip()
+            os.remove(self.control_path)
+        except OSError as error:
+            Messenger([]).queue_message("couldn't read the profiling control file: " + str(error), "error")
+            return
+        if text.isdigit() and int(text) > 0:
+            self.request(int(text))
+        else:
+            self.request()
+
+    def start_cycle(self):
+        # ^ before each cycle; returns whether it's to be profiled
+        self.check_control()
+        if self._requested:
+            if not self.active:
+                self.begin()
+            self._cycles_left = self._requested
+            self._requested = 0
+        if not self.active:
+            return False
+        self._cycle_start = time.perf_counter()
+        self._cycle_profile = self.enable()
+        return True
+
+    def finish_cycle(self):
+        # ^ after a profiled cycle; returns the text report's path once the last of them is done (else None)
+        self.disable(self._cycle_profile)
+        self._cycle_profile = None
+        self._cycle_times.append(time.perf_counter() - self._cycle_start)
+        self._cycles_left = self._cycles_left - 1
+        if self._cycles_left > 0:
+            return None
+        return self.end()
+
+    def stop(self):
+        # ^ the pool is ending; reports on whatever was profiled, if it was part way through (returns as end())
+        if not self.active:
+            return None
+        self.disable(self._cycle_profile)
+        self._cycle_profile = None
+        return self.end()
+
+    def call(self, function, *args):
+        # ^ function(*args), profiled; cProfile only sees the thread it's enabled on, so work done on the fetching
+        #   threads goes through this
+        profile = self.enable()
+        try:
+            return function(*args)
+        finally:
+            self.disable(profile)
+
+    def enable(self):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12 on: only one profiler at a time, but the one enabled for the cycle then sees every thread
+            return None
+        return profile
+
+    def disable(self, profile):
+        if profile is None:
+            return
+        profile.disable()
+        profile.create_stats()
+        if not profile.stats:
+            return
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profile)
+            else:
+                self._stats.add(profile)
+
+    def begin(self):
+        self.active = True
+        self._stats = None
+        self._cycle_times = []
+        self._started_tracing = not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start(self.frames)
+        self._first_snapshot = tracemalloc.take_snapshot()
+
+    def end(self):
+        # ^ writes the reports; returns the text report's path, or None if they couldn't be written
+        self.active = False
+        snapshot = tracemalloc.take_snapshot()
+        if self._started_tracing:
+            tracemalloc.stop()
+        first_snapshot = self._first_snapshot
+        self._first_snapshot = None
+        try:
+            return self.write_reports(snapshot, first_snapshot)
+        except OSError as error:
+            Messenger([]).queue_message("couldn't write the profile: " + str(error), "error")
+            return None
+
+    def write_reports(self, snapshot, first_snapshot):
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        text_path = os.path.join(self.directory, "profile-" + stamp + ".txt")
+
+        report = io.StringIO()
+        report.write(str(len(self._cycle_times)) + " cycles profiled, taking "
+                     + ", ".join("%.3f" % cycle_time for cycle_time in self._cycle_times) + " s\n\n")
+        if self._stats is not None:
+            self._stats.dump_stats(os.path.join(self.directory, "profile-" + stamp + ".prof"))
+            self._stats.stream = report
+            self._stats.sort_stats("cumulative").print_stats(REPORT_LINES)
+        with open(text_path, 'w', encoding="utf-8") as file:
+            file.write(report.getvalue())
+
+        # the profiling's own allocations (the stats, tracemalloc's snapshots) would otherwise top the list
+        filters = [tracemalloc.Filter(False, module.__file__) for module in (cProfile, pstats, tracemalloc)]
+        snapshot = snapshot.filter_traces(filters)
+        first_snapshot = first_snapshot.filter_traces(filters)
+        with open(os.path.join(self.directory, "memory-" + stamp + ".txt"), 'w', encoding="utf-8") as file:
+            file.write("Allocated at the end of profiling, by line:\n")
+            for statistic in snapshot.statistics("lineno")[:REPORT_LINES]:
+                file.write(str(statistic) + "\n")
+            file.write("\nGrowth while profiling, by line:\n")
+            for difference in snapshot.compare_to(first_snapshot, "lineno")[:REPORT_LINES]:
+                file.write(str(difference) + "\n")
+        return text_path
@@ -0,0 +1,139 @@
+# MDP Incident Monitor App
+
+"""Keyword scanning in worker processes, for pool.py when it's given scan_processes: the regex work holds the GIL, so
+with many large pages the threads fetching them would otherwise take turns scanning.
+
+The pool's threads still fetch (and hash) the pages; a changed page's body is handed to a process, which scans it
+with a matcher it compiled once when it started (not per page) and sends back only what was found: the lines with
+keywords on them, as (line hash, incidents.block_key, keywords), the hashes of lines with negative keywords, and the
+time it took. The settings being reloaded with different keywords restarts the processes (between cycles). So does a
+process dying (killed for memory, say): the scans it took down with it raise ScanError, an OSError, and the url is
+checked again next cycle.
+"""
+
+import concurrent.futures
+import concurrent.futures.process
+import hashlib
+import io
+import multiprocessing
+import threading
+import time
+
+from cancel import Cancelled
+from extract import extract_lines
+from incidents import block_key
+from matcher import KeywordMatcher
+
+LINE_HASH_SIZE = 8
+SCAN_TIMEOUT = 2 * 60
+# ^ seconds a page's scan may take (queueing for a process included)
+
+_matchers = {}
+# ^ in a scanning process: matcher fingerprint -> KeywordMatcher
+
+def line_hash(line):
+    return hashlib.blake2b(line.encode('utf-8'), digest_size=LINE_HASH_SIZE).digest()
+
+def initialize(keyword_lists):
+    # runs once in each process as it starts
+    for keywords in keyword_lists:
+        matcher = KeywordMatcher(keywords)
+        _matchers[matcher.fingerprint] = matcher
+
+def scan_body(matcher_fingerprint, body, regions=None):
+    # ^ runs in a scanning process; returns (hits, neg, scan time), hits as (line hash, block key, keywords), neg as
+    #   line hashes; a line repeated on the page is only scanned (and reported) once. regions: as for the worker, to
+    #   scan the text extracted from the page (here, so the parsing is off the fetching threads too)
+    scan_start = time.perf_counter()
+    matcher = _matchers[matcher_fingerprint]
+    hits = []
+    neg = []
+    seen = set()
+
+    text = body.decode('utf-8', errors='replace')
+    if regions is None:
+        lines = io.StringIO(text)
+    else:
+        lines = extract_lines([text], regions)
+    for line in lines:
+        hashed = line_hash(line)
+        if hashed in seen:
+            continue
+        seen.add(hashed)
+        found_keywords, found_neg = matcher.scan(line)
+        if found_keywords:
+            hits.append((hashed, block_key(line), tuple(found_keywords)))
+        if found_neg:
+            neg.append(hashed)
+
+    return hits, neg, time.perf_counter() - scan_start
+
+class ScanError(OSError):
+    # A scanning process died before it finished the scan.
+    pass
+
+class ScanPool():
+    # Processes started with "spawn", so they don't inherit the pool's threads / sockets / sqlite connection.
+    def __init__(self, processes, matchers):
+        self.processes = processes
+        self._executor = None
+        self._fingerprints = set()
+        self._keyword_lists = []
+        self._lock = threading.Lock()
+        # ^ for replacing a broken executor, which the fetching threads may all find at once
+        self.update(matchers)
+
+    def update(self, matchers):
+        # ^ called with the matchers in use whenever they may have changed; restarts the processes only if some
+        #   matcher isn't one they compiled
+        fingerprints = set(matcher.fingerprint for matcher in matchers)
+        if self._executor is not None and fingerprints <= self._fingerprints:
+            return
+
+        self.shutdown()
+        self._keyword_lists = []
+        listed = set()
+        for matcher in matchers:
+            if matcher.fingerprint not in listed:
+                listed.add(matcher.fingerprint)
+                self._keyword_lists.append(list(matcher.keywords))
+        self._executor = self.start()
+        self._fingerprints = fingerprints
+
+    def start(self):
+        return concurrent.futures.ProcessPoolExecutor(max_workers=self.processes,
+                                                      mp_context=multiprocessing.get_context("spawn"),
+                                                      initializer=initialize, initargs=(self._keyword_lists,))
+
+    def restart(self, broken):
+        # ^ replaces the executor broken by a process dying, unless another thread has already
+        with self._lock:
+            if self._executor is broken:
+                broken.shutdown(False, cancel_futures=True)
+                self._executor = self.start()
+
+    def scan(self, matcher, body, regions=None, cancel=None):
+        # ^ blocks the calling (fetching) thread until a process has scanned body, for at most SCAN_TIMEOUT (or until
+        #   cancel is cancelled, raising Cancelled)
+        executor = self._executor
+        try:
+            future = executor.submit(scan_body, matcher.fingerprint, body, regions)
+            if cancel is None:
+                return future.result(SCAN_TIMEOUT)
+            future.add_done_callback(lambda done: cancel.notify())
+            cancel.wait(SCAN_TIMEOUT, future.done)
+            if not future.done():
+                future.cancel()
+                if cancel.cancelled():
+                    raise Cancelled()
+                raise TimeoutError("scan took longer than " + str(SCAN_TIMEOUT) + " seconds")
+            return future.result()
+        except concurrent.futures.process.BrokenProcessPool as error:
+            self.restart(executor)
+            raise ScanError("a scanning process died: " + str(error)) from error
+
+    def shutdown(self, wait=True):
+        # ^ wait: for a scan that's under way to finish (any not yet started are dropped either way)
+        if self._executor is not None:
+            self._executor.shutdown(wait, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,122 @@
+# MDP Incident Monitor App
+
+"""Scheduler for pool.py: a heap of when each url is next due, with the pool thread sleeping on the monitor's
+cancel.CancelToken until the earliest one (or the end of the monitoring duration). Stopping the monitor cancels the
+token, so a sleeping pool wakes up right away instead of at the end of its interval.
+
+Given a ceiling, it's adaptive: a url that comes back unchanged (with no open incident) is checked BACKOFF times less
+often each time, up to the ceiling; as soon as it changes or has an incident it's back to its own frequency.
+"""
+
+import heapq
+import random
+import time
+
+from cancel import CancelToken
+
+BACKOFF = 1.5
+
+class MonitorScheduler():
+    def __init__(self, frequencies, jitter=0, duration=None, ceiling=None, cancel=None):
+        # ^ frequencies in seconds, one per url (the most often each is checked); jitter as a fraction of the
+        #   frequency (0.1 = +/- 10%); duration in seconds, or None to run until stopped; ceiling: seconds, the least
+        #   often an unchanged url is checked when adaptive (None to always use the frequencies); cancel: the
+        #   monitor's CancelToken
+        self.cancel = cancel
+        if self.cancel is None:
+            self.cancel = CancelToken()
+        self.frequencies = list(frequencies)
+        self.jitter = jitter
+        self.ceiling = ceiling
+        self.streaks = [0] * len(self.frequencies)
+        # ^ per url, how many checks in a row it's been unchanged (only counted when adaptive)
+        self.start_time = time.monotonic()
+        self.end_time = None
+        if duration:
+            self.end_time = self.start_time + duration
+        self._heap = []
+
+        for url_count in range(len(self.frequencies)):
+            heapq.heappush(self._heap, (self.start_time, url_count))
+
+    def wait_for_due(self, timeout=None):
+        # ^ blocks until at least one url is due, then returns the due url indexes (in url order); returns [] once
+        #   the monitor is stopped or the duration has run out, or None if timeout (seconds) passes first
+        deadline = None
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        while not self.cancel.cancelled():
+            now = time.monotonic()
+            if self.expired(now) or not self._heap:
+                return []
+
+            next_time = self._heap[0][0]
+            if next_time <= now:
+                due = []
+                while self._heap and self._heap[0][0] <= now:
+                    due.append(heapq.heappop(self._heap)[1])
+                return sorted(due)
+
+            if deadline is not None:
+                if now >= deadline:
+                    return None
+                next_time = min(next_time, deadline)
+            if self.end_time is not None:
+                next_time = min(next_time, self.end_time)
+            self.cancel.wait(next_time - now)
+
+        return []
+
+    def reschedule(self, url_count, active=True):
+        # ^ active: the url changed, or has an incident open; if not, and adaptive, it's left longer next time
+        if active:
+            self.streaks[url_count] = 0
+        elif self.ceiling and self.interval(url_count) < self.ceiling:
+            self.streaks[url_count] = self.streaks[url_count] + 1
+
+        interval = self.interval(url_count)
+        if self.jitter:
+            interval = interval + random.uniform(-self.jitter, self.jitter) * interval
+        heapq.heappush(self._heap, (time.monotonic() + max(interval, 0), url_count))
+
+    def interval(self, url_count):
+        # ^ seconds until the url's next check, before jitter
+        interval = self.frequencies[url_count]
+        if self.ceiling and self.streaks[url_count]:
+            interval = max(min(interval * BACKOFF ** self.streaks[url_count], self.ceiling), interval)
+        return interval
+
+    def replace_urls(self, frequencies, prev_indexes):
+        # ^ for a reloaded config, between cycles: prev_indexes[url_count] is where the url was in the old list (None
+        #   if it's new); old urls keep their next check (brought forward if their frequency went down), new ones are
+        #   due now and ones no longer there are dropped
+        now = time.monotonic()
+        next_times = {}
+        for next_time, url_count in self._heap:
+            next_times[url_count] = next_time
+
+        prev_streaks = self.streaks
+        self.frequencies = list(frequencies)
+        self.streaks = [0] * len(self.frequencies)
+        self._heap = []
+        for url_count in range(len(self.frequencies)):
+            next_time = now
+            prev_count = prev_indexes[url_count]
+            if prev_count in next_times:
+                self.streaks[url_count] = prev_streaks[prev_count]
+                next_time = min(next_times[prev_count], now + self.interval(url_count))
+            self._heap.append((next_time, url_count))
+        heapq.heapify(self._heap)
+
+    def next_due_in(self):
+        # ^ seconds until the next url is due
+        if not self._heap:
+            return 0
+        return max(self._heap[0][0] - time.monotonic(), 0)
+
+    def expired(self, now=None):
+        if self.end_time is None:
+            return False
+        if now is None:
+            now = time.monotonic()
+        return now >= self.end_time
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# MDP Incident Monitor App
+
+"""What the monitor knows about each url, kept in a SQLite database (state.db) so it survives a restart: the
+validators and digest of the last body, the page snapshot pool.py diffs against, the incidents open at each url
+(see incidents.py), the last result per url and the history of incidents. With it loaded, a restarted monitor
+carries on where it left off: unchanged pages aren't scanned again and incidents already reported aren't reported
+(or emailed) again.
+
+The database is in WAL mode; the pool writes to it from its own thread, committing once per cycle, and other
+processes can read it meanwhile. From this directory:
+  python3 -m state [--db PATH] [--url URL] [--since YYYY-MM-DD] [--limit N]     # incident history
+  python3 -m state --results                                                   # last result per url
+  python3 -m state --open                                                      # incidents not yet cleared
+"""
+
+import argparse
+import datetime
+import os
+import sqlite3
+import sys
+
+_PATH = os.path.dirname(os.path.realpath(__file__))
+STATE_PATH = os.path.join(_PATH, "state.db")
+HISTORY_LIMIT = 50
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS url_state (
+    url TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    digest TEXT,
+    fingerprint TEXT,
+    lines BLOB,
+    hits TEXT,
+    neg BLOB,
+    updated REAL
+);
+CREATE TABLE IF NOT EXISTS results (
+    url TEXT PRIMARY KEY,
+    checked REAL,
+    action TEXT,
+    keywords TEXT
+);
+CREATE TABLE IF NOT EXISTS incidents (
+    id INTEGER PRIMARY KEY,
+    url TEXT,
+    time REAL,
+    action TEXT,
+    keywords TEXT
+);
+CREATE INDEX IF NOT EXISTS incidents_url_time ON incidents (url, time);
+CREATE TABLE IF NOT EXISTS open_incidents (
+    url TEXT,
+    fingerprint TEXT,
+    keyword TEXT,
+    first_seen REAL,
+    PRIMARY KEY (url, fingerprint)
+);
+"""
+
+class StateStore():
+    # Writes go into an open transaction until commit(), so a cycle's worth of them costs one fsync.
+    def __init__(self, path=STATE_PATH):
+        self.path = path
+        # made on the UI / main thread, used from the pool's (one at a time)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(_SCHEMA)
+        self.connection.commit()
+
+    def load_url_state(self, url):
+        # ^ returns dict(etag, last_modified, digest, fingerprint, lines, hits, neg), or None if url isn't known
+        cursor = self.connection.execute("SELECT etag, last_modified, digest, fingerprint, lines, hits, neg "
+                                         "FROM url_state WHERE url = ?", (url,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip(["etag", "last_modified", "digest", "fingerprint", "lines", "hits", "neg"], row))
+
+    def save_url_state(self, url, etag, last_modified, digest, when, snapshot=None, fingerprint=None):
+        # ^ snapshot: dict(fingerprint, lines, hits, neg); None leaves the stored one as it was; fingerprint: what
+        #   the page was scanned with (snapshot's, if there is one)
+        self.connection.execute("INSERT INTO url_state (url, etag, last_modified, digest, fingerprint, updated) "
+                                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (url) DO UPDATE SET etag = excluded.etag, "
+                                "last_modified = excluded.last_modified, digest = excluded.digest, "
+                                "fingerprint = excluded.fingerprint, updated = excluded.updated",
+                                (url, etag, last_modified, digest, fingerprint, when))
+        if snapshot is not None:
+            self.connection.execute("UPDATE url_state SET fingerprint = ?, lines = ?, hits = ?, neg = ? "
+                                    "WHERE url = ?", (snapshot["fingerprint"], snapshot["lines"], snapshot["hits"],
+                                                      snapshot["neg"], url))
+
+    def load_open_incidents(self, url):
+        # ^ (fingerprint, keyword, first_seen) of each incident still open at url
+        return self.connection.execute("SELECT fingerprint, keyword, first_seen FROM open_incidents WHERE url = ?",
+                                       (url,)).fetchall()
+
+    def save_open_incidents(self, url, incidents):
+        # ^ replaces url's open incidents with incidents, as (fingerprint, keyword, first_seen)
+        self.connection.execute("DELETE FROM open_incidents WHERE url = ?", (url,))
+        self.connection.executemany("INSERT INTO open_incidents (url, fingerprint, keyword, first_seen) "
+                                    "VALUES (?, ?, ?, ?)", [(url,) + tuple(incident) for incident in incidents])
+
+    def save_result(self, url, when, action, keywords=""):
+        self.connection.execute("INSERT OR REPLACE INTO results (url, checked, action, keywords) VALUES (?, ?, ?, ?)",
+                                (url, when, action, keywords))
+
+    def add_incident(self, url, when, action, keywords):
+        self.connection.execute("INSERT INTO incidents (url, time, action, keywords) VALUES (?, ?, ?, ?)",
+                                (url, when, action, keywords))
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def incidents(self, url=None, since=None, limit=HISTORY_LIMIT):
+        # ^ most recent first, as (url, time, action, keywords); since: a time.time() value
+        query = "SELECT url, time, action, keywords FROM incidents"
+        conditions = []
+        parameters = []
+        if url is not None:
+            conditions.append("url = ?")
+            parameters.append(url)
+        if since is not None:
+            conditions.append("time >= ?")
+            parameters.append(since)
+        if conditions:
+            query = query + " WHERE " + " AND ".join(conditions)
+        query = query + " ORDER BY time DESC, id DESC"
+        if limit:
+            query = query + " LIMIT ?"
+            parameters.append(limit)
+        return self.connection.execute(query, parameters).fetchall()
+
+    def open_incidents(self):
+        # ^ every open incident, as (url, first_seen, keyword), oldest first
+        return self.connection.execute("SELECT url, first_seen, keyword FROM open_incidents "
+                                       "ORDER BY first_seen, url").fetchall()
+
+    def results(self):
+        # ^ the last result for each url, as (url, checked, action, keywords)
+        return self.connection.execute("SELECT url, checked, action, keywords FROM results ORDER BY url").fetchall()
+
+def format_time(when):
+    return str(datetime.datetime.fromtimestamp(when).replace(microsecond=0))
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="state", description="MDP monitor state / incident history.")
+    parser.add_argument("--db", default=STATE_PATH, help="state database (default: state.db)")
+    parser.add_argument("--url", default=None, help="only this url's incidents")
+    parser.add_argument("--since", default=None, help="only incidents since this date (YYYY-MM-DD)")
+    parser.add_argument("--limit", type=int, default=HISTORY_LIMIT, help="at most this many (0 for all)")
+    parser.add_argument("--results", action="store_true", help="show the last result per url instead")
+    parser.add_argument("--open", action="store_true", help="show the incidents still open instead")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not os.path.exists(args.db):
+        print("no state database at " + args.db, file=sys.stderr)
+        return 1
+    store = StateStore(args.db)
+
+    if args.open:
+        for url, first_seen, keyword in store.open_incidents():
+            print("since " + format_time(first_seen) + "  " + url + "  (" + keyword + ")")
+    elif args.results:
+        for url, checked, action, keywords in store.results():
+            line = format_time(checked) + "  " + action + "  " + url
+            if keywords:
+                line = line + "  (" + keywords + ")"
+            print(line)
+    else:
+        since = None
+        if args.since:
+            since = datetime.datetime.strptime(args.since, "%Y-%m-%d").timestamp()
+        for url, when, action, keywords in store.incidents(args.url, since, args.limit):
+            print(format_time(when) + "  " + action + "  " + url + "  (" + keywords + ")")
+
+    store.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,10 @@
+# MDP Incident Monitor App
+
+"""The modules are imported as the app does, from their directory, so it goes on the path. From the 1.1 directory:
+  python3 -m pytest tests
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
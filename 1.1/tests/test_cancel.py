@@ -0,0 +1,43 @@
+# MDP Incident Monitor App
+
+import threading
+import time
+
+import pytest
+
+from cancel import CancelToken, Cancelled
+
+def test_deadline_expires():
+    token = CancelToken(0.05)
+    fired = threading.Event()
+    token.on_cancel(fired.set)
+    assert not token.cancelled()
+    assert 0 < token.timeout(10) <= 0.05
+    # fired by the token's timer, without anything polling it
+    assert fired.wait(2)
+    assert token.cancelled()
+    assert token.remaining() == 0
+    with pytest.raises(Cancelled):
+        token.timeout(10)
+
+def test_wait_ends_at_deadline():
+    token = CancelToken(0.05)
+    start = time.monotonic()
+    assert token.wait(5)
+    assert time.monotonic() - start < 1
+
+def test_child_keeps_sooner_deadline():
+    parent = CancelToken(0.05)
+    child = parent.child(60)
+    assert child.remaining() <= 0.05
+    assert child.wait(5)
+    assert child.cancelled()
+
+def test_parent_cancels_child():
+    parent = CancelToken()
+    child = parent.child()
+    assert child.remaining() is None
+    parent.cancel()
+    assert child.cancelled()
+    # a child made once the parent is cancelled starts out cancelled
+    assert parent.child().cancelled()
@@ -0,0 +1,27 @@
+# MDP Incident Monitor App
+
+import pytest
+
+import config
+
+def settings(**lines):
+    result = config.new_settings()
+    result.update(lines)
+    return result
+
+def test_email_defaults():
+    assert config.compile_config(settings()).email == config.DEFAULT_EMAIL
+
+def test_email_settings():
+    email = config.compile_config(settings(smtp_host="localhost:1025", smtp_tls="False", digest_window="300")).email
+    assert email == config.EmailSettings("localhost", 1025, False, 300)
+
+def test_smtp_host_without_port():
+    assert config.parse_email(settings(smtp_host="mail.example.com")) == config.EmailSettings(
+        "mail.example.com", config.DEFAULT_EMAIL.port, True, config.DEFAULT_EMAIL.digest_window)
+
+@pytest.mark.parametrize("lines", [dict(smtp_host="localhost:smtp"), dict(digest_window="soon"),
+                                   dict(digest_window="-1")])
+def test_bad_email_settings(lines):
+    with pytest.raises(ValueError):
+        config.parse_email(settings(**lines))
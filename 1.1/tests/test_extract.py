@@ -0,0 +1,50 @@
+# MDP Incident Monitor App
+
+import pytest
+
+from extract import extract_lines, parse_regions
+
+PAGE = """<html><head><title>Road conditions</title><style>.closed { color: red }</style>
+<script>var college = "College Ave";</script></head>
+<body><nav><a href="/college">Home</a></nav>
+<div id="incidents"><p>SR 243 IS CLOSED<br>at Pine Cove</p><ul><li>chains required<li>I-10 &amp; SR 74</ul></div>
+<!-- start -->Updated 9 am<!-- end -->
+<footer>Contact us</footer></body></html>
+"""
+
+def extract(page, regions=(), chunk_size=None):
+    if chunk_size is None:
+        return list(extract_lines([page], regions))
+    return list(extract_lines([page[start:start + chunk_size] for start in range(0, len(page), chunk_size)],
+                              regions))
+
+def test_visible_text_only():
+    lines = extract(PAGE)
+    assert lines == ["Road conditions\n", "Home\n", "SR 243 IS CLOSED\n", "at Pine Cove\n", "chains required\n",
+                     "I-10 & SR 74\n", "Updated 9 am\n", "Contact us\n"]
+    assert not any("college" in line.lower() or "color" in line for line in lines)
+
+def test_id_region():
+    assert extract(PAGE, parse_regions("#incidents")) == ["SR 243 IS CLOSED\n", "at Pine Cove\n",
+                                                          "chains required\n", "I-10 & SR 74\n"]
+
+def test_marker_region():
+    assert extract(PAGE, parse_regions("start..end")) == ["Updated 9 am\n"]
+
+def test_several_regions():
+    assert extract(PAGE, parse_regions("start..end, #incidents"))[-1] == "Updated 9 am\n"
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64])
+def test_chunked_the_same(chunk_size):
+    assert extract(PAGE, chunk_size=chunk_size) == extract(PAGE)
+    assert extract(PAGE, parse_regions("#incidents"), chunk_size) == extract(PAGE, parse_regions("#incidents"))
+
+def test_nested_elements_in_id_region():
+    page = '<div id="a"><div>one</div><div>two</div></div><div>three</div>'
+    assert extract(page, parse_regions("#a")) == ["one\n", "two\n"]
+
+def test_parse_regions():
+    assert parse_regions("#incidents, start .. end, ") == (("id", "incidents"), ("marker", "start", "end"))
+    assert parse_regions("") == ()
+    with pytest.raises(ValueError):
+        parse_regions("incidents")
@@ -0,0 +1,107 @@
+# MDP Incident Monitor App
+
+import gzip
+import http.server
+import threading
+import zlib
+
+import pytest
+
+from fetch import DecodeError, Fetcher
+
+PAGE = b"SR 243 IS CLOSED\n" * 1000
+
+def raw_deflate(data):
+    compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+RESPONSES = {
+    "/plain": (200, [], PAGE),
+    "/gzip": (200, [("Content-Encoding", "gzip")], gzip.compress(PAGE)),
+    "/bad-gzip": (200, [("Content-Encoding", "gzip")], b"\x1f\x8b\x08\x00not really gzip at all"),
+    "/cut-gzip": (200, [("Content-Encoding", "gzip")], gzip.compress(PAGE)[:-10]),
+    "/deflate": (200, [("Content-Encoding", "deflate")], zlib.compress(PAGE)),
+    "/raw-deflate": (200, [("Content-Encoding", "deflate")], raw_deflate(PAGE)),
+    "/redirect": (302, [("Location", "/gzip")], b""),
+}
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path == "/etag":
+            if self.headers.get("If-None-Match") == '"v1"':
+                self.send_response(304)
+                self.send_header("ETag", '"v1"')
+                self.end_headers()
+                return
+            status, headers, body = 200, [("ETag", '"v1"')], PAGE
+        else:
+            status, headers, body = RESPONSES[self.path]
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture(scope="module")
+def server():
+    http_server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=http_server.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:" + str(http_server.server_address[1])
+    http_server.shutdown()
+    http_server.server_close()
+
+@pytest.fixture
+def fetcher():
+    fetcher = Fetcher()
+    yield fetcher
+    fetcher.close()
+
+@pytest.mark.parametrize("path", ["/plain", "/gzip", "/deflate", "/raw-deflate", "/redirect"])
+def test_body(server, fetcher, path):
+    with fetcher.fetch(server + path) as response:
+        assert response.status == 200
+        assert response.read() == PAGE
+
+def test_read_in_chunks(server, fetcher):
+    with fetcher.fetch(server + "/gzip") as response:
+        chunks = []
+        while True:
+            chunk = response.read(1000)
+            if not chunk:
+                break
+            assert len(chunk) <= 1000
+            chunks.append(chunk)
+    assert b"".join(chunks) == PAGE
+
+@pytest.mark.parametrize("path", ["/bad-gzip", "/cut-gzip"])
+def test_bad_body_is_an_oserror(server, fetcher, path):
+    with fetcher.fetch(server + path) as response:
+        with pytest.raises(DecodeError):
+            response.read()
+    assert issubclass(DecodeError, OSError)
+    # the connection isn't reused half read; the next fetch is fine
+    with fetcher.fetch(server + "/gzip") as response:
+        assert response.read() == PAGE
+
+def test_not_modified(server, fetcher):
+    with fetcher.fetch(server + "/etag") as response:
+        assert response.read() == PAGE
+        etag = response.headers.get("ETag")
+    with fetcher.fetch(server + "/etag", {"If-None-Match": etag}) as response:
+        assert response.status == 304
+        assert response.read() == b""
+
+def test_connection_reused(server, fetcher):
+    with fetcher.fetch(server + "/plain") as response:
+        response.read()
+        assert not response.reused
+    with fetcher.fetch(server + "/plain") as response:
+        response.read()
+        assert response.reused
@@ -0,0 +1,46 @@
+# MDP Incident Monitor App
+
+from incidents import Incident, IncidentIndex, block_key, fingerprint
+
+CLOSED = fingerprint(block_key("SR 243 IS CLOSED at mile 12"), "CLOSED")
+CHAINS = fingerprint(block_key("chains required"), "chains")
+
+def test_new_ongoing_cleared():
+    index, new, ongoing, cleared = IncidentIndex().update({CLOSED: "CLOSED"}, 100)
+    assert [incident.keyword for incident in new] == ["CLOSED"]
+    assert ongoing == [] and cleared == []
+
+    index, new, ongoing, cleared = index.update({CLOSED: "CLOSED", CHAINS: "chains"}, 200)
+    assert [incident.keyword for incident in new] == ["chains"]
+    assert [incident.keyword for incident in ongoing] == ["CLOSED"]
+    assert ongoing[0].first_seen == 100
+    assert cleared == []
+
+    index, new, ongoing, cleared = index.update({CHAINS: "chains"}, 300)
+    assert new == []
+    assert [incident.keyword for incident in ongoing] == ["chains"]
+    assert [incident.keyword for incident in cleared] == ["CLOSED"]
+    assert list(index.open) == [CHAINS]
+
+def test_update_leaves_index_alone():
+    index = IncidentIndex([Incident(CLOSED, "CLOSED", 100)])
+    next_index, new, ongoing, cleared = index.update({}, 200)
+    assert list(index.open) == [CLOSED]
+    assert next_index.open == {}
+    assert [incident.keyword for incident in cleared] == ["CLOSED"]
+
+def test_incomplete_page_clears_nothing():
+    index = IncidentIndex([Incident(CLOSED, "CLOSED", 100)])
+    next_index, new, ongoing, cleared = index.update({CHAINS: "chains"}, 200, complete=False)
+    assert cleared == []
+    assert set(next_index.open) == {CLOSED, CHAINS}
+    assert [incident.keyword for incident in ongoing] == ["CLOSED"]
+
+def test_fingerprint_ignores_case_spacing_and_digits():
+    assert block_key("SR 243 IS CLOSED at mile 12") == block_key("sr  244 is closed AT MILE 7\n")
+    assert block_key("SR 243 IS CLOSED") != block_key("SR 243 IS OPEN")
+    assert fingerprint(block_key("SR 243 IS CLOSED"), "CLOSED") != fingerprint(block_key("SR 243 IS CLOSED"), "SR")
+
+def test_keywords_in_order_without_repeats():
+    incidents = [Incident("1", "chains", 0), Incident("2", "CLOSED", 0), Incident("3", "chains", 0)]
+    assert IncidentIndex.keywords(incidents) == ["chains", "CLOSED"]
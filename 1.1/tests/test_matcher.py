@@ -0,0 +1,57 @@
+# MDP Incident Monitor App
+
+import re
+
+import pytest
+
+from matcher import KeywordMatcher
+
+KEYWORDS = ["Palm", "Palm Canyon", "Canyon Dr", "canyon", "SR 2[0-9]+", "I-10 (east|west)bound", "a.b", "Hwy",
+            "highway 74", "Straße", "İdyllwild", "^NO TRAFFIC RESTRICTIONS", "^all clear", "^Palm Desert"]
+
+LINES = ["", "nothing to see here\n", "PALM CANYON DR closed\n", "palm canyon dr", "Palm Desert is fine",
+         "SR 243 IS CLOSED", "sr 74 open", "I-10 EASTBOUND lanes", "I-10 northbound", "axb and a.b", "ab",
+         "Hwy 74 / HIGHWAY 74", "STRASSE", "straße gesperrt", "STRAẞE", "İdyllwild", "i̇dyllwild", "idyllwild",
+         "No traffic restrictions are reported for this area.", "ALL CLEAR", "all clearly", "PalmPalm Canyon"]
+
+def baseline(keywords, line):
+    # ^ what scanning used to do, a regex search per keyword; negative keywords (^text) are plain text
+    pos = [keyword for keyword in keywords if not keyword.startswith("^")]
+    found = [keyword for keyword in dict.fromkeys(pos) if re.search(keyword, line, re.IGNORECASE)]
+    neg = any(keyword[1:].lower() in line.lower() for keyword in keywords if keyword.startswith("^") and keyword[1:])
+    return found, neg
+
+@pytest.mark.parametrize("line", LINES)
+def test_same_as_baseline(line):
+    assert KeywordMatcher(KEYWORDS).scan(line) == baseline(KEYWORDS, line)
+
+def test_overlapping_keywords_all_found():
+    found, neg = KeywordMatcher(["Palm Canyon", "Canyon Dr", "Palm"]).scan("Palm Canyon Dr")
+    assert found == ["Palm Canyon", "Canyon Dr", "Palm"]
+    assert not neg
+
+def test_settings_order_and_duplicates():
+    matcher = KeywordMatcher(["closed", "chains", "closed"])
+    assert matcher.pos_keywords == ["closed", "chains"]
+    assert matcher.scan("CHAINS required, road CLOSED") == (["closed", "chains"], False)
+
+def test_negative_keyword_is_plain_text():
+    matcher = KeywordMatcher(["^a.b"])
+    assert matcher.scan("a.b") == ([], True)
+    assert matcher.scan("axb") == ([], False)
+
+def test_negative_keyword_prefix_of_positive():
+    matcher = KeywordMatcher(["closed road", "^closed"])
+    assert matcher.scan("Closed road ahead") == (["closed road"], True)
+    assert matcher.scan("closed") == ([], True)
+
+def test_empty_keyword_matches_every_line():
+    assert KeywordMatcher(["", "snow"]).scan("anything") == ([""], False)
+
+def test_no_keywords():
+    assert KeywordMatcher([]).scan("SR 243 IS CLOSED") == ([], False)
+    assert KeywordMatcher(["^"]).scan("^") == ([], False)
+
+def test_fingerprint_follows_keywords():
+    assert KeywordMatcher(["a", "b"]).fingerprint == KeywordMatcher(["a", "b"]).fingerprint
+    assert KeywordMatcher(["a", "b"]).fingerprint != KeywordMatcher(["b", "a"]).fingerprint
@@ -0,0 +1,78 @@
+# MDP Incident Monitor App
+
+import pytest
+
+import messenger
+from messenger import Messenger
+
+@pytest.fixture(autouse=True)
+def empty_queue():
+    Messenger.configure()
+    Messenger.clear_queue()
+    yield
+    Messenger.configure()
+    Messenger.clear_queue()
+
+def queue(info, action):
+    return Messenger(None).queue_message(info, action)
+
+def texts(messages):
+    return [Messenger(message).get_text() for message in messages]
+
+def test_repeats_fold_while_waiting():
+    for count in range(3):
+        queue("http://a/", "no change")
+    assert texts(Messenger.get_messages(10)) == ["No changes to http://a/ (3 times)"]
+
+def test_repeats_fold_across_drains():
+    queue("http://a/", "no change")
+    assert texts(Messenger.get_messages(10)) == ["No changes to http://a/"]
+    for count in range(4):
+        queue("http://a/", "no change")
+        assert Messenger.get_messages(10) == []
+    queue(["CLOSED", "http://a/"], "new incident")
+    assert texts(Messenger.get_messages(10)) == ["No changes to http://a/ (4 times)",
+                                                 "New incident at http://a/ (found keyword: CLOSED)"]
+
+def test_held_repeats_are_queued_at_the_limit():
+    queue("http://a/", "no change")
+    Messenger.get_messages(10)
+    for count in range(messenger.FOLD_LIMIT):
+        queue("http://a/", "no change")
+    assert texts(Messenger.get_messages(10)) == ["No changes to http://a/ (" + str(messenger.FOLD_LIMIT) + " times)"]
+
+def test_finished_releases_held_repeats():
+    queue("http://a/", "no change")
+    Messenger.get_messages(10)
+    queue("http://a/", "no change")
+    queue(None, "finished")
+    assert texts(Messenger.get_messages(10)) == ["No changes to http://a/", "Done monitoring."]
+
+def test_pool_messages_keep_their_order():
+    queue("http://a/", "no change")
+    queue(300, "sleeping")
+    queue("http://a/", "no change")
+    queue(["CLOSED", "http://a/"], "new incident")
+    queue(300, "sleeping")
+    assert [message[1] for message in Messenger.get_messages(10)] == ["no change", "sleeping", "new incident",
+                                                                      "sleeping"]
+
+def test_urls_fold_separately():
+    queue("http://a/", "no change")
+    queue("http://b/", "no change")
+    queue("http://a/", "no change")
+    assert texts(Messenger.get_messages(10)) == ["No changes to http://a/ (2 times)", "No changes to http://b/"]
+
+def test_drop_oldest_keeps_incidents():
+    Messenger.configure(2, "drop-oldest")
+    queue(["CLOSED", "http://a/"], "new incident")
+    queue("http://b/", "no change")
+    queue("http://c/", "no change")
+    queue("http://d/", "no change")
+    assert [message[1] for message in Messenger.get_messages(10)] == ["new incident", "no change"]
+    assert Messenger.take_dropped() == 2
+
+@pytest.mark.parametrize("seconds, text", [(0.26, "0.3 seconds"), (1, "1 second"), (45.4, "45 seconds"),
+                                           (60, "1 minute"), (90, "1.5 minutes"), (300, "5 minutes")])
+def test_sleeping_text(seconds, text):
+    assert Messenger([seconds, "sleeping"]).get_text() == "Sleeping for " + text + "..."
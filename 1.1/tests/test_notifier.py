@@ -0,0 +1,133 @@
+# MDP Incident Monitor App
+
+import email
+import socketserver
+import threading
+import time
+
+import pytest
+
+from messenger import Messenger
+from notifier import Notifier
+
+class SmtpSink(socketserver.ThreadingTCPServer):
+    # Just enough of an SMTP server (no TLS, no auth) to take the notifier's emails and keep them; smtpd is gone
+    # from the standard library (3.12). drop_after: messages after which it hangs up on the client, as a server
+    # dropping an idle connection would.
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, drop_after=None):
+        socketserver.ThreadingTCPServer.__init__(self, ("127.0.0.1", 0), SmtpHandler)
+        self.drop_after = drop_after
+        self.connections = 0
+        self.messages = []
+        # ^ (recipients, email.message.Message) as received
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def wait_for(self, count, timeout=5):
+        deadline = time.monotonic() + timeout
+        while len(self.messages) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return len(self.messages) >= count
+
+class SmtpHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        sink = self.server
+        with sink.lock:
+            sink.connections = sink.connections + 1
+        self.reply(b"220 sink ready")
+        recipients = []
+        received = 0
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command in (b"EHLO", b"HELO"):
+                self.reply(b"250 sink")
+            elif command == b"MAIL":
+                recipients = []
+                self.reply(b"250 ok")
+            elif command == b"RCPT":
+                recipients.append(line.decode().split(":", 1)[1].strip().strip("<>"))
+                self.reply(b"250 ok")
+            elif command == b"DATA":
+                self.reply(b"354 go ahead")
+                data = []
+                while True:
+                    data_line = self.rfile.readline()
+                    if not data_line or data_line == b".\r\n":
+                        break
+                    data.append(data_line[1:] if data_line.startswith(b"..") else data_line)
+                with sink.lock:
+                    sink.messages.append((recipients, email.message_from_bytes(b"".join(data))))
+                self.reply(b"250 queued")
+                received = received + 1
+                if sink.drop_after is not None and received >= sink.drop_after:
+                    return
+            elif command == b"QUIT":
+                self.reply(b"221 bye")
+                return
+            else:
+                self.reply(b"250 ok")
+
+    def reply(self, text):
+        self.wfile.write(text + b"\r\n")
+
+@pytest.fixture
+def sink():
+    smtp_sink = SmtpSink()
+    yield smtp_sink
+    smtp_sink.stop()
+
+def make_notifier(smtp_sink, digest_window=0):
+    notifier = Notifier("me", "", host="127.0.0.1", port=smtp_sink.server_address[1], use_tls=False,
+                        address="me@example.com", digest_window=digest_window, retry_delay=0.01)
+    notifier.start()
+    return notifier
+
+def test_connection_reused(sink):
+    notifier = make_notifier(sink)
+    for url_count in range(3):
+        notifier.notify("http://a.example/" + str(url_count), "CLOSED")
+        assert sink.wait_for(url_count + 1)
+    notifier.stop(5)
+    assert sink.connections == 1
+    assert notifier.sent == 3
+
+def test_one_digest_per_recipient(sink):
+    notifier = make_notifier(sink, digest_window=0.5)
+    notifier.notify("http://a.example/", "CLOSED")
+    notifier.notify("http://b.example/", "chains", recipient="roads@example.com")
+    notifier.notify("http://c.example/", "CLOSED")
+    notifier.notify("http://a.example/", "CLOSED", "incident cleared", "roads@example.com")
+    assert sink.wait_for(2)
+    notifier.stop(5)
+    assert len(sink.messages) == 2
+    by_recipient = dict((recipients[0], message) for recipients, message in sink.messages)
+    assert by_recipient["me@example.com"]["Subject"] == "2 new incidents"
+    assert by_recipient["roads@example.com"]["Subject"] == "2 incident updates"
+    assert sink.connections == 1
+
+def test_reconnects_after_server_drops_connection():
+    smtp_sink = SmtpSink(drop_after=1)
+    Messenger.clear_queue()
+    try:
+        notifier = make_notifier(smtp_sink)
+        notifier.notify("http://a.example/", "CLOSED")
+        assert smtp_sink.wait_for(1)
+        notifier.notify("http://b.example/", "CLOSED")
+        assert smtp_sink.wait_for(2)
+        notifier.stop(5)
+        assert smtp_sink.connections == 2
+        assert notifier.sent == 2 and notifier.failed == 0
+    finally:
+        smtp_sink.stop()
+        Messenger.clear_queue()
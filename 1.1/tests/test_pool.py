@@ -0,0 +1,122 @@
+# MDP Incident Monitor App
+
+import socket
+import threading
+import time
+
+import pytest
+
+from corpus import ReplayResponse
+from matcher import KeywordMatcher
+from messenger import Messenger
+from pool import MonitorPool
+
+class CountingFetcher():
+    # Answers every url after a pause, keeping track of how many fetches per host were under way at once.
+    def __init__(self, pause=0.05):
+        self.pause = pause
+        self.lock = threading.Lock()
+        self.current = {}
+        self.most = {}
+
+    def fetch(self, url, headers=None, cancel=None):
+        host = url.split("/")[2]
+        with self.lock:
+            self.current[host] = self.current.get(host, 0) + 1
+            self.most[host] = max(self.most.get(host, 0), self.current[host])
+        time.sleep(self.pause)
+        with self.lock:
+            self.current[host] = self.current[host] - 1
+        return ReplayResponse(200, [], b"all clear\n")
+
+def make_pool(urls, max_workers, max_per_host):
+    matchers = [KeywordMatcher(["CLOSED", "^clear"]) for url in urls]
+    pool = MonitorPool(urls, matchers, "", "", "None", 5, max_workers=max_workers, max_per_host=max_per_host)
+    pool.fetcher = CountingFetcher()
+    return pool
+
+def test_per_host_cap():
+    urls = ["http://a.example/" + str(url_count) for url_count in range(6)] + ["http://b.example/"]
+    pool = make_pool(urls, 4, 2)
+    start = time.perf_counter()
+    active = pool.run_cycle(list(range(len(urls))))
+    assert len(active) == len(urls)
+    assert pool.fetcher.most == {"a.example": 2, "b.example": 1}
+    # a.example's six urls two at a time; b.example's alongside them rather than after
+    assert time.perf_counter() - start < 4 * pool.fetcher.pause
+
+def test_busy_host_leaves_threads_for_others():
+    urls = ["http://a.example/" + str(url_count) for url_count in range(4)] + ["http://b.example/"]
+    pool = make_pool(urls, 2, 2)
+    pool.fetcher.pause = 0.1
+    done = {}
+    fetch = pool.fetcher.fetch
+    def timed_fetch(url, headers=None, cancel=None):
+        response = fetch(url, headers, cancel)
+        done[url] = time.perf_counter()
+        return response
+    pool.fetcher.fetch = timed_fetch
+    start = time.perf_counter()
+    pool.run_cycle(list(range(len(urls))))
+    # b.example gets the first thread a.example hands back, not the last
+    assert done["http://b.example/"] - start < 2.5 * pool.fetcher.pause
+
+def test_hosts_fetched_at_once():
+    urls = ["http://" + host + ".example/" for host in "abcd"]
+    pool = make_pool(urls, 4, 1)
+    start = time.perf_counter()
+    pool.run_cycle(list(range(len(urls))))
+    assert time.perf_counter() - start < 2 * pool.fetcher.pause
+
+class FailingFetcher(CountingFetcher):
+    # Something no worker expects goes wrong with one url.
+    def fetch(self, url, headers=None, cancel=None):
+        if url.endswith("/broken"):
+            raise ValueError("unexpected")
+        return CountingFetcher.fetch(self, url, headers, cancel)
+
+def test_unexpected_error_leaves_other_urls():
+    Messenger.clear_queue()
+    urls = ["http://a.example/", "http://a.example/broken", "http://b.example/"]
+    pool = make_pool(urls, 4, 2)
+    pool.fetcher = FailingFetcher(0)
+    active = pool.run_cycle(list(range(len(urls))))
+    assert sorted(active) == [0, 2]
+    messages = [Messenger(message).get_text() for message in Messenger.get_messages(10)]
+    Messenger.clear_queue()
+    assert "couldn't check http://a.example/broken: ValueError('unexpected')" in messages
+
+def test_metrics_port_taken_fails_at_construction():
+    taken = socket.socket()
+    taken.bind(("127.0.0.1", 0))
+    taken.listen()
+    try:
+        with pytest.raises(OSError):
+            MonitorPool(["http://a.example/"], [KeywordMatcher(["CLOSED"])], "", "", "None", 5,
+                        metrics_port=taken.getsockname()[1])
+    finally:
+        taken.close()
+
+def test_stop_during_fetch_returns_nones_quietly():
+    # a server that takes the connection and never answers; the pool's own fetcher waits on it until stopped
+    silent = socket.socket()
+    silent.bind(("127.0.0.1", 0))
+    silent.listen()
+    Messenger.clear_queue()
+    try:
+        url = "http://127.0.0.1:" + str(silent.getsockname()[1]) + "/"
+        pool = MonitorPool([url], [KeywordMatcher(["CLOSED"])], "", "", "None", 5)
+        worker = pool.create_worker(url, pool.matchers[0], None, pool.url_states[pool.keys[0]],
+                                    cancel=pool.cancel.child())
+        results = []
+        thread = threading.Thread(target=lambda: results.append(pool.run_workers([worker])))
+        thread.start()
+        time.sleep(0.2)
+        assert thread.is_alive()
+        pool.stop()
+        thread.join(5)
+        assert results == [[None]]
+        assert [message for message in Messenger.get_messages(10) if message[1] == "error"] == []
+    finally:
+        silent.close()
+        Messenger.clear_queue()
@@ -0,0 +1,35 @@
+# MDP Incident Monitor App
+
+import os
+import signal
+
+import pytest
+
+from matcher import KeywordMatcher
+from scanner import ScanError, ScanPool
+
+PAGE = b"SR 243 IS CLOSED\nall clear elsewhere\n"
+
+@pytest.fixture
+def scan_pool():
+    matcher = KeywordMatcher(["CLOSED", "^NO TRAFFIC RESTRICTIONS"])
+    pool = ScanPool(1, [matcher])
+    yield pool, matcher
+    pool.shutdown()
+
+def test_scan(scan_pool):
+    pool, matcher = scan_pool
+    hits, neg, scan_time = pool.scan(matcher, PAGE)
+    assert [keywords for hashed, key, keywords in hits] == [("CLOSED",)]
+    assert neg == []
+
+@pytest.mark.skipif(not hasattr(signal, "SIGKILL"), reason="needs SIGKILL")
+def test_dead_process_is_replaced(scan_pool):
+    pool, matcher = scan_pool
+    pool.scan(matcher, PAGE)
+    for pid in list(pool._executor._processes):
+        os.kill(pid, signal.SIGKILL)
+    with pytest.raises(ScanError):
+        pool.scan(matcher, PAGE)
+    hits, neg, scan_time = pool.scan(matcher, PAGE)
+    assert [keywords for hashed, key, keywords in hits] == [("CLOSED",)]
@@ -0,0 +1,93 @@
+# MDP Incident Monitor App
+
+import threading
+import time
+
+import pytest
+
+import scheduler
+from cancel import CancelToken
+from scheduler import BACKOFF, MonitorScheduler
+
+class Clock():
+    # Stands in for time.monotonic(), moved on by hand.
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = Clock()
+    monkeypatch.setattr(scheduler, "time", fake)
+    return fake
+
+def test_all_due_at_start(clock):
+    assert MonitorScheduler([60, 300]).wait_for_due(0) == [0, 1]
+
+def test_each_url_at_its_frequency(clock):
+    monitor_scheduler = MonitorScheduler([60, 300])
+    for url_count in monitor_scheduler.wait_for_due(0):
+        monitor_scheduler.reschedule(url_count)
+    assert monitor_scheduler.next_due_in() == 60
+    clock.now = clock.now + 59
+    assert monitor_scheduler.wait_for_due(0) is None
+    clock.now = clock.now + 1
+    assert monitor_scheduler.wait_for_due(0) == [0]
+    monitor_scheduler.reschedule(0)
+    clock.now = clock.now + 240
+    assert monitor_scheduler.wait_for_due(0) == [0, 1]
+
+def test_backoff_up_to_ceiling_and_back(clock):
+    monitor_scheduler = MonitorScheduler([60], ceiling=300)
+    intervals = []
+    for check_count in range(6):
+        monitor_scheduler.reschedule(0, active=False)
+        intervals.append(monitor_scheduler.interval(0))
+    assert intervals[:3] == [60 * BACKOFF, 60 * BACKOFF ** 2, 60 * BACKOFF ** 3]
+    assert intervals[-1] == 300
+    monitor_scheduler.reschedule(0, active=True)
+    assert monitor_scheduler.interval(0) == 60
+
+def test_no_backoff_without_ceiling(clock):
+    monitor_scheduler = MonitorScheduler([60])
+    monitor_scheduler.reschedule(0, active=False)
+    monitor_scheduler.reschedule(0, active=False)
+    assert monitor_scheduler.interval(0) == 60
+
+def test_ceiling_below_frequency(clock):
+    monitor_scheduler = MonitorScheduler([600], ceiling=300)
+    monitor_scheduler.reschedule(0, active=False)
+    assert monitor_scheduler.interval(0) == 600
+
+def test_duration(clock):
+    monitor_scheduler = MonitorScheduler([60], duration=100)
+    monitor_scheduler.reschedule(0)
+    clock.now = clock.now + 100
+    assert monitor_scheduler.expired()
+    assert monitor_scheduler.wait_for_due(0) == []
+
+def test_replace_urls_keeps_next_check_and_backoff(clock):
+    monitor_scheduler = MonitorScheduler([60, 60], ceiling=600)
+    monitor_scheduler.wait_for_due(0)
+    monitor_scheduler.reschedule(0, active=False)
+    monitor_scheduler.reschedule(1)
+    # url 1 dropped, url 0 moved to the end, a new url first
+    monitor_scheduler.replace_urls([30, 60], [None, 0])
+    assert monitor_scheduler.wait_for_due(0) == [0]
+    assert monitor_scheduler.streaks == [0, 1]
+    clock.now = clock.now + 60 * BACKOFF
+    assert monitor_scheduler.wait_for_due(0) == [1]
+
+def test_stop_wakes_waiting_scheduler():
+    cancel = CancelToken()
+    monitor_scheduler = MonitorScheduler([60], cancel=cancel)
+    monitor_scheduler.wait_for_due(0)
+    monitor_scheduler.reschedule(0)
+    timer = threading.Timer(0.05, cancel.cancel)
+    timer.start()
+    start = time.monotonic()
+    assert monitor_scheduler.wait_for_due() == []
+    assert time.monotonic() - start < 5
+    timer.join()
@@ -0,0 +1,69 @@
+# MDP Incident Monitor App
+
+from corpus import ReplayResponse
+from matcher import KeywordMatcher
+from messenger import Messenger
+from pool import MonitorPool
+from state import StateStore
+
+URL = "http://a.example/"
+
+def test_url_state_round_trip(tmp_path):
+    path = str(tmp_path / "state.db")
+    store = StateStore(path)
+    assert store.load_url_state(URL) is None
+    snapshot = dict(fingerprint="f1", lines=b"\x01" * 20, hits='{"ab": ["", "CLOSED"]}', neg=b"\x02" * 16)
+    store.save_url_state(URL, '"v1"', "Sat, 17 Oct 2026 08:00:00 GMT", "d1", 100.0, snapshot, "f1")
+    store.save_open_incidents(URL, [("i1", "CLOSED", 90.0), ("i2", "chains", 95.0)])
+    store.add_incident(URL, 90.0, "new incident", "CLOSED")
+    store.save_result(URL, 100.0, "ongoing", "CLOSED")
+    store.close()
+
+    store = StateStore(path)
+    assert store.load_url_state(URL) == dict(etag='"v1"', last_modified="Sat, 17 Oct 2026 08:00:00 GMT",
+                                             digest="d1", **snapshot)
+    assert sorted(store.load_open_incidents(URL)) == [("i1", "CLOSED", 90.0), ("i2", "chains", 95.0)]
+    assert store.incidents() == [(URL, 90.0, "new incident", "CLOSED")]
+    assert store.results() == [(URL, 100.0, "ongoing", "CLOSED")]
+
+    # no snapshot leaves the stored one as it was
+    store.save_url_state(URL, '"v2"', None, "d2", 110.0)
+    saved = store.load_url_state(URL)
+    assert (saved["etag"], saved["digest"], saved["lines"]) == ('"v2"', "d2", snapshot["lines"])
+    store.save_open_incidents(URL, [])
+    assert store.load_open_incidents(URL) == []
+    store.close()
+
+class PageFetcher():
+    def __init__(self, body):
+        self.body = body
+
+    def fetch(self, url, headers=None, cancel=None):
+        return ReplayResponse(200, [], self.body)
+
+def run_pool(path, body):
+    # ^ one cycle of a pool over state.db at path, the way run() starts one; returns the actions it reported
+    store = StateStore(path)
+    pool = MonitorPool([URL], [KeywordMatcher(["CLOSED"])], "", "", "None", 5, state_store=store)
+    pool.fetcher = PageFetcher(body)
+    for key in pool.keys:
+        pool.url_states[key] = pool.load_url_state(key)
+    Messenger.clear_queue()
+    pool.run_cycle([0])
+    actions = [message[1] for message in Messenger.get_messages(20)]
+    Messenger.clear_queue()
+    store.close()
+    return actions
+
+def test_no_repeat_alert_after_restart(tmp_path):
+    path = str(tmp_path / "state.db")
+    page = b"Highway 1\nCLOSED at Exit 4\n"
+    assert run_pool(path, page) == ["new incident"]
+    # restarted on the same state.db: the page's validators and digest are known, so it isn't scanned again
+    assert run_pool(path, page) == ["no change"]
+    # and when it has changed elsewhere, the closure is still the incident already reported
+    assert run_pool(path, b"Highway 1 (updated 9:00)\nCLOSED at Exit 4\n") == ["ongoing"]
+    store = StateStore(path)
+    assert [incident[2] for incident in store.incidents()] == ["new incident"]
+    assert len(store.open_incidents()) == 1
+    store.close()
@@ -0,0 +1,82 @@
+# MDP Incident Monitor App
+
+import pytest
+
+from corpus import ReplayResponse
+from matcher import KeywordMatcher
+from pool import MonitorWorker, UrlState
+
+PAGE = b"<p>SR 243 IS CLOSED</p>\n<p>chains required</p>\n"
+ETAG = '"v1"'
+
+class StaticFetcher():
+    # A page served with an ETag (changing body and etag changes the page); answers a matching If-None-Match with a
+    # 304.
+    def __init__(self, body=PAGE, etag=ETAG):
+        self.body = body
+        self.etag = etag
+        self.requests = []
+
+    def fetch(self, url, headers=None, cancel=None):
+        headers = headers or {}
+        self.requests.append(headers)
+        if headers.get("If-None-Match") == self.etag:
+            return ReplayResponse(304, [("ETag", self.etag)], None)
+        return ReplayResponse(200, [("ETag", self.etag)], self.body)
+
+def check(fetcher, keywords, state, incremental=True, regions=None):
+    # ^ not streaming, so the whole page is scanned either way
+    worker = MonitorWorker("http://example.com/", KeywordMatcher(keywords), None, state, False, incremental,
+                           fetcher=fetcher, regions=regions)
+    return worker, worker.work()
+
+@pytest.mark.parametrize("incremental", [True, False])
+def test_static_page_is_not_rescanned(incremental):
+    fetcher = StaticFetcher()
+    worker, state = check(fetcher, ["CLOSED"], UrlState(), incremental)
+    assert worker.messages[0][1] == "new incident"
+    worker, state = check(fetcher, ["CLOSED"], state, incremental)
+    assert fetcher.requests[-1] == {"If-None-Match": ETAG}
+    assert worker.messages == [["http://example.com/", "no change"]]
+
+@pytest.mark.parametrize("incremental", [True, False])
+def test_keywords_changed_on_static_page(incremental):
+    fetcher = StaticFetcher()
+    worker, state = check(fetcher, ["CLOSED"], UrlState(), incremental)
+    assert worker.messages[0][0][0] == "CLOSED"
+
+    worker, state = check(fetcher, ["CLOSED", "chains"], state, incremental)
+    assert "If-None-Match" not in fetcher.requests[-1]
+    assert worker.changed
+    assert worker.messages[0][1] == "new incident"
+    assert worker.messages[0][0][0] == "chains"
+
+    # scanned with the new keywords now, so back to conditional requests
+    worker, state = check(fetcher, ["CLOSED", "chains"], state, incremental)
+    assert fetcher.requests[-1] == {"If-None-Match": ETAG}
+    assert worker.messages == [["http://example.com/", "no change"]]
+
+def test_keyword_removed_on_static_page():
+    fetcher = StaticFetcher()
+    worker, state = check(fetcher, ["CLOSED", "chains"], UrlState())
+    worker, state = check(fetcher, ["CLOSED"], state)
+    assert worker.messages[0][1] == "incident cleared"
+    assert worker.messages[0][0][0] == "chains"
+
+def test_regions_changed_on_static_page():
+    fetcher = StaticFetcher(b"<div id='news'>all clear</div>\n<div id='roads'>SR 243 IS CLOSED</div>\n")
+    worker, state = check(fetcher, ["CLOSED", "^clear"], UrlState(), regions=(("id", "news"),))
+    assert worker.messages[0][1] == "no incident"
+    worker, state = check(fetcher, ["CLOSED", "^clear"], state, regions=())
+    assert worker.messages[0][1] == "new incident"
+
+@pytest.mark.parametrize("incremental", [True, False])
+def test_edit_elsewhere_on_page_with_incident(incremental):
+    # a keyword on a line that stays put is still an incident when some other line changes
+    fetcher = StaticFetcher(b"SR 243 IS CLOSED\nupdated 9am\n")
+    worker, state = check(fetcher, ["CLOSED"], UrlState(), incremental)
+    assert worker.messages[0][1] == "new incident"
+    fetcher.body = b"SR 243 IS CLOSED\nupdated 10am\n"
+    fetcher.etag = '"v2"'
+    worker, state = check(fetcher, ["CLOSED"], state, incremental)
+    assert worker.messages == [[["CLOSED", "http://example.com/"], "ongoing"]]